@@ -1,47 +1,212 @@
+import threading
+from typing import Any
+
 from google.adk.agents import Agent
-from google.adk.tools import google_search
+from google.adk.models import BaseLlm, Gemini
+from google.adk.tools import FunctionTool, google_search
 from google.adk.tools.agent_tool import AgentTool
+from google.adk.tools.base_tool import BaseTool
+
+from . import config
+from .tools import get_current_time, get_weather
+from .utils import cassette, context_cache, hedging, history, rate_limit, usage
+from .utils.fake_llm import FakeLlm
+from .utils.instrumentation import InstrumentedLlm, InstrumentedTool
+from .utils.langfuse import LangfuseClient
+from .utils.metrics import stage
+
+usage.configure(
+    store_path=config.USAGE_DB_PATH,
+    flush_interval=float(config.USAGE_FLUSH_INTERVAL),
+    budget_tokens=int(config.USER_TOKEN_BUDGET),
+    budget_window=float(config.TOKEN_BUDGET_WINDOW),
+    budget_action=config.TOKEN_BUDGET_ACTION,
+    downgrade_model=config.TOKEN_BUDGET_DOWNGRADE_MODEL,
+)
+rate_limit.configure(
+    limiter=rate_limit.AdaptiveLimiter(
+        initial=float(config.MODEL_CONCURRENCY_INITIAL),
+        max_limit=float(config.MODEL_CONCURRENCY_MAX),
+        queue_timeout=float(config.MODEL_QUEUE_TIMEOUT),
+    ),
+    retry=rate_limit.RetryPolicy(max_attempts=int(config.MODEL_RETRY_ATTEMPTS)),
+    breaker=rate_limit.CircuitBreaker(
+        failure_threshold=int(config.MODEL_CIRCUIT_THRESHOLD),
+        open_seconds=float(config.MODEL_CIRCUIT_OPEN_SECONDS),
+    ),
+)
+context_cache.configure(
+    ttl=float(config.CONTEXT_CACHE_TTL),
+    renew_before=float(config.CONTEXT_CACHE_RENEW_BEFORE),
+    min_tokens=int(config.CONTEXT_CACHE_MIN_TOKENS),
+)
+
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+
+def _build_model(name: str, prompt_version: str) -> InstrumentedLlm:
+    # USE_FAKE_MODEL=true の場合はGeminiを呼ばずにローカルのフェイクモデルで応答する
+    llm: BaseLlm
+    if config.USE_FAKE_MODEL:
+        llm = FakeLlm(
+            model=name,
+            latency=float(config.FAKE_MODEL_LATENCY),
+            prefill_latency=float(config.FAKE_MODEL_PREFILL_LATENCY),
+        )
+    else:
+        llm = Gemini(model=name)
+        if config.CONTEXT_CACHE_ENABLED:
+            # インストラクションとツール定義はプロンプトバージョンごとにキャッシュして毎回送らない
+            llm = context_cache.ContextCachingLlm(inner=llm, prompt_version=prompt_version)
+    if config.LLM_CASSETTE:
+        # テスト・ベンチマーク用に、モデルの応答をカセットに記録・再生する
+        llm = cassette.CassetteLlm(
+            inner=llm,
+            path=config.LLM_CASSETTE,
+            mode=config.LLM_CASSETTE_MODE,
+            timing=float(config.LLM_CASSETTE_TIMING),
+        )
+    # 計測はリトライや待ち時間も含めた1ターン全体に対して行う
+    return InstrumentedLlm(
+        inner=rate_limit.RateLimitedLlm(inner=llm), prompt_version=prompt_version
+    )
+
+
+def configure_history() -> None:
+    # 要約モデルも _build_model を通すので、import 後に設定を変えた場合は呼び直す
+    if config.HISTORY_COMPACTION_ENABLED:
+        history.configure(
+            summary_model=_build_model(
+                config.HISTORY_SUMMARY_MODEL, "history_summary:v1"
+            ),
+            max_tokens=int(config.HISTORY_MAX_TOKENS),
+            max_events=int(config.HISTORY_MAX_EVENTS),
+            keep_turns=int(config.HISTORY_KEEP_TURNS),
+            tool_result_chars=int(config.HISTORY_TOOL_RESULT_CHARS),
+        )
+
 
-from .tools import get_weather, get_current_time
+configure_history()
 
-def create_agents(langfuse_client):
-    
-    search_instruction, search_prompt_obj = langfuse_client.get_prompt(
-        name="search_agent_instruction",
-        fallback="""
+
+def _root_model_callbacks() -> list:
+    callbacks = [usage.enforce_budget]
+    if config.HISTORY_COMPACTION_ENABLED:
+        # 予算チェックで拒否されなかったリクエストだけ履歴を圧縮する
+        callbacks.append(history.compact_history)
+    return callbacks
+
+
+def _with_deadline(tool: BaseTool) -> BaseTool:
+    # 期限切れはタイムアウトの結果としてモデルに返し、冪等なツールは遅い呼び出しをヘッジする
+    return hedging.wrap(
+        tool,
+        deadlines=hedging.parse_deadlines(config.TOOL_DEADLINES),
+        default=float(config.TOOL_DEFAULT_DEADLINE),
+        hedged=set(config.TOOL_HEDGED),
+    )
+
+
+SEARCH_AGENT_FALLBACK = """
         You are a diligent and exhaustive researcher. Your task is to perform comprehensive web searches and synthesize the results.
         Use the 'google_search' tool to find relevant information and provide a detailed, well-organized summary of your findings.
         Always search for the most current and relevant information available.
         """
-    )    
-    search_agent = Agent(
-        name="search_agent",
-        model="gemini-2.5-flash",
-        instruction=search_instruction,
-        tools=[google_search],
-    )
-    
-    root_instruction, root_prompt_obj = langfuse_client.get_prompt(
-        name="root_agent_instruction",
-        fallback="""You are a helpful AI assistant designed to provide accurate and useful information. 
+
+ROOT_AGENT_FALLBACK = """You are a helpful AI assistant designed to provide accurate and useful information. 
         You can provide weather information and current time for cities using your built-in tools.
         
         For research tasks or when you need to search for information online, use the search_agent tool.
         This tool will perform web searches and provide you with comprehensive information on any topic.
         """
-    )    
+
+
+def fetch_prompts(langfuse_client: LangfuseClient) -> dict[str, tuple[str, Any]]:
+    """Langfuseから最新のプロンプトを取得する。{"root"|"search": (instruction, prompt_obj)}"""
+    with stage("prompt_fetch", target="search_agent_instruction"):
+        search = langfuse_client.get_prompt(
+            name="search_agent_instruction",
+            fallback=SEARCH_AGENT_FALLBACK,
+        )
+    with stage("prompt_fetch", target="root_agent_instruction"):
+        root = langfuse_client.get_prompt(
+            name="root_agent_instruction",
+            fallback=ROOT_AGENT_FALLBACK,
+        )
+    return {"root": root, "search": search}
+
+
+def build_agents(prompts: dict[str, tuple[str, Any]], model: str = DEFAULT_MODEL) -> Agent:
+    search_instruction, search_prompt_obj = prompts["search"]
+    search_agent = Agent(
+        name="search_agent",
+        model=_build_model(
+            DEFAULT_MODEL,
+            usage.prompt_version("search_agent_instruction", search_prompt_obj),
+        ),
+        instruction=search_instruction,
+        tools=[google_search],
+        before_model_callback=usage.enforce_budget,
+    )
+
+    root_instruction, root_prompt_obj = prompts["root"]
     root_agent = Agent(
         name="root_agent",
-        model="gemini-2.5-flash",
+        model=_build_model(
+            model,
+            usage.prompt_version("root_agent_instruction", root_prompt_obj),
+        ),
         instruction=root_instruction,
         # TODO search_agentはツールではなく、sub agentとして動かしたい
-        tools=[get_weather, get_current_time, AgentTool(search_agent)],
+        tools=[
+            InstrumentedTool(_with_deadline(FunctionTool(get_weather))),
+            InstrumentedTool(_with_deadline(FunctionTool(get_current_time))),
+            InstrumentedTool(_with_deadline(AgentTool(search_agent))),
+        ],
+        before_agent_callback=usage.bind_invocation,
+        before_model_callback=_root_model_callbacks(),
     )
-    
+
     # エージェントにプロンプトオブジェクトを添付（後でトレーシングで使用）
     root_agent._langfuse_prompts = {
         "root": root_prompt_obj,
         "search": search_prompt_obj
     }
-    
+
     return root_agent
+
+
+def create_agents(langfuse_client: LangfuseClient, model: str = DEFAULT_MODEL) -> Agent:
+    return build_agents(fetch_prompts(langfuse_client), model=model)
+
+
+class AgentCache:
+    """モデルとプロンプトバージョンごとに組み立て済みのエージェントを使い回す
+
+    プロンプトは毎回取得し、Langfuse側でバージョンが変わったときだけエージェントを作り直す。
+    """
+
+    def __init__(self, langfuse_client: LangfuseClient) -> None:
+        self._langfuse_client = langfuse_client
+        self._agents: dict[tuple[str, str, str], Agent] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str = DEFAULT_MODEL) -> Agent:
+        prompts = fetch_prompts(self._langfuse_client)
+        key = (
+            model,
+            usage.prompt_version("root_agent_instruction", prompts["root"][1]),
+            usage.prompt_version("search_agent_instruction", prompts["search"][1]),
+        )
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is None:
+                # 古いバージョンのエージェントは捨てる
+                self._agents = {k: v for k, v in self._agents.items() if k[1:] == key[1:]}
+                agent = self._agents[key] = build_agents(prompts, model=model)
+            return agent
+
+    def warm(self, models: list[str]) -> None:
+        for model in models:
+            self.get(model)
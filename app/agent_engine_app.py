@@ -15,21 +15,30 @@
 # mypy: disable-error-code="attr-defined,arg-type"
 import copy
 import datetime
+import hashlib
 import json
 import logging
 import os
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
 from typing import Any
 
 import google.auth
 import vertexai
 from google.adk.artifacts import GcsArtifactService
+from google.api_core import exceptions
 from google.cloud import logging as google_cloud_logging
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider, export
 from vertexai import agent_engines
 from vertexai.preview.reasoning_engines import AdkApp
 
-from app.agent import root_agent
+from app import config, root_agent
+from app.utils import metrics, profiling, usage
+from app.utils.artifacts import CachedArtifactService
 from app.utils.gcs import create_bucket_if_not_exists
 from app.utils.tracing import CloudTraceLoggingSpanExporter
 from app.utils.typing import Feedback
@@ -49,6 +58,13 @@ class AgentEngineApp(AdkApp):
         )
         provider.add_span_processor(processor)
         trace.set_tracer_provider(provider)
+        metrics.configure(otel_spans=config.METRICS_OTEL_SPANS)
+        profiling.install(
+            signal_name=config.PROFILE_SIGNAL,
+            on_start=float(config.PROFILE_ON_START),
+            output_dir=config.PROFILE_DIR,
+            upload_bucket=config.PROFILE_UPLOAD_BUCKET,
+        )
 
     def register_feedback(self, feedback: dict[str, Any]) -> None:
         """Collect and log feedback."""
@@ -79,6 +95,108 @@ class AgentEngineApp(AdkApp):
         )
 
 
+def build_artifact_service(
+    bucket_name: str,
+) -> GcsArtifactService | CachedArtifactService:
+    """Builds the artifact service, with a local cache in front of GCS if enabled."""
+    gcs = GcsArtifactService(bucket_name=bucket_name)
+    if not config.ARTIFACT_CACHE_ENABLED:
+        return gcs
+    return CachedArtifactService(
+        gcs,
+        cache_dir=config.ARTIFACT_CACHE_DIR,
+        max_bytes=int(config.ARTIFACT_CACHE_MAX_BYTES),
+        upload_workers=int(config.ARTIFACT_UPLOAD_WORKERS),
+        write_behind=config.ARTIFACT_WRITE_BEHIND,
+    )
+
+
+def _package_files(package: str) -> list[str]:
+    if os.path.isfile(package):
+        return [package]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(package):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+        files += [
+            os.path.join(dirpath, name)
+            for name in sorted(filenames)
+            if not name.endswith(".pyc")
+        ]
+    return files
+
+
+def prompt_versions(agent: Any) -> list[str]:
+    """Versions of the Langfuse prompts fetched at import, which are pickled with the agent."""
+    prompts = getattr(agent, "_langfuse_prompts", {})
+    return [
+        usage.prompt_version("root_agent_instruction", prompts.get("root")),
+        usage.prompt_version("search_agent_instruction", prompts.get("search")),
+    ]
+
+
+def agent_settings() -> dict[str, Any]:
+    """Local settings from app.config, which are baked into the pickled agent at import."""
+    # 秘密情報は指紋に含めない
+    return {
+        name: value
+        for name, value in sorted(vars(config).items())
+        if name.isupper() and not name.endswith(("_TOKEN", "_KEY"))
+    }
+
+
+def fingerprint(
+    extra_packages: list[str],
+    requirements: list[str],
+    env_vars: dict[str, str],
+    prompts: list[str] | None = None,
+    settings: dict[str, Any] | None = None,
+) -> str:
+    """Hashes everything that is uploaded with the agent, to detect no-op deploys."""
+    digest = hashlib.sha256()
+    for package in sorted(extra_packages):
+        for path in _package_files(package):
+            digest.update(Path(path).as_posix().encode() + b"\0")
+            digest.update(hashlib.sha256(Path(path).read_bytes()).digest())
+    digest.update(
+        "\n".join(sorted(r.strip() for r in requirements if r.strip())).encode()
+    )
+    digest.update(json.dumps(env_vars, sort_keys=True).encode())
+    digest.update("\n".join(prompts or []).encode())
+    digest.update(json.dumps(settings or {}, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def load_deployment_metadata(path: str) -> dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+@contextmanager
+def _phase(timings: dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 2)
+        logging.info(f"[deploy] {name}: {timings[name]:.2f}s")
+
+
+def find_agent_engine(
+    agent_name: str | None, resource_name: str | None = None
+) -> agent_engines.AgentEngine | None:
+    """Looks up the deployed agent, by its recorded resource name when known."""
+    if resource_name and resource_name != "None":
+        try:
+            return agent_engines.get(resource_name)
+        except exceptions.NotFound:
+            logging.info(f"Recorded agent {resource_name} no longer exists")
+    existing_agents = list(agent_engines.list(filter=f"display_name={agent_name}"))
+    return existing_agents[0] if existing_agents else None
+
+
 def deploy_agent_engine_app(
     project: str,
     location: str,
@@ -86,34 +204,87 @@ def deploy_agent_engine_app(
     requirements_file: str = ".requirements.txt",
     extra_packages: list[str] = ["./app"],
     env_vars: dict[str, str] = {},
+    metadata_file: str = "deployment_metadata.json",
+    force: bool = False,
 ) -> agent_engines.AgentEngine:
-    """Deploy the agent engine app to Vertex AI."""
+    """Deploy the agent engine app to Vertex AI.
+
+    The uploaded packages, requirements, env vars, prompt versions and the local
+    settings the agent was built with are fingerprinted,
+    and the update is skipped when the fingerprint matches the one recorded for the
+    deployed agent.
+    """
+    timings: dict[str, float] = {}
 
     staging_bucket_uri = f"gs://{project}-agent-engine"
     artifacts_bucket_name = f"{project}-adk-base-logs-data"
-    create_bucket_if_not_exists(
-        bucket_name=artifacts_bucket_name, project=project, location=location
-    )
-    create_bucket_if_not_exists(
-        bucket_name=staging_bucket_uri, project=project, location=location
-    )
+
+    # Set worker parallelism to 1
+    env_vars = {**env_vars, "NUM_WORKERS": "1"}
+
+    with _phase(timings, "fingerprint"):
+        # Read requirements
+        with open(requirements_file) as f:
+            requirements = f.read().strip().split("\n")
+        digest = fingerprint(
+            extra_packages,
+            requirements,
+            env_vars,
+            prompt_versions(root_agent),
+            agent_settings(),
+        )
+        previous = load_deployment_metadata(metadata_file)
 
     vertexai.init(project=project, location=location, staging_bucket=staging_bucket_uri)
 
-    # Read requirements
-    with open(requirements_file) as f:
-        requirements = f.read().strip().split("\n")
+    # Bucket checks and the engine lookup do not depend on each other
+    with _phase(timings, "setup"), ThreadPoolExecutor(max_workers=3) as executor:
+
+        def timed(name: str, fn: Any, **kwargs: Any) -> Any:
+            with _phase(timings, name):
+                return fn(**kwargs)
+
+        buckets = [
+            executor.submit(
+                timed,
+                f"bucket:{bucket_name}",
+                create_bucket_if_not_exists,
+                bucket_name=bucket_name,
+                project=project,
+                location=location,
+            )
+            for bucket_name in (artifacts_bucket_name, staging_bucket_uri)
+        ]
+        lookup = executor.submit(
+            timed,
+            "engine_lookup",
+            find_agent_engine,
+            agent_name=agent_name,
+            resource_name=previous.get("remote_agent_engine_id")
+            if previous.get("agent_name") == agent_name
+            else None,
+        )
+        for future in buckets:
+            future.result()
+        existing_agent = lookup.result()
+
+    if (
+        not force
+        and existing_agent is not None
+        and previous.get("fingerprint") == digest
+        and previous.get("remote_agent_engine_id") == existing_agent.resource_name
+    ):
+        logging.info(
+            f"Agent {agent_name} is up to date ({digest[:12]}), skipping update"
+        )
+        logging.info(f"[deploy] phases: {timings}")
+        return existing_agent
 
     agent_engine = AgentEngineApp(
         agent=root_agent,
-        artifact_service_builder=lambda: GcsArtifactService(
-            bucket_name=artifacts_bucket_name
-        ),
+        artifact_service_builder=lambda: build_artifact_service(artifacts_bucket_name),
     )
 
-    # Set worker parallelism to 1
-    env_vars["NUM_WORKERS"] = "1"
-
     # Common configuration for both create and update operations
     agent_config = {
         "agent_engine": agent_engine,
@@ -125,27 +296,29 @@ def deploy_agent_engine_app(
     logging.info(f"Agent config: {agent_config}")
     agent_config["requirements"] = requirements
 
-    # Check if an agent with this name already exists
-    existing_agents = list(agent_engines.list(filter=f"display_name={agent_name}"))
-    if existing_agents:
-        # Update the existing agent with new configuration
-        logging.info(f"Updating existing agent: {agent_name}")
-        remote_agent = existing_agents[0].update(**agent_config)
-    else:
-        # Create a new agent if none exists
-        logging.info(f"Creating new agent: {agent_name}")
-        remote_agent = agent_engines.create(**agent_config)
-
-    config = {
+    with _phase(timings, "deploy"):
+        if existing_agent is not None:
+            # Update the existing agent with new configuration
+            logging.info(f"Updating existing agent: {agent_name}")
+            remote_agent = existing_agent.update(**agent_config)
+        else:
+            # Create a new agent if none exists
+            logging.info(f"Creating new agent: {agent_name}")
+            remote_agent = agent_engines.create(**agent_config)
+
+    metadata = {
         "remote_agent_engine_id": remote_agent.resource_name,
         "deployment_timestamp": datetime.datetime.now().isoformat(),
+        "agent_name": agent_name,
+        "fingerprint": digest,
+        "phase_seconds": timings,
     }
-    config_file = "deployment_metadata.json"
 
-    with open(config_file, "w") as f:
-        json.dump(config, f, indent=2)
+    with open(metadata_file, "w") as f:
+        json.dump(metadata, f, indent=2)
 
-    logging.info(f"Agent Engine ID written to {config_file}")
+    logging.info(f"Agent Engine ID written to {metadata_file}")
+    logging.info(f"[deploy] phases: {timings}")
 
     return remote_agent
 
@@ -184,6 +357,11 @@ if __name__ == "__main__":
         "--set-env-vars",
         help="Comma-separated list of environment variables in KEY=VALUE format",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Update the agent even if nothing changed since the last deploy",
+    )
     args = parser.parse_args()
 
     # Parse environment variables if provided
@@ -211,4 +389,5 @@ if __name__ == "__main__":
         requirements_file=args.requirements_file,
         extra_packages=args.extra_packages,
         env_vars=env_vars,
+        force=args.force,
     )
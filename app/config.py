@@ -1,8 +1,16 @@
 import os
+from typing import overload
+
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+# 既定値を渡した場合は必ず文字列が返る
+@overload
+def get_env(key: str) -> str | None: ...
+@overload
+def get_env(key: str, default: str) -> str: ...
 def get_env(key: str, default: str | None = None) -> str | None:
     return os.getenv(key, default)
 
@@ -10,10 +18,107 @@ def get_env(key: str, default: str | None = None) -> str | None:
 SLACK_BOT_TOKEN = get_env("SLACK_BOT_TOKEN")
 SLACK_APP_TOKEN = get_env("SLACK_APP_TOKEN")
 
-LANGFUSE_PUBLIC_KEY = get_env("LANGFUSE_PUBLIC_KEY")
-LANGFUSE_SECRET_KEY = get_env("LANGFUSE_SECRET_KEY")
+LANGFUSE_PUBLIC_KEY = get_env("LANGFUSE_PUBLIC_KEY", "")
+LANGFUSE_SECRET_KEY = get_env("LANGFUSE_SECRET_KEY", "")
 LANGFUSE_HOST = get_env("LANGFUSE_HOST", "http://localhost:3000")
 
 GOOGLE_CLOUD_PROJECT = get_env("GOOGLE_CLOUD_PROJECT")
 GOOGLE_CLOUD_LOCATION = get_env("GOOGLE_CLOUD_LOCATION", "global")
 GOOGLE_GENAI_USE_VERTEXAI = get_env("GOOGLE_GENAI_USE_VERTEXAI", "True").lower() == "true"
+
+# Geminiを呼ばずにローカルのフェイクモデルで応答する（ベンチマーク・オフラインテスト用）
+USE_FAKE_MODEL = get_env("USE_FAKE_MODEL", "false").lower() == "true"
+FAKE_MODEL_LATENCY = get_env("FAKE_MODEL_LATENCY", "0")
+# フェイクモデルの入力1000トークンあたりの追加レイテンシ（秒）
+FAKE_MODEL_PREFILL_LATENCY = get_env("FAKE_MODEL_PREFILL_LATENCY", "0")
+
+# Prometheus形式のメトリクスエンドポイント（空にすると無効）
+METRICS_HOST = get_env("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = get_env("METRICS_PORT", "9464")
+# 各ステージの計測をOpenTelemetryのspanとしても記録する
+METRICS_OTEL_SPANS = get_env("METRICS_OTEL_SPANS", "false").lower() == "true"
+
+# トークン利用量の集計（ユーザー・セッション・モデル・プロンプトバージョン別）
+USAGE_DB_PATH = get_env("USAGE_DB_PATH", ".usage.sqlite3")
+USAGE_FLUSH_INTERVAL = get_env("USAGE_FLUSH_INTERVAL", "30")
+# ユーザーごとのトークン上限（0で無効）。超過時は reject（拒否）または downgrade（軽量モデルに切り替え）
+USER_TOKEN_BUDGET = get_env("USER_TOKEN_BUDGET", "0")
+TOKEN_BUDGET_WINDOW = get_env("TOKEN_BUDGET_WINDOW", "86400")
+TOKEN_BUDGET_ACTION = get_env("TOKEN_BUDGET_ACTION", "reject")
+TOKEN_BUDGET_DOWNGRADE_MODEL = get_env("TOKEN_BUDGET_DOWNGRADE_MODEL", "gemini-2.5-flash-lite")
+
+# 実行中プロセスのプロファイル取得。シグナル受信時、起動直後（PROFILE_ON_START秒）、Slackの /profile で開始する
+PROFILE_DIR = get_env("PROFILE_DIR", ".profiles")
+PROFILE_SIGNAL = get_env("PROFILE_SIGNAL", "SIGUSR1")
+PROFILE_ON_START = get_env("PROFILE_ON_START", "0")
+# 指定するとプロファイルをGCSにもアップロードする（例: <project>-adk-base-logs-data）
+PROFILE_UPLOAD_BUCKET = get_env("PROFILE_UPLOAD_BUCKET")
+# /profile コマンドを実行できるSlackユーザーID（カンマ区切り）
+SLACK_ADMIN_USER_IDS = [
+    user_id.strip() for user_id in get_env("SLACK_ADMIN_USER_IDS", "").split(",") if user_id.strip()
+]
+
+# モデル呼び出しの同時実行数制御（AIMD）・429時のリトライ・サーキットブレーカー
+MODEL_CONCURRENCY_INITIAL = get_env("MODEL_CONCURRENCY_INITIAL", "8")
+MODEL_CONCURRENCY_MAX = get_env("MODEL_CONCURRENCY_MAX", "64")
+MODEL_QUEUE_TIMEOUT = get_env("MODEL_QUEUE_TIMEOUT", "30")
+MODEL_RETRY_ATTEMPTS = get_env("MODEL_RETRY_ATTEMPTS", "4")
+MODEL_CIRCUIT_THRESHOLD = get_env("MODEL_CIRCUIT_THRESHOLD", "8")
+MODEL_CIRCUIT_OPEN_SECONDS = get_env("MODEL_CIRCUIT_OPEN_SECONDS", "30")
+
+# メッセージ内容と直近のレイテンシから root_agent のモデル（flash / flash-lite）を選ぶ
+MODEL_ROUTING_ENABLED = get_env("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+
+# 長くなった会話履歴の圧縮。超過したら古いターンを要約（バックグラウンドで作成）に置き換え、長いツール結果を切り詰める
+HISTORY_COMPACTION_ENABLED = get_env("HISTORY_COMPACTION_ENABLED", "true").lower() == "true"
+HISTORY_MAX_TOKENS = get_env("HISTORY_MAX_TOKENS", "8000")
+HISTORY_MAX_EVENTS = get_env("HISTORY_MAX_EVENTS", "60")
+HISTORY_KEEP_TURNS = get_env("HISTORY_KEEP_TURNS", "4")
+HISTORY_TOOL_RESULT_CHARS = get_env("HISTORY_TOOL_RESULT_CHARS", "2000")
+HISTORY_SUMMARY_MODEL = get_env("HISTORY_SUMMARY_MODEL", "gemini-2.5-flash-lite")
+
+# エージェントのインストラクションとツール定義をGeminiのコンテキストキャッシュに載せる
+# TTL（秒）の残りが CONTEXT_CACHE_RENEW_BEFORE を切ったら延長し、MIN_TOKENS 未満の固定部分はキャッシュしない
+CONTEXT_CACHE_ENABLED = get_env("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_TTL = get_env("CONTEXT_CACHE_TTL", "3600")
+CONTEXT_CACHE_RENEW_BEFORE = get_env("CONTEXT_CACHE_RENEW_BEFORE", "300")
+CONTEXT_CACHE_MIN_TOKENS = get_env("CONTEXT_CACHE_MIN_TOKENS", "1024")
+
+# モデル呼び出しをカセットに記録・再生する（空にすると無効）。MODE は replay / record / auto
+# TIMING は記録時の応答間隔に掛ける倍率（0で待たずに返す、1で記録時と同じ速さ）
+LLM_CASSETTE = get_env("LLM_CASSETTE", "")
+LLM_CASSETTE_MODE = get_env("LLM_CASSETTE_MODE", "replay")
+LLM_CASSETTE_TIMING = get_env("LLM_CASSETTE_TIMING", "0")
+
+# ユーザーをまたいで、ほぼ同じ質問（Jaccard係数が THRESHOLD 以上）への回答を TTL 秒間使い回す
+ANSWER_CACHE_ENABLED = get_env("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_TTL = get_env("ANSWER_CACHE_TTL", "900")
+ANSWER_CACHE_THRESHOLD = get_env("ANSWER_CACHE_THRESHOLD", "0.7")
+ANSWER_CACHE_MAX_ENTRIES = get_env("ANSWER_CACHE_MAX_ENTRIES", "10000")
+
+# ツールごとの実行期限（秒、0以下で無制限）。期限を過ぎたらタイムアウトを表す結果をモデルに返す
+TOOL_DEADLINES = get_env("TOOL_DEADLINES", "get_weather=10,get_current_time=5,search_agent=60")
+TOOL_DEFAULT_DEADLINE = get_env("TOOL_DEFAULT_DEADLINE", "30")
+# 冪等なツール（カンマ区切り）。実行時間が直近の p95 を超えたら重複実行し、先に終わった結果を使う
+TOOL_HEDGED = [
+    name.strip() for name in get_env("TOOL_HEDGED", "get_weather,get_current_time").split(",") if name.strip()
+]
+
+# セッション履歴をコンパクトな形式で保持する。BLOB_THRESHOLD バイト以上のツール結果は内容のハッシュで共有する（0で無効）
+SESSION_COMPACT_ENABLED = get_env("SESSION_COMPACT_ENABLED", "true").lower() == "true"
+SESSION_BLOB_THRESHOLD = get_env("SESSION_BLOB_THRESHOLD", "2048")
+
+# Slackボットのワーカープロセス数。2以上でユーザーごとにワーカーへ振り分ける（コンシステントハッシュ）
+SLACK_WORKERS = get_env("SLACK_WORKERS", "1")
+# ワーカー1つあたりの同時処理数
+SLACK_WORKER_CONCURRENCY = get_env("SLACK_WORKER_CONCURRENCY", "16")
+# ボットが参加しているスレッドを記録するSQLiteファイル
+SLACK_THREAD_DB_PATH = get_env("SLACK_THREAD_DB_PATH", ".slack_threads.sqlite3")
+
+# Agent Engine のアーティファクト保存（GCS）の前段に置くローカルキャッシュと非同期アップロード
+ARTIFACT_CACHE_ENABLED = get_env("ARTIFACT_CACHE_ENABLED", "true").lower() == "true"
+ARTIFACT_CACHE_DIR = get_env("ARTIFACT_CACHE_DIR", "/tmp/adk-artifact-cache")
+ARTIFACT_CACHE_MAX_BYTES = get_env("ARTIFACT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+ARTIFACT_UPLOAD_WORKERS = get_env("ARTIFACT_UPLOAD_WORKERS", "4")
+# true にすると保存をアップロードの完了を待たずに返す（SIGTERM で終了すると未送信分が失われる）
+ARTIFACT_WRITE_BEHIND = get_env("ARTIFACT_WRITE_BEHIND", "false").lower() == "true"
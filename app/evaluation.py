@@ -0,0 +1,372 @@
+"""root_agent をJSONLのデータセットに対してまとめて実行する評価CLI
+
+- 同時実行数を制限して並列に実行する
+- 応答は (プロンプト, プロンプトバージョン, モデル) をキーにSQLiteへキャッシュし、変わった行だけ再実行する
+- 完了した行は出力ディレクトリの checkpoint.jsonl に追記し、中断しても同じコマンドで再開できる
+- 結果（応答・ツール呼び出しの軌跡・レイテンシ・トークン数）は列指向形式（Parquet）で書き出す
+- --offline ではGeminiの代わりにフェイクモデルを使う
+
+Usage:
+    uv run python -m app.evaluation --dataset requests.jsonl --output .eval/run1 [--offline]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from google.adk.events import Event
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types as genai_types
+
+from . import config
+from .agent import DEFAULT_MODEL, build_agents, configure_history, fetch_prompts
+from .utils import usage
+from .utils.langfuse import LangfuseClient
+
+logger = logging.getLogger(__name__)
+
+APP_NAME = "adk-eval"
+
+
+@dataclass
+class EvalCase:
+    id: str
+    prompt: str
+    reference_trajectory: list[dict[str, Any]] | None = None
+
+
+@dataclass
+class EvalResult:
+    id: str
+    prompt: str
+    model: str
+    prompt_version: str
+    cache_key: str
+    response: str = ""
+    predicted_trajectory: list[dict[str, Any]] = field(default_factory=list)
+    reference_trajectory: list[dict[str, Any]] | None = None
+    latency_seconds: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    error: str = ""
+    cached: bool = False
+
+    def as_row(self) -> dict[str, Any]:
+        row = asdict(self)
+        # 列指向形式で扱いやすいよう、入れ子の値はJSON文字列にする
+        row["predicted_trajectory"] = json.dumps(
+            self.predicted_trajectory, ensure_ascii=False
+        )
+        row["reference_trajectory"] = (
+            json.dumps(self.reference_trajectory, ensure_ascii=False)
+            if self.reference_trajectory is not None
+            else None
+        )
+        row.update(
+            trajectory_metrics(self.predicted_trajectory, self.reference_trajectory)
+        )
+        return row
+
+
+def load_dataset(path: str) -> list[EvalCase]:
+    """JSONLを読み込む。prompt / text / message、なければ title と body をプロンプトにする"""
+    cases = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            prompt = row.get("prompt") or row.get("text") or row.get("message")
+            if not prompt:
+                prompt = "\n".join(str(row[k]) for k in ("title", "body") if row.get(k))
+            case_id = row.get("id") or row.get("request_id") or str(i)
+            cases.append(
+                EvalCase(str(case_id), prompt, row.get("reference_trajectory"))
+            )
+    return cases
+
+
+def cache_key(prompt: str, prompt_version: str, model: str) -> str:
+    return hashlib.sha256(
+        "\0".join((prompt, prompt_version, model)).encode()
+    ).hexdigest()
+
+
+def trajectory_metrics(
+    predicted: list[dict[str, Any]], reference: list[dict[str, Any]] | None
+) -> dict[str, float | None]:
+    """Vertex AI の trajectory_* 指標と同じ定義で、ローカルに計算する"""
+    names = (
+        "trajectory_exact_match",
+        "trajectory_in_order_match",
+        "trajectory_precision",
+        "trajectory_recall",
+    )
+    if reference is None:
+        return dict.fromkeys(names)
+
+    def keys(calls: list[dict[str, Any]]) -> list[str]:
+        return [json.dumps(c, sort_keys=True, ensure_ascii=False) for c in calls]
+
+    pred, ref = keys(predicted), keys(reference)
+    it = iter(pred)
+    in_order = all(call in it for call in ref)
+    matched = sum(1 for call in pred if call in ref)
+    return {
+        "trajectory_exact_match": float(pred == ref),
+        "trajectory_in_order_match": float(in_order),
+        "trajectory_precision": matched / len(pred) if pred else float(not ref),
+        "trajectory_recall": sum(1 for call in ref if call in pred) / len(ref)
+        if ref
+        else 1.0,
+    }
+
+
+def parse_events(events: Iterable[Event]) -> tuple[str, list[dict[str, Any]]]:
+    """イベントから最終応答とツール呼び出しの軌跡を取り出す"""
+    response = ""
+    trajectory = []
+    for event in events:
+        if not event.content or not event.content.parts:
+            continue
+        for part in event.content.parts:
+            if part.function_call:
+                trajectory.append(
+                    {
+                        "tool_name": part.function_call.name,
+                        "tool_input": dict(part.function_call.args or {}),
+                    }
+                )
+            if event.content.role == "model" and part.text and not event.partial:
+                response = part.text.strip()
+    return response, trajectory
+
+
+class ResponseCache:
+    """評価結果のSQLiteキャッシュ。キーは (プロンプト, プロンプトバージョン, モデル) のハッシュ"""
+
+    def __init__(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS eval_responses (
+                    cache_key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM eval_responses WHERE cache_key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, result: dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO eval_responses VALUES (?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False), time.time()),
+            )
+
+
+class Checkpoint:
+    """完了した行を1行ずつ追記するJSONL。再開時はここにある行（エラーを除く）を飛ばす"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+        done = {}
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断時に途中まで書かれた行は捨てる
+                    continue
+                done[row["id"]] = row
+        return done
+
+    def append(self, result: EvalResult) -> None:
+        line = json.dumps(asdict(result), ensure_ascii=False)
+        with self._lock, self.path.open("a") as f:
+            f.write(line + "\n")
+
+
+def write_columnar(rows: list[dict[str, Any]], output_dir: Path) -> Path:
+    """結果を列指向形式で書き出す。pyarrow が無い環境では列ごとの配列を持つJSONにする"""
+    if importlib.util.find_spec("pyarrow") is not None:
+        import pandas as pd
+
+        path = output_dir / "results.parquet"
+        pd.DataFrame(rows).to_parquet(path, index=False)
+        return path
+
+    logger.warning("pyarrow がインストールされていないため、列指向のJSONで書き出します")
+    columns: dict[str, list[Any]] = {name: [] for name in rows[0]} if rows else {}
+    for row in rows:
+        for name, values in columns.items():
+            values.append(row.get(name))
+    path = output_dir / "results.columns.json"
+    path.write_text(json.dumps(columns, ensure_ascii=False))
+    return path
+
+
+class Evaluator:
+    def __init__(
+        self,
+        output_dir: str,
+        model: str = DEFAULT_MODEL,
+        concurrency: int = 8,
+        cache: ResponseCache | None = None,
+        langfuse_client: LangfuseClient | None = None,
+    ) -> None:
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.concurrency = concurrency
+        self.cache = cache
+        self.checkpoint = Checkpoint(self.output_dir / "checkpoint.jsonl")
+
+        langfuse_client = langfuse_client or LangfuseClient(
+            public_key=config.LANGFUSE_PUBLIC_KEY,
+            secret_key=config.LANGFUSE_SECRET_KEY,
+            host=config.LANGFUSE_HOST,
+        )
+        # 履歴要約のモデルは app.agent の import 時に作られるため、--offline を反映し直す
+        configure_history()
+        prompts = fetch_prompts(langfuse_client)
+        self.agent = build_agents(prompts, model=model)
+        self.model = f"fake:{model}" if config.USE_FAKE_MODEL else model
+        self.prompt_version = "+".join(
+            (
+                usage.prompt_version("root_agent_instruction", prompts["root"][1]),
+                usage.prompt_version("search_agent_instruction", prompts["search"][1]),
+            )
+        )
+        self.session_service = InMemorySessionService()
+        self.runner = Runner(
+            agent=self.agent, app_name=APP_NAME, session_service=self.session_service
+        )
+
+    async def run(self, cases: list[EvalCase]) -> tuple[Path, dict[str, int]]:
+        done = self.checkpoint.load()
+        stats = {"rows": len(cases), "resumed": 0, "cached": 0, "ran": 0, "errors": 0}
+        slots = asyncio.Semaphore(self.concurrency)
+        results: dict[str, EvalResult] = {}
+
+        async def one(case: EvalCase) -> None:
+            key = cache_key(case.prompt, self.prompt_version, self.model)
+            previous = done.get(case.id)
+            # エラーになった行は再開時にもう一度実行する
+            if previous and previous["cache_key"] == key and not previous.get("error"):
+                stats["resumed"] += 1
+                results[case.id] = EvalResult(**previous)
+                return
+            if self.cache and (cached := self.cache.get(key)):
+                stats["cached"] += 1
+                result = EvalResult(**{**cached, "id": case.id, "cached": True})
+                result.reference_trajectory = case.reference_trajectory
+            else:
+                async with slots:
+                    result = await self._run_case(case, key)
+                stats["ran"] += 1
+                stats["errors"] += bool(result.error)
+                if self.cache and not result.error:
+                    self.cache.put(key, asdict(result))
+            self.checkpoint.append(result)
+            results[case.id] = result
+
+        await asyncio.gather(*(one(case) for case in cases))
+        rows = [results[case.id].as_row() for case in cases]
+        return write_columnar(rows, self.output_dir), stats
+
+    async def _run_case(self, case: EvalCase, key: str) -> EvalResult:
+        result = EvalResult(
+            id=case.id,
+            prompt=case.prompt,
+            model=self.model,
+            prompt_version=self.prompt_version,
+            cache_key=key,
+            reference_trajectory=case.reference_trajectory,
+        )
+        session = await self.session_service.create_session(
+            app_name=APP_NAME, user_id=f"eval_{case.id}"
+        )
+        start = time.perf_counter()
+        events = []
+        try:
+            with usage.scope(session.user_id, session.id) as scope:
+                async for event in self.runner.run_async(
+                    user_id=session.user_id,
+                    session_id=session.id,
+                    new_message=genai_types.Content(
+                        role="user",
+                        parts=[genai_types.Part.from_text(text=case.prompt)],
+                    ),
+                ):
+                    events.append(event)
+            result.prompt_tokens = scope.totals[1]
+            result.output_tokens = scope.totals[2]
+        except Exception as e:
+            logger.exception("評価の実行に失敗しました: %s", case.id)
+            result.error = f"{type(e).__name__}: {e}"
+        result.latency_seconds = time.perf_counter() - start
+        result.response, result.predicted_trajectory = parse_events(events)
+        return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="root_agent をデータセットに対して実行して評価する"
+    )
+    parser.add_argument("--dataset", default="requests.jsonl")
+    parser.add_argument(
+        "--output", default=".eval/latest", help="結果とチェックポイントの出力先"
+    )
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cache", default=".eval/cache.sqlite3")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--offline", action="store_true", help="フェイクモデルで実行する"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.offline:
+        config.USE_FAKE_MODEL = True
+
+    evaluator = Evaluator(
+        args.output,
+        model=args.model,
+        concurrency=args.concurrency,
+        cache=None if args.no_cache else ResponseCache(args.cache),
+    )
+    start = time.perf_counter()
+    path, stats = asyncio.run(evaluator.run(load_dataset(args.dataset)))
+    seconds = round(time.perf_counter() - start, 2)
+    print(json.dumps({**stats, "seconds": seconds, "output": str(path)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,116 +1,52 @@
-import asyncio
 import logging
+from collections.abc import Callable
+from concurrent.futures import Future
 from typing import Dict, Any
 
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai import types as genai_types
 
 from . import config
-from .agent import create_agents
-from .utils.langfuse import LangfuseClient, langfuse_context, observe
+from .slack_worker import agent_cache, process_message, run_async
+from .utils import metrics, profiling
+from .utils.metrics import stage
+from .utils.routing import TIERS
+from .utils.sharding import ThreadStore, WorkerError, WorkerPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = App(token=config.SLACK_BOT_TOKEN)
 
-session_service = InMemorySessionService()
-user_sessions: Dict[str, str] = {}
-bot_threads: set = set()
-
-langfuse_client = LangfuseClient(
-    public_key=config.LANGFUSE_PUBLIC_KEY,
-    secret_key=config.LANGFUSE_SECRET_KEY,
-    host=config.LANGFUSE_HOST
-)
-
-async def get_or_create_session(user_id: str) -> str:
-    if user_id not in user_sessions:
-        session_id = f"slack_{user_id}"
-        await session_service.create_session(
-            app_name="adk-slack-bot",
-            user_id=user_id,
-            session_id=session_id
-        )
-        user_sessions[user_id] = session_id
-    return user_sessions[user_id]
-
-
-@observe(name="slack_bot_conversation")
-async def process_with_agent(user_id: str, session_id: str, message: str) -> str:
-    langfuse_context.update_current_trace(
-        user_id=user_id,
-        session_id=session_id
-    )
-    
-    # リクエストごとに最新のプロンプトでエージェントを作成。
-    # agentsのinstructionは更新することができないため、プロンプトを更新しても反映することができないため
-    agent = create_agents(langfuse_client)
-    root_prompt = getattr(agent, '_langfuse_prompts', {}).get('root')
-    
-    # Generationとして記録するための内部関数
-    @observe(as_type="generation", name="root_agent_generation")
-    async def _run_agent():
-        if root_prompt:
-            langfuse_context.update_current_observation(
-                prompt=root_prompt,
-                input=message,
-                model="gemini-2.5-flash"
-            )
-        
-        runner = Runner(
-            agent=agent,
-            app_name="adk-slack-bot",
-            session_service=session_service
-        )
-        
-        response_text = ""
-        
-        async for event in runner.run_async(
-            user_id=user_id,
-            session_id=session_id,
-            new_message=genai_types.Content(
-                role="user",
-                parts=[genai_types.Part.from_text(text=message)]
-            ),
-        ):
-            if event.is_final_response() and event.content and event.content.parts:
-                for part in event.content.parts:
-                    if part.text:
-                        response_text += part.text
-        
-        if response_text:
-            langfuse_context.update_current_observation(
-                output=response_text
-            )
-        
-        return response_text or "申し訳ございませんが、応答を生成できませんでした。"
-    
-    return await _run_agent()
+# ボットが参加しているスレッド。ワーカー数や再起動に関係なく共有する
+bot_threads = ThreadStore(config.SLACK_THREAD_DB_PATH)
 
+# SLACK_WORKERS > 1 のとき、ユーザーごとにワーカープロセスへ振り分ける
+pool: WorkerPool | None = None
 
-async def process_message(user_id: str, message: str) -> str:
-    try:
-        logger.info(f"[DEBUG] メッセージ処理開始: {message}")
-        session_id = await get_or_create_session(user_id)
-        
-        return await process_with_agent(user_id, session_id, message)
-    
-    except Exception as e:
-        logger.error(f"エージェント処理エラー: {e}")
-        return f"エラーが発生しました: {str(e)}"
 
+def dispatch(user_id: str, text: str, reply: Callable[[str], Any]) -> None:
+    """メッセージを処理して reply で返信する
 
-def run_async(coro):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+    ワーカープロセスを使う場合は結果を待たずに戻り、処理が終わったら返信する。
+    """
+    if pool is None:
+        response = run_async(process_message(user_id, text))
+        with stage("slack_post"):
+            reply(response)
+        return
+
+    # セッションはユーザー単位なので、ユーザーIDでワーカーを決める
+    def _reply(future: Future) -> None:
+        try:
+            response = future.result()
+        except WorkerError as e:
+            logger.error(f"ワーカーでの処理に失敗しました: {e}")
+            response = f"エラーが発生しました: {e!s}"
+        with stage("slack_post"):
+            reply(response)
+
+    pool.submit(user_id, "process_message", user_id, text).add_done_callback(_reply)
 
 
 @app.message("")
@@ -124,13 +60,12 @@ def handle_message(message: Dict[str, Any], say: Any) -> None:
     
     # DM
     if channel_type == "im":
-        response = run_async(process_message(user_id, text))
-        say(response)
+        dispatch(user_id, text, say)
     
     # スレッド
     elif message.get("thread_ts") and message["thread_ts"] in bot_threads:
-        response = run_async(process_message(user_id, text))
-        say(text=response, thread_ts=message["thread_ts"])
+        thread_ts = message["thread_ts"]
+        dispatch(user_id, text, lambda response: say(text=response, thread_ts=thread_ts))
 
 
 @app.event("app_mention")
@@ -139,29 +74,90 @@ def handle_app_mention(event: Dict[str, Any], say: Any) -> None:
     text = event["text"]
     event_ts = event["ts"]
     
-    response = run_async(process_message(user_id, text))
-    say(text=response, thread_ts=event_ts)
     bot_threads.add(event_ts)
+    dispatch(user_id, text, lambda response: say(text=response, thread_ts=event_ts))
 
 
 @app.command("/weather")
 def handle_weather_command(ack: Any, command: Dict[str, Any], respond: Any) -> None:
     ack()
     query = f"{command['text'] or 'サンフランシスコ'}の天気を教えて"
-    response = run_async(process_message(command["user_id"], query))
-    respond(response)
+    dispatch(command["user_id"], query, respond)
 
 
 @app.command("/time")
 def handle_time_command(ack: Any, command: Dict[str, Any], respond: Any) -> None:
     ack()
     query = f"{command['text'] or 'サンフランシスコ'}の現在時刻を教えて"
-    response = run_async(process_message(command["user_id"], query))
-    respond(response)
+    dispatch(command["user_id"], query, respond)
 
 
-def main():
+@app.command("/profile")
+def handle_profile_command(ack: Any, command: Dict[str, Any], respond: Any) -> None:
+    ack()
+    if command["user_id"] not in config.SLACK_ADMIN_USER_IDS:
+        respond("このコマンドを実行する権限がありません。")
+        return
+
+    try:
+        duration = float(command["text"] or 30)
+    except ValueError:
+        respond("使い方: /profile [秒数]")
+        return
+
+    capture = profiling.start_capture(duration)
+    if capture is None:
+        respond("すでにプロファイルを取得中です。")
+        return
+    respond(f"{capture.duration:.0f}秒間プロファイルを取得します。")
+    # リスナーのスレッドを待たせないよう、結果は取得が終わってから返信する
+    capture.add_done_callback(
+        lambda paths: respond("プロファイルを保存しました:\n" + "\n".join(str(path) for path in paths))
+    )
+
+
+@app.command("/workers")
+def handle_workers_command(ack: Any, command: Dict[str, Any], respond: Any) -> None:
+    ack()
+    if command["user_id"] not in config.SLACK_ADMIN_USER_IDS:
+        respond("このコマンドを実行する権限がありません。")
+        return
+    if pool is None:
+        respond("ワーカープロセスは使っていません（SLACK_WORKERS=1）。")
+        return
+    if not command["text"]:
+        respond("\n".join(f"{worker}: {keys}ユーザー" for worker, keys in pool.owners().items()))
+        return
+
+    try:
+        workers = int(command["text"])
+        moved = pool.resize(workers)
+    except ValueError:
+        respond("使い方: /workers [ワーカー数]")
+        return
+    respond(f"ワーカー数を {workers} にしました（{moved} セッションを移動）。")
+
+
+def main() -> None:
+    global pool
     logger.info("Slack ボットを開始しています...")
+    profiling.install(
+        signal_name=config.PROFILE_SIGNAL,
+        on_start=float(config.PROFILE_ON_START),
+        output_dir=config.PROFILE_DIR,
+        upload_bucket=config.PROFILE_UPLOAD_BUCKET,
+    )
+    metrics.configure(otel_spans=config.METRICS_OTEL_SPANS)
+    if config.METRICS_PORT:
+        metrics.start_metrics_server(int(config.METRICS_PORT), host=config.METRICS_HOST)
+    if int(config.SLACK_WORKERS) > 1:
+        pool = WorkerPool(
+            "app.slack_worker",
+            workers=int(config.SLACK_WORKERS),
+            concurrency=int(config.SLACK_WORKER_CONCURRENCY),
+        ).start()
+    else:
+        agent_cache.warm(list(TIERS.values()))
     handler = SocketModeHandler(app, config.SLACK_APP_TOKEN)
     handler.start()
 
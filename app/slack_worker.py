@@ -0,0 +1,281 @@
+"""Slackのメッセージをエージェントで処理する部分
+
+単一プロセスでは slack_bot から直接呼び出し、SLACK_WORKERS > 1 のときは
+各ワーカープロセスがこのモジュールを読み込み、担当するユーザーのセッションだけを持つ。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+from google.adk.events import Event
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.genai import types as genai_types
+
+from . import config
+from .agent import AgentCache
+from .utils import metrics, profiling, usage
+from .utils.answer_cache import AnswerCache
+from .utils.langfuse import LangfuseClient, langfuse_context, observe
+from .utils.metrics import stage
+from .utils.rate_limit import RateLimitError
+from .utils.routing import TIERS, ModelRouter, RoutingDecision
+from .utils.session_store import CompactSessionService
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+APP_NAME = "adk-slack-bot"
+
+session_service = (
+    CompactSessionService(blob_threshold=int(config.SESSION_BLOB_THRESHOLD))
+    if config.SESSION_COMPACT_ENABLED
+    else InMemorySessionService()
+)
+user_sessions: dict[str, str] = {}
+
+langfuse_client = LangfuseClient(
+    public_key=config.LANGFUSE_PUBLIC_KEY,
+    secret_key=config.LANGFUSE_SECRET_KEY,
+    host=config.LANGFUSE_HOST,
+)
+
+agent_cache = AgentCache(langfuse_client)
+router = ModelRouter()
+
+# ユーザーをまたいで、ほぼ同じ質問への回答を使い回す（ワーカープロセスごと）
+answer_cache = (
+    AnswerCache(
+        ttl=float(config.ANSWER_CACHE_TTL),
+        threshold=float(config.ANSWER_CACHE_THRESHOLD),
+        max_entries=int(config.ANSWER_CACHE_MAX_ENTRIES),
+    )
+    if config.ANSWER_CACHE_ENABLED
+    else None
+)
+
+
+async def get_or_create_session(user_id: str) -> str:
+    if user_id not in user_sessions:
+        session_id = f"slack_{user_id}"
+        await session_service.create_session(
+            app_name=APP_NAME, user_id=user_id, session_id=session_id
+        )
+        user_sessions[user_id] = session_id
+    return user_sessions[user_id]
+
+
+async def _append_cached_turn(
+    user_id: str, session_id: str, author: str, message: str, answer: str
+) -> None:
+    # キャッシュから答えた質問も履歴に残し、続けて聞かれたときに文脈が途切れないようにする
+    session = await session_service.get_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session_id
+    )
+    if session is None:
+        return
+    invocation_id = Event.new_id()
+    for event_author, role, text in (
+        ("user", "user", message),
+        (author, "model", answer),
+    ):
+        await session_service.append_event(
+            session,
+            Event(
+                invocation_id=invocation_id,
+                author=event_author,
+                content=genai_types.Content(
+                    role=role, parts=[genai_types.Part.from_text(text=text)]
+                ),
+            ),
+        )
+
+
+@observe(name="slack_bot_conversation")
+async def process_with_agent(user_id: str, session_id: str, message: str) -> str:
+    langfuse_context.update_current_trace(user_id=user_id, session_id=session_id)
+
+    # メッセージの内容から root_agent のモデルを選ぶ
+    if config.MODEL_ROUTING_ENABLED:
+        decision = router.route(message)
+    else:
+        decision = RoutingDecision(
+            tier="standard", model=TIERS["standard"], reason="disabled"
+        )
+    langfuse_context.update_current_trace(
+        metadata={"routing": decision.as_metadata()},
+        tags=[f"model_tier:{decision.tier}"],
+    )
+
+    # リクエストごとに最新のプロンプトを取得し、バージョンが変わったときだけエージェントを作り直す。
+    # agentsのinstructionは更新することができないため、プロンプトを更新しても反映することができないため
+    with stage("agent_build", target=decision.tier):
+        agent = agent_cache.get(decision.model)
+    prompts = getattr(agent, "_langfuse_prompts", {})
+    root_prompt = prompts.get("root")
+    prompt_version = "+".join(
+        (
+            usage.prompt_version("root_agent_instruction", root_prompt),
+            usage.prompt_version("search_agent_instruction", prompts.get("search")),
+        )
+    )
+
+    in_conversation = False
+    if answer_cache is not None:
+        with stage("answer_cache"):
+            # 以前の発話や state があると、文脈に依存しない質問に見えても答えが変わりうる
+            session = await session_service.get_session(
+                app_name=APP_NAME,
+                user_id=user_id,
+                session_id=session_id,
+                config=GetSessionConfig(num_recent_events=1),
+            )
+            in_conversation = bool(session and (session.events or session.state))
+            cached = answer_cache.lookup(message, prompt_version, in_conversation)
+        if cached is not None:
+            langfuse_context.update_current_trace(
+                metadata={
+                    "routing": decision.as_metadata(),
+                    "answer_cache": {"question": cached.question, "hits": cached.hits},
+                },
+                tags=[f"model_tier:{decision.tier}", "answer_cache:hit"],
+            )
+            await _append_cached_turn(
+                user_id, session_id, agent.name, message, cached.answer
+            )
+            return cached.answer
+
+    # Generationとして記録するための内部関数
+    @observe(as_type="generation", name="root_agent_generation")
+    async def _run_agent() -> str:
+        if root_prompt:
+            langfuse_context.update_current_observation(
+                prompt=root_prompt, input=message, model=decision.model
+            )
+
+        runner = Runner(agent=agent, app_name=APP_NAME, session_service=session_service)
+
+        response_text = ""
+        start = time.perf_counter()
+
+        # ネストしたsearch_agentを含め、このリクエストで使ったトークンをユーザーに紐づけて集計する
+        with usage.scope(user_id, session_id) as request_usage:
+            async for event in runner.run_async(
+                user_id=user_id,
+                session_id=session_id,
+                new_message=genai_types.Content(
+                    role="user", parts=[genai_types.Part.from_text(text=message)]
+                ),
+            ):
+                if event.is_final_response() and event.content and event.content.parts:
+                    for part in event.content.parts:
+                        if part.text:
+                            response_text += part.text
+
+        langfuse_context.update_current_observation(
+            usage=request_usage.as_langfuse_usage()
+        )
+        if response_text:
+            langfuse_context.update_current_observation(output=response_text)
+            # バジェット超過の定型文やツールがタイムアウトした回答は使い回さない
+            if answer_cache is not None and not request_usage.degraded:
+                answer_cache.store(
+                    message,
+                    response_text,
+                    prompt_version,
+                    time.perf_counter() - start,
+                    in_conversation,
+                )
+
+        return response_text or "申し訳ございませんが、応答を生成できませんでした。"
+
+    return await _run_agent()
+
+
+async def process_message(user_id: str, message: str) -> str:
+    try:
+        logger.info(f"[DEBUG] メッセージ処理開始: {message}")
+        with stage("process_message"):
+            with stage("session_lookup"):
+                session_id = await get_or_create_session(user_id)
+
+            return await process_with_agent(user_id, session_id, message)
+
+    except RateLimitError as e:
+        logger.warning(f"モデル呼び出しを制限しました: {e}")
+        return "現在リクエストが集中しています。しばらく時間をおいてから再度お試しください。"
+
+    except Exception as e:
+        logger.error(f"エージェント処理エラー: {e}")
+        return f"エラーが発生しました: {e!s}"
+
+
+async def export_session(user_id: str) -> dict[str, Any] | None:
+    """リバランスで担当を外れたユーザーのセッションを取り出し、このワーカーからは削除する"""
+    session_id = user_sessions.pop(user_id, None)
+    if session_id is None:
+        return None
+    session = await session_service.get_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session_id
+    )
+    await session_service.delete_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session_id
+    )
+    return session.model_dump(mode="json") if session else None
+
+
+async def import_session(user_id: str, data: dict[str, Any]) -> None:
+    """他のワーカーから移ってきたセッションを復元する"""
+    exported = Session.model_validate(data)
+    session = await session_service.create_session(
+        app_name=APP_NAME,
+        user_id=user_id,
+        session_id=exported.id,
+        state=exported.state,
+    )
+    for event in exported.events:
+        await session_service.append_event(session, event)
+    user_sessions[user_id] = session.id
+
+
+def init_worker(worker_id: str) -> None:
+    """ワーカープロセスの起動時に WorkerPool から呼ばれる"""
+    profiling.track_loop(asyncio.get_running_loop())
+    profiling.install(
+        signal_name=config.PROFILE_SIGNAL,
+        output_dir=config.PROFILE_DIR,
+        upload_bucket=config.PROFILE_UPLOAD_BUCKET,
+    )
+    metrics.configure(otel_spans=config.METRICS_OTEL_SPANS)
+    if config.METRICS_PORT:
+        # ワーカーごとに METRICS_PORT+1, +2, ... で公開する
+        port = int(config.METRICS_PORT) + 1 + int(worker_id.rsplit("-", 1)[1])
+        metrics.start_metrics_server(port, host=config.METRICS_HOST)
+    agent_cache.warm(list(TIERS.values()))
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _agent_loop() -> asyncio.AbstractEventLoop:
+    # エージェント（とGeminiクライアントの接続）を使い回すため、全メッセージを1つのイベントループで処理する
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            profiling.track_loop(_loop)
+            threading.Thread(
+                target=_loop.run_forever, name="agent-loop", daemon=True
+            ).start()
+        return _loop
+
+
+def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    return asyncio.run_coroutine_threadsafe(coro, _agent_loop()).result()
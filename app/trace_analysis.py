@@ -0,0 +1,615 @@
+"""書き出したspanからエージェントの実行時間の内訳を調べるオフライン分析CLI
+
+- CloudTraceLoggingSpanExporter が Cloud Logging に書いたspan（ReadableSpan.to_json の形式）、
+  またはそのログエントリ（jsonPayload）のJSONL（.gz可）を1行ずつ読み、全体をメモリに載せない
+- トレースごとにspanの木を組み立て、子の時間を除いた自己時間とクリティカルパスを求める
+- ステージ（モデル呼び出し・ツール・search_agent・エクスポートなど）ごとに
+  1呼び出しあたりの自己時間とクリティカルパス上の時間をパーセンタイルの表にする
+- 集計結果を保存し、2つの実行の間でパーセンタイルが悪化したステージを報告する
+
+ヒストグラムは対数バケット（相対誤差約1%）、未完了のトレースは --max-open-traces 件までなので、
+数百万spanでもメモリ使用量は入力の大きさによらない。
+
+Usage:
+    gcloud logging read 'labels.type="agent_telemetry"' --format=json | jq -c '.[]' > spans.jsonl
+    uv run python -m app.trace_analysis report spans.jsonl [--save .traces/run1.json]
+    uv run python -m app.trace_analysis diff .traces/run1.json spans-new.jsonl [--fail-on-regression]
+"""
+
+import argparse
+import gzip
+import heapq
+import json
+import math
+import sys
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, TextIO
+
+SUMMARY_VERSION = 1
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class LogHistogram:
+    """対数バケットのヒストグラム（DDSketch と同じ考え方）。値の範囲だけでメモリが決まり、マージできる"""
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.counts: dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value: float, count: int = 1) -> None:
+        self.count += count
+        self.sum += value * count
+        self.max = max(self.max, value)
+        if value < 1e-6:
+            self.zero += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other: "LogHistogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank < seen:
+                return min(2 * self.gamma**index / (1 + self.gamma), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "counts": {str(k): v for k, v in self.counts.items()},
+            "zero": self.zero,
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "LogHistogram":
+        histogram = cls(data["relative_accuracy"])
+        histogram.counts = {int(k): v for k, v in data["counts"].items()}
+        histogram.zero = data["zero"]
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.max = data["max"]
+        return histogram
+
+
+@dataclass(slots=True)
+class Span:
+    span_id: str
+    parent_id: str | None
+    name: str
+    start: float
+    end: float
+    target: str = ""
+    children: list["Span"] = field(default_factory=list)
+
+
+def _hex(value: Any) -> str | None:
+    if not value:
+        return None
+    return str(value).removeprefix("0x").lower()
+
+
+def _seconds(value: Any) -> float:
+    if isinstance(value, int | float):
+        # エポックからのナノ秒・秒のどちらでも受け付ける
+        return value / 1e9 if value > 1e12 else float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def parse_span(record: dict[str, Any]) -> tuple[str, Span] | None:
+    """spanのJSON（またはCloud Loggingのログエントリ）を (trace_id, Span) にする。spanでなければ None"""
+    payload = record.get("jsonPayload") or record.get("json_payload") or record
+    context = payload.get("context") or {}
+    trace_id = _hex(context.get("trace_id")) or _hex(
+        str(payload.get("trace") or record.get("trace") or "").rsplit("/", 1)[-1]
+    )
+    span_id = _hex(context.get("span_id") or payload.get("span_id"))
+    if (
+        not trace_id
+        or not span_id
+        or "start_time" not in payload
+        or "end_time" not in payload
+    ):
+        return None
+    attributes = payload.get("attributes") or {}
+    return trace_id, Span(
+        span_id=span_id,
+        parent_id=_hex(payload.get("parent_id")),
+        name=payload.get("name", ""),
+        start=_seconds(payload["start_time"]),
+        end=_seconds(payload["end_time"]),
+        target=str(attributes.get("target") or ""),
+    )
+
+
+def _open(path: str) -> TextIO:
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def read_spans(
+    paths: Iterable[str], stats: dict[str, int] | None = None
+) -> Iterator[tuple[str, Span]]:
+    """JSONLファイルを順に1行ずつ読み、spanだけを返す"""
+    stats = stats if stats is not None else {}
+    for path in paths:
+        f = _open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line == "[" or line == "]":
+                    raise ValueError(
+                        f"{path} はJSON配列です。jq -c '.[]' でJSONLに変換してください"
+                    )
+                try:
+                    parsed = parse_span(json.loads(line))
+                except (ValueError, TypeError, AttributeError):
+                    parsed = None
+                if parsed is None:
+                    stats["skipped"] = stats.get("skipped", 0) + 1
+                    continue
+                yield parsed
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def classify(span: Span) -> str:
+    """spanの名前からステージ名を決める（ADK のspanと metrics.stage のspanの両方）"""
+    name = span.name
+    if name in ("call_llm", "stage.model_turn", "stage.history_summary"):
+        return "model_call"
+    if name.startswith("execute_tool ") or name == "stage.tool_call":
+        tool = (
+            span.target
+            if name == "stage.tool_call"
+            else name.removeprefix("execute_tool ")
+        )
+        return "search_agent" if tool == "search_agent" else f"tool:{tool}"
+    if "export" in name.lower():
+        return "exporter"
+    if name in ("invocation", "send_data") or name.startswith("agent_run "):
+        return "agent"
+    if name.startswith("stage."):
+        return name.removeprefix("stage.")
+    return name or "unknown"
+
+
+def _label(span: Span, parent_label: str | None) -> str:
+    label = classify(span)
+    # search_agent の中の処理は「search_agent/model_call」のようにまとめる
+    if (
+        parent_label
+        and parent_label.split("/", 1)[0] == "search_agent"
+        and label != "search_agent"
+    ):
+        return f"search_agent/{label}"
+    return label
+
+
+def _self_time(span: Span) -> float:
+    """子spanの区間（重なりはまとめる）を除いた時間"""
+    busy = 0.0
+    cursor = span.start
+    for child in sorted(span.children, key=lambda c: c.start):
+        start, end = max(child.start, cursor), min(child.end, span.end)
+        if end > start:
+            busy += end - start
+            cursor = end
+    return max(0.0, span.end - span.start - busy)
+
+
+def _critical_path(
+    span: Span, limit: float, labels: dict[str, str], out: list[tuple[str, float]]
+) -> None:
+    """span の区間のうち limit までを終わりから遡り、待ちの原因になったspanに時間を割り当てる"""
+    cursor = min(span.end, limit)
+    label = labels[span.span_id]
+    # 終わりの遅い子から順に、cursor より前に始まったものを待ちの原因とする
+    for child in sorted(span.children, key=lambda c: c.end, reverse=True):
+        if cursor <= span.start:
+            break
+        if child.start >= cursor or child.end <= span.start:
+            continue
+        end = min(child.end, cursor)
+        if cursor > end:
+            out.append((label, cursor - end))
+        _critical_path(child, end, labels, out)
+        cursor = max(child.start, span.start)
+    if cursor > span.start:
+        out.append((label, cursor - span.start))
+
+
+@dataclass
+class Invocation:
+    trace_id: str
+    root: str
+    seconds: float
+    self_time: dict[str, float]
+    critical: list[tuple[str, float]]
+
+    def critical_by_stage(self) -> dict[str, float]:
+        totals: dict[str, float] = {}
+        for label, seconds in self.critical:
+            totals[label] = totals.get(label, 0.0) + seconds
+        return totals
+
+
+def analyze_trace(trace_id: str, spans: list[Span]) -> list[Invocation]:
+    """1つのトレースのspanから木を組み立てる。親が見つからないspanはそれぞれ1つの呼び出しの根とする"""
+    by_id = {span.span_id: span for span in spans}
+    roots = []
+    for span in spans:
+        span.children.clear()
+    for span in spans:
+        parent = by_id.get(span.parent_id) if span.parent_id else None
+        if parent is None or parent is span:
+            roots.append(span)
+        else:
+            parent.children.append(span)
+
+    invocations = []
+    for root in roots:
+        labels: dict[str, str] = {}
+        self_time: dict[str, float] = {}
+        stack: list[tuple[Span, str | None]] = [(root, None)]
+        while stack:
+            span, parent_label = stack.pop()
+            label = labels[span.span_id] = _label(span, parent_label)
+            self_time[label] = self_time.get(label, 0.0) + _self_time(span)
+            stack.extend((child, label) for child in span.children)
+        critical: list[tuple[str, float]] = []
+        _critical_path(root, root.end, labels, critical)
+        critical.reverse()
+        invocations.append(
+            Invocation(trace_id, root.name, root.end - root.start, self_time, critical)
+        )
+    return invocations
+
+
+class TraceAssembler:
+    """時刻順に近い順序で届くspanをトレースごとにまとめ、完了したトレースから順に返す
+
+    トレースは最後のspanの終了から grace 秒以上新しいspanが届いたら完了とみなす。
+    未完了のトレースが max_open を超えたら、最も古いものから打ち切って返す。
+    """
+
+    def __init__(self, grace: float = 120.0, max_open: int = 100_000) -> None:
+        self.grace = grace
+        self.max_open = max_open
+        self.watermark = 0.0
+        self.forced = 0
+        self._open: OrderedDict[str, tuple[list[Span], float]] = OrderedDict()
+
+    def add(self, trace_id: str, span: Span) -> Iterator[tuple[str, list[Span]]]:
+        spans, last_end = self._open.pop(trace_id, ([], 0.0))
+        spans.append(span)
+        self._open[trace_id] = (spans, max(last_end, span.end))
+        self.watermark = max(self.watermark, span.end)
+        while self._open:
+            oldest, (spans, last_end) = next(iter(self._open.items()))
+            if len(self._open) > self.max_open:
+                self.forced += 1
+            elif self.watermark - last_end <= self.grace:
+                break
+            del self._open[oldest]
+            yield oldest, spans
+
+    def flush(self) -> Iterator[tuple[str, list[Span]]]:
+        while self._open:
+            trace_id, (spans, _) = self._open.popitem(last=False)
+            yield trace_id, spans
+
+
+class Report:
+    """ステージごとの自己時間・クリティカルパス時間のヒストグラムと、最も遅い呼び出し"""
+
+    def __init__(self, top: int = 5) -> None:
+        self.top = top
+        self.invocations = 0
+        self.spans = 0
+        self.total = LogHistogram()
+        self.self_time: dict[str, LogHistogram] = {}
+        self.critical: dict[str, LogHistogram] = {}
+        self.slowest: list[tuple[float, str, list[tuple[str, float]]]] = []
+
+    def add(self, invocation: Invocation) -> None:
+        self.invocations += 1
+        self.total.add(invocation.seconds)
+        for label, seconds in invocation.self_time.items():
+            self.self_time.setdefault(label, LogHistogram()).add(seconds)
+        for label, seconds in invocation.critical_by_stage().items():
+            self.critical.setdefault(label, LogHistogram()).add(seconds)
+        if self.top:
+            entry = (
+                invocation.seconds,
+                invocation.trace_id,
+                _merge_path(invocation.critical),
+            )
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "version": SUMMARY_VERSION,
+            "invocations": self.invocations,
+            "spans": self.spans,
+            "total": self.total.to_dict(),
+            "self_time": {k: v.to_dict() for k, v in self.self_time.items()},
+            "critical": {k: v.to_dict() for k, v in self.critical.items()},
+            "slowest": sorted(self.slowest, reverse=True),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Report":
+        if data.get("version") != SUMMARY_VERSION:
+            raise ValueError(
+                f"未対応の集計ファイルのバージョンです: {data.get('version')}"
+            )
+        report = cls(top=len(data["slowest"]))
+        report.invocations = data["invocations"]
+        report.spans = data["spans"]
+        report.total = LogHistogram.from_dict(data["total"])
+        report.self_time = {
+            k: LogHistogram.from_dict(v) for k, v in data["self_time"].items()
+        }
+        report.critical = {
+            k: LogHistogram.from_dict(v) for k, v in data["critical"].items()
+        }
+        report.slowest = [
+            (s, t, [tuple(p) for p in path]) for s, t, path in data["slowest"]
+        ]
+        return report
+
+
+def _merge_path(path: list[tuple[str, float]]) -> list[tuple[str, float]]:
+    merged: list[tuple[str, float]] = []
+    for label, seconds in path:
+        if merged and merged[-1][0] == label:
+            merged[-1] = (label, merged[-1][1] + seconds)
+        else:
+            merged.append((label, seconds))
+    return merged
+
+
+def analyze(
+    paths: Iterable[str], grace: float = 120.0, max_open: int = 100_000, top: int = 5
+) -> tuple[Report, dict[str, int]]:
+    stats = {"skipped": 0}
+    report = Report(top=top)
+    assembler = TraceAssembler(grace=grace, max_open=max_open)
+
+    def finish(traces: Iterable[tuple[str, list[Span]]]) -> None:
+        for trace_id, spans in traces:
+            report.spans += len(spans)
+            for invocation in analyze_trace(trace_id, spans):
+                report.add(invocation)
+
+    for trace_id, span in read_spans(paths, stats):
+        finish(assembler.add(trace_id, span))
+    finish(assembler.flush())
+    stats["forced"] = assembler.forced
+    return report, stats
+
+
+def load_report(path: str, **kwargs: Any) -> Report:
+    """保存した集計（.json）か、spanのJSONL（.jsonl / .jsonl.gz）から Report を作る"""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            return Report.from_dict(json.load(f))
+    return analyze([path], **kwargs)[0]
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+def format_report(report: Report) -> str:
+    lines = [
+        f"invocations: {report.invocations}  spans: {report.spans}  "
+        f"total p50 {_ms(report.total.quantile(0.5))}ms  p99 {_ms(report.total.quantile(0.99))}ms",
+        "",
+        f"{'stage':<28}{'calls':>8}"
+        + "".join(f"{f'self p{round(q * 100)}':>11}" for q in QUANTILES)
+        + f"{'crit p50':>10}{'crit p99':>10}{'crit %':>8}",
+    ]
+    critical_total = sum(h.sum for h in report.critical.values()) or 1.0
+    order = sorted(
+        report.self_time,
+        key=lambda k: report.critical.get(k, LogHistogram()).sum,
+        reverse=True,
+    )
+    for label in order:
+        self_hist = report.self_time[label]
+        crit = report.critical.get(label, LogHistogram())
+        lines.append(
+            f"{label:<28}{self_hist.count:>8}"
+            + "".join(f"{_ms(self_hist.quantile(q)):>11}" for q in QUANTILES)
+            + f"{_ms(crit.quantile(0.5)):>10}{_ms(crit.quantile(0.99)):>10}"
+            + f"{crit.sum / critical_total:>8.1%}"
+        )
+    if report.slowest:
+        lines += ["", "slowest invocations (critical path):"]
+        for seconds, trace_id, path in sorted(report.slowest, reverse=True):
+            steps = " → ".join(f"{label} {_ms(s)}" for label, s in path)
+            lines.append(f"  {_ms(seconds)}ms {trace_id}: {steps}")
+    return "\n".join(lines)
+
+
+@dataclass
+class Regression:
+    stage: str
+    quantile: float
+    baseline: float
+    candidate: float
+
+    @property
+    def change(self) -> float:
+        return self.candidate / self.baseline - 1 if self.baseline else math.inf
+
+
+def compare(
+    baseline: Report,
+    candidate: Report,
+    threshold: float = 0.1,
+    min_delta: float = 0.005,
+    quantiles: tuple[float, ...] = (0.5, 0.95, 0.99),
+) -> list[Regression]:
+    """候補の自己時間（と全体）のパーセンタイルが threshold 以上かつ min_delta 秒以上悪化したもの"""
+    regressions = []
+    pairs = [
+        ("total", baseline.total, candidate.total),
+        *(
+            (label, baseline.self_time.get(label, LogHistogram()), hist)
+            for label, hist in candidate.self_time.items()
+        ),
+    ]
+    for label, before, after in pairs:
+        for q in quantiles:
+            b, a = before.quantile(q), after.quantile(q)
+            if a - b >= min_delta and (not b or a / b - 1 >= threshold):
+                regressions.append(Regression(label, q, b, a))
+    return regressions
+
+
+def format_diff(
+    baseline: Report, candidate: Report, regressions: list[Regression]
+) -> str:
+    flagged = {(r.stage, r.quantile) for r in regressions}
+    labels = ["total", *sorted(set(baseline.self_time) | set(candidate.self_time))]
+    lines = [
+        f"baseline: {baseline.invocations} invocations  candidate: {candidate.invocations} invocations",
+        "",
+        f"{'stage':<28}"
+        + "".join(
+            f"{f'p{round(q * 100)} base':>11}{'cand':>9}{'Δ':>8}"
+            for q in (0.5, 0.95, 0.99)
+        ),
+    ]
+    for label in labels:
+        before = (
+            baseline.total
+            if label == "total"
+            else baseline.self_time.get(label, LogHistogram())
+        )
+        after = (
+            candidate.total
+            if label == "total"
+            else candidate.self_time.get(label, LogHistogram())
+        )
+        row = f"{label:<28}"
+        for q in (0.5, 0.95, 0.99):
+            b, a = before.quantile(q), after.quantile(q)
+            change = f"{a / b - 1:+.0%}" if b else ("new" if a else "")
+            mark = "!" if (label, q) in flagged else ""
+            row += f"{_ms(b):>11}{_ms(a):>9}{change + mark:>8}"
+        lines.append(row)
+    lines += ["", f"regressions: {len(regressions)}"]
+    lines += [
+        f"  {r.stage} p{round(r.quantile * 100)}: {_ms(r.baseline)}ms → {_ms(r.candidate)}ms"
+        for r in regressions
+    ]
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="書き出したspanのクリティカルパスとステージ別の自己時間を集計する"
+    )
+    streaming = argparse.ArgumentParser(add_help=False)
+    streaming.add_argument(
+        "--grace",
+        type=float,
+        default=120.0,
+        help="トレースが完了したとみなすまでの秒数",
+    )
+    streaming.add_argument("--max-open-traces", type=int, default=100_000)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser(
+        "report", parents=[streaming], help="spanのJSONLを集計して表示する"
+    )
+    report_parser.add_argument("paths", nargs="+", help="JSONL（.gz可、- で標準入力）")
+    report_parser.add_argument("--save", help="diff に使う集計結果（JSON）の保存先")
+    report_parser.add_argument(
+        "--top", type=int, default=5, help="表示する最も遅い呼び出しの件数"
+    )
+
+    diff_parser = subparsers.add_parser(
+        "diff", parents=[streaming], help="2つの実行の自己時間のパーセンタイルを比べる"
+    )
+    diff_parser.add_argument("baseline", help="集計結果（.json）またはspanのJSONL")
+    diff_parser.add_argument("candidate", help="集計結果（.json）またはspanのJSONL")
+    diff_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="悪化とみなす変化率"
+    )
+    diff_parser.add_argument(
+        "--min-delta-ms", type=float, default=5.0, help="悪化とみなす最小の差（ミリ秒）"
+    )
+    diff_parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    options = {"grace": args.grace, "max_open": args.max_open_traces}
+    if args.command == "report":
+        report, stats = analyze(args.paths, top=args.top, **options)
+        print(format_report(report))
+        if stats["skipped"] or stats["forced"]:
+            print(
+                f"\nskipped lines: {stats['skipped']}  traces cut off at --max-open-traces: {stats['forced']}"
+            )
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(report.to_dict(), f)
+        return
+
+    baseline = load_report(args.baseline, **options)
+    candidate = load_report(args.candidate, **options)
+    regressions = compare(
+        baseline,
+        candidate,
+        threshold=args.threshold,
+        min_delta=args.min_delta_ms / 1000,
+    )
+    print(format_diff(baseline, candidate, regressions))
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
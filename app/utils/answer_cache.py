@@ -0,0 +1,270 @@
+import hashlib
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from .metrics import REGISTRY
+
+REQUESTS_TOTAL = REGISTRY.counter(
+    "adk_answer_cache_requests_total",
+    "Number of questions answered from the answer cache (hit), by the agent (miss) or not eligible for caching (bypass).",
+    ("result",),
+)
+LATENCY_SAVED_SECONDS = REGISTRY.counter(
+    "adk_answer_cache_latency_saved_seconds_total",
+    "Agent latency avoided by answering from the answer cache.",
+)
+ENTRIES = REGISTRY.gauge(
+    "adk_answer_cache_entries",
+    "Number of answers held in the answer cache.",
+)
+
+# 直前の会話を前提にした質問（指示語・続き・ユーザー自身の情報）
+_CONTEXT_PATTERNS = re.compile(
+    r"それ|これ|あれ|その|この|あの|さっき|先ほど|前の|上の|続き|もっと|もう一度|他に|ほかに|"
+    r"私|僕|俺|わたし|自分|"
+    r"\b(it|this|that|these|those|them|above|previous|earlier|again|more|else|another|"
+    r"i|my|mine|we|our)\b",
+    re.IGNORECASE,
+)
+# 同じ質問でも答えが時刻や日付で変わるもの（get_current_time など）
+_VOLATILE_PATTERNS = re.compile(
+    r"時刻|何時|時間|今日|明日|明後日|昨日|今週|来週|今|現在|"
+    r"what time|\btime\b|\bnow\b|today|tonight|tomorrow|yesterday|current",
+    re.IGNORECASE,
+)
+# 質問の言い回しで、答えを変えない部分
+_BOILERPLATE = re.compile(
+    r"(を|について)?(教えて|おしえて)|ください|下さい|でしょうか|ですか|とは"
+)
+_STOPWORDS = frozenset(
+    "a an the is are was were what whats how do does can could would please tell me about "
+    "in on at of for to and or".split()
+)
+# 数字の小数点（2.5 など）以外の記号は区切りとして扱う
+_PUNCTUATION = re.compile(r"(?!(?<=\d)\.(?=\d))[^\w\s]")
+_TOKEN = re.compile(
+    r"[a-z0-9][a-z0-9.]*|[\u30a0-\u30ff\u4e00-\u9fff\u3400-\u4dbf]+|[\u3040-\u309f]+"
+)
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize(text: str) -> str:
+    """全角・半角や大文字小文字、記号、空白の違いをなくす"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION.sub(" ", text.replace("'", ""))
+    return " ".join(text.split())
+
+
+def shingles(text: str) -> set[str]:
+    """正規化した質問の特徴集合
+
+    英数字は単語（よくある疑問詞・冠詞を除く）、漢字とカタカナの並びは2文字ずつに分ける。
+    ひらがなは助詞や語尾がほとんどなので、他に特徴が無いときだけ使う。
+    """
+    features: set[str] = set()
+    kana: set[str] = set()
+    for token in _TOKEN.findall(_BOILERPLATE.sub(" ", text)):
+        if token[0].isascii():
+            if token not in _STOPWORDS:
+                features.add(token)
+            continue
+        target = kana if "\u3040" <= token[0] <= "\u309f" else features
+        if len(token) == 1:
+            target.add(token)
+        else:
+            target.update(token[i : i + 2] for i in range(len(token) - 1))
+    return features or kana
+
+
+def is_context_dependent(question: str) -> bool:
+    """直前の会話やユーザーに依存する、または時刻で答えが変わる質問か"""
+    text = unicodedata.normalize("NFKC", question)
+    return bool(_CONTEXT_PATTERNS.search(text) or _VOLATILE_PATTERNS.search(text))
+
+
+def _hash(feature: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, seed: int = 1) -> None:
+        rng = random.Random(seed)
+        self.params = [
+            (rng.randrange(1, _MERSENNE), rng.randrange(0, _MERSENNE))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, features: set[str]) -> tuple[int, ...]:
+        hashes = [_hash(f) for f in features]
+        return tuple(
+            min((a * h + b) % _MERSENNE for h in hashes) for a, b in self.params
+        )
+
+
+def jaccard(a: set[str], b: set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    prompt_version: str
+    features: set[str]
+    signature: tuple[int, ...]
+    created_at: float
+    # 元の回答の生成にかかった時間（キャッシュから返したときに節約できた時間）
+    seconds: float
+    hits: int = 0
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    latency_saved: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class AnswerCache:
+    """ユーザーをまたいで、ほぼ同じ質問への回答を使い回すキャッシュ
+
+    質問を正規化して特徴集合に分け、MinHash と LSH（bands x rows）で候補を探し、
+    特徴集合の Jaccard 係数が threshold 以上で ttl 秒以内の回答を返す。
+    直前の会話に依存する質問や時刻で答えが変わる質問は対象外。質問の文面から判断できないため、
+    会話の途中（in_conversation=True）の質問も対象外にする。
+    プロンプトのバージョンが変わると、それまでの回答はすべて破棄する。
+    """
+
+    def __init__(
+        self,
+        ttl: float = 900.0,
+        threshold: float = 0.7,
+        max_entries: int = 10000,
+        bands: int = 16,
+        rows: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = rows
+        self.clock = clock
+        self.hasher = MinHasher(bands * rows)
+        self.stats = CacheStats()
+        self.prompt_version = ""
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._buckets: dict[tuple[int, tuple[int, ...]], set[int]] = {}
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def _bands(self, signature: tuple[int, ...]) -> list[tuple[int, tuple[int, ...]]]:
+        return [
+            (band, signature[band * self.rows : (band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def _set_version(self, prompt_version: str) -> None:
+        # self._lock を保持した状態で呼ぶ
+        if prompt_version != self.prompt_version:
+            self._entries.clear()
+            self._buckets.clear()
+            self.prompt_version = prompt_version
+            ENTRIES.set(0)
+
+    def _remove(self, entry_id: int) -> None:
+        # self._lock を保持した状態で呼ぶ
+        entry = self._entries.pop(entry_id)
+        for key in self._bands(entry.signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def lookup(
+        self, question: str, prompt_version: str, in_conversation: bool = False
+    ) -> CachedAnswer | None:
+        if in_conversation or is_context_dependent(question):
+            with self._lock:
+                self.stats.bypassed += 1
+            REQUESTS_TOTAL.inc(result="bypass")
+            return None
+        features = shingles(normalize(question))
+        signature = self.hasher.signature(features) if features else ()
+        now = self.clock()
+        best: tuple[float, int] | None = None
+        with self._lock:
+            self._set_version(prompt_version)
+            candidates = set()
+            for key in self._bands(signature) if signature else ():
+                candidates |= self._buckets.get(key, set())
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                similarity = jaccard(features, entry.features)
+                if similarity >= self.threshold and (
+                    best is None or similarity > best[0]
+                ):
+                    best = (similarity, entry_id)
+            ENTRIES.set(len(self._entries))
+            if best is None:
+                self.stats.misses += 1
+                REQUESTS_TOTAL.inc(result="miss")
+                return None
+            entry = self._entries[best[1]]
+            entry.hits += 1
+            self.stats.hits += 1
+            self.stats.latency_saved += entry.seconds
+        REQUESTS_TOTAL.inc(result="hit")
+        LATENCY_SAVED_SECONDS.inc(entry.seconds)
+        return entry
+
+    def store(
+        self,
+        question: str,
+        answer: str,
+        prompt_version: str,
+        seconds: float,
+        in_conversation: bool = False,
+    ) -> bool:
+        if not answer or in_conversation or is_context_dependent(question):
+            return False
+        features = shingles(normalize(question))
+        if not features:
+            return False
+        entry = CachedAnswer(
+            question,
+            answer,
+            prompt_version,
+            features,
+            self.hasher.signature(features),
+            self.clock(),
+            seconds,
+        )
+        with self._lock:
+            self._set_version(prompt_version)
+            self._ids += 1
+            self._entries[self._ids] = entry
+            for key in self._bands(entry.signature):
+                self._buckets.setdefault(key, set()).add(self._ids)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            ENTRIES.set(len(self._entries))
+        return True
@@ -0,0 +1,405 @@
+import asyncio
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import Callable, Coroutine
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from pathlib import Path
+from typing import Any, TypeVar
+
+from google.adk.artifacts import BaseArtifactService
+from google.genai import types as genai_types
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CACHE_REQUESTS_TOTAL = REGISTRY.counter(
+    "adk_artifact_cache_requests_total",
+    "Number of artifact loads served from the local cache or the backing store.",
+    ("result",),
+)
+CACHE_BYTES = REGISTRY.gauge(
+    "adk_artifact_cache_bytes",
+    "Bytes of artifacts held in the local disk cache.",
+)
+PENDING_UPLOADS = REGISTRY.gauge(
+    "adk_artifact_pending_uploads",
+    "Number of artifact saves not yet written to the backing store.",
+)
+UPLOAD_ERRORS_TOTAL = REGISTRY.counter(
+    "adk_artifact_upload_errors_total",
+    "Number of write-behind uploads that failed.",
+)
+
+# (app_name, user_id, session_id, filename, version)
+ArtifactKey = tuple[str, str, str, str, int]
+
+
+class DiskLruCache:
+    """サイズ上限付きのLRUディスクキャッシュ。pin したキーは追い出さない"""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._pinned: dict[str, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        # 前回のプロセスが残したファイルも古い順に引き継ぐ
+        files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            self._entries[path.stem] = path.stat().st_size
+            self._size += path.stat().st_size
+        self._evict()
+
+    @staticmethod
+    def _name(key: ArtifactKey) -> str:
+        return hashlib.sha256("\0".join(map(str, key)).encode()).hexdigest()
+
+    def get(self, key: ArtifactKey) -> genai_types.Part | None:
+        name = self._name(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            data = (self.directory / f"{name}.json").read_bytes()
+            return genai_types.Part.model_validate_json(data)
+        except FileNotFoundError:
+            self._forget(name)
+            return None
+
+    def put(self, key: ArtifactKey, part: genai_types.Part, pin: bool = False) -> None:
+        name = self._name(key)
+        data = part.model_dump_json(exclude_none=True).encode()
+        path = self.directory / f"{name}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            if pin:
+                self._pinned[name] = self._pinned.get(name, 0) + 1
+            self._evict()
+
+    def unpin(self, key: ArtifactKey) -> None:
+        name = self._name(key)
+        with self._lock:
+            count = self._pinned.pop(name, 0) - 1
+            if count > 0:
+                self._pinned[name] = count
+            self._evict()
+
+    def discard(self, key: ArtifactKey) -> None:
+        name = self._name(key)
+        self._forget(name)
+        (self.directory / f"{name}.json").unlink(missing_ok=True)
+
+    def _forget(self, name: str) -> None:
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            CACHE_BYTES.set(self._size)
+
+    def _evict(self) -> None:
+        # self._lock を保持した状態で呼ぶ
+        for name in list(self._entries):
+            if self._size <= self.max_bytes:
+                break
+            if name in self._pinned:
+                continue
+            self._size -= self._entries.pop(name)
+            (self.directory / f"{name}.json").unlink(missing_ok=True)
+        CACHE_BYTES.set(self._size)
+
+
+class CachedArtifactService(BaseArtifactService):
+    """GcsArtifactService などの前段に置く、読み込みキャッシュと非同期書き込みのラッパー
+
+    アップロードは同じファイルの保存順にバックグラウンドのスレッドで行う。
+    write_behind=True のときは保存をローカルのキャッシュに書いた時点で返し、
+    未送信分は close / 終了時（atexit）に書き出す。SIGTERM などで atexit が
+    走らないと未送信分は失われるため、既定ではアップロードの完了を待ってから返す。
+    バックエンドの呼び出しは同期I/Oを含むため、イベントループを止めないよう別スレッドで実行する。
+    """
+
+    def __init__(
+        self,
+        inner: BaseArtifactService,
+        cache_dir: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        upload_workers: int = 4,
+        versions_ttl: float = 30.0,
+        write_behind: bool = False,
+    ) -> None:
+        self.inner = inner
+        self.cache = DiskLruCache(cache_dir, max_bytes)
+        self.versions_ttl = versions_ttl
+        self.write_behind = write_behind
+        self._executor = ThreadPoolExecutor(
+            upload_workers, thread_name_prefix="artifact-upload"
+        )
+        self._lock = threading.Lock()
+        # (app, user, session, filename) -> (取得時刻, バージョン一覧)
+        self._versions: dict[tuple[str, str, str, str], tuple[float, set[int]]] = {}
+        # (app, user, session, filename) -> 最後に積んだアップロード
+        self._uploads: dict[tuple[str, str, str, str], Future] = {}
+        self._pending: set[Future] = set()
+        _services.add(self)
+
+    @staticmethod
+    def _file(
+        app_name: str, user_id: str, session_id: str, filename: str
+    ) -> tuple[str, str, str, str]:
+        # "user:" で始まるファイルはセッションをまたいでユーザー単位で共有される
+        if filename.startswith("user:"):
+            session_id = "user"
+        return app_name, user_id, session_id, filename
+
+    async def _call_inner(
+        self, method: Callable[..., Coroutine[Any, Any, T]], **kwargs: Any
+    ) -> T:
+        return await asyncio.to_thread(lambda: asyncio.run(method(**kwargs)))
+
+    async def _known_versions(self, file: tuple[str, str, str, str]) -> set[int]:
+        with self._lock:
+            cached = self._versions.get(file)
+            upload = self._uploads.get(file)
+        if cached and (upload or time.monotonic() - cached[0] < self.versions_ttl):
+            return set(cached[1])
+
+        app_name, user_id, session_id, filename = file
+        remote = await self._call_inner(
+            self.inner.list_versions,
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=filename,
+        )
+        with self._lock:
+            # アップロード待ちのバージョンはバックエンドにまだ無いので残す
+            local = self._versions.get(file, (0.0, set()))[1]
+            versions = set(remote) | (local if file in self._uploads else set())
+            self._versions[file] = (time.monotonic(), versions)
+        return set(versions)
+
+    async def save_artifact(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        artifact: genai_types.Part,
+    ) -> int:
+        file = self._file(app_name, user_id, session_id, filename)
+        known = await self._known_versions(file)
+        with self._lock:
+            # 同じファイルへの同時保存でも番号が重ならないよう、ロック内で採番する
+            versions = self._versions.get(file, (0.0, known))[1]
+            version = max(versions) + 1 if versions else 0
+            self._versions[file] = (time.monotonic(), versions | {version})
+            self.cache.put((*file, version), artifact, pin=True)
+            previous = self._uploads.get(file)
+            future = self._executor.submit(
+                self._upload, previous, file, version, app_name, session_id, artifact
+            )
+            self._uploads[file] = future
+            self._pending.add(future)
+            PENDING_UPLOADS.set(len(self._pending))
+        future.add_done_callback(lambda f: self._upload_done(file, version, f))
+        if self.write_behind:
+            return version
+        # バックエンドに書き込んでから返す（採番がずれていればバックエンドの番号を返す）
+        return await asyncio.wrap_future(future)
+
+    def _upload(
+        self,
+        previous: Future | None,
+        file: tuple[str, str, str, str],
+        version: int,
+        app_name: str,
+        session_id: str,
+        artifact: genai_types.Part,
+    ) -> int:
+        # 同じファイルは保存した順にアップロードし、バックエンド側の採番と揃える
+        if previous is not None:
+            wait_futures([previous])
+        uploaded = asyncio.run(
+            self.inner.save_artifact(
+                app_name=app_name,
+                user_id=file[1],
+                session_id=session_id,
+                filename=file[3],
+                artifact=artifact,
+            )
+        )
+        if uploaded != version:
+            # 他のプロセスが同じファイルに書き込んだ。ローカルの番号ではもう読めないので、
+            # キャッシュから外し、次の参照でバックエンドのバージョン一覧を取り直す
+            logger.warning(
+                "アーティファクトのバージョンがずれました: %s (local=%d, remote=%d)",
+                "/".join(file),
+                version,
+                uploaded,
+            )
+            self.cache.discard((*file, version))
+            with self._lock:
+                self._versions.pop(file, None)
+        return uploaded
+
+    def _upload_done(
+        self, file: tuple[str, str, str, str], version: int, future: Future
+    ) -> None:
+        self.cache.unpin((*file, version))
+        with self._lock:
+            self._pending.discard(future)
+            PENDING_UPLOADS.set(len(self._pending))
+            if self._uploads.get(file) is future:
+                del self._uploads[file]
+        if future.exception() is not None:
+            # バックエンドにこのバージョンは作られていない。ローカルの内容と番号を捨て、
+            # 次の保存・読み込みでバックエンドのバージョン一覧を取り直す
+            self.cache.discard((*file, version))
+            with self._lock:
+                self._versions.pop(file, None)
+            UPLOAD_ERRORS_TOTAL.inc()
+            logger.error(
+                "アーティファクトのアップロードに失敗しました: %s",
+                "/".join(file),
+                exc_info=future.exception(),
+            )
+
+    async def load_artifact(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filename: str,
+        version: int | None = None,
+    ) -> genai_types.Part | None:
+        file = self._file(app_name, user_id, session_id, filename)
+        if version is None:
+            versions = await self._known_versions(file)
+            if not versions:
+                return None
+            version = max(versions)
+
+        part = self.cache.get((*file, version))
+        if part is not None:
+            CACHE_REQUESTS_TOTAL.inc(result="hit")
+            return part
+
+        CACHE_REQUESTS_TOTAL.inc(result="miss")
+        part = await self._call_inner(
+            self.inner.load_artifact,
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=filename,
+            version=version,
+        )
+        if part is not None:
+            self.cache.put((*file, version), part)
+        return part
+
+    async def load_artifacts(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        filenames: list[str],
+    ) -> dict[str, genai_types.Part | None]:
+        """複数のアーティファクトの最新版を並列に読み込む"""
+        parts = await asyncio.gather(
+            *(
+                self.load_artifact(
+                    app_name=app_name,
+                    user_id=user_id,
+                    session_id=session_id,
+                    filename=filename,
+                )
+                for filename in filenames
+            )
+        )
+        return dict(zip(filenames, parts, strict=True))
+
+    async def list_artifact_keys(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> list[str]:
+        remote = await self._call_inner(
+            self.inner.list_artifact_keys,
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+        )
+        with self._lock:
+            pending = {
+                file[3]
+                for file in self._uploads
+                if file[:2] == (app_name, user_id) and file[2] in (session_id, "user")
+            }
+        return sorted(set(remote) | pending)
+
+    async def delete_artifact(
+        self, *, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> None:
+        file = self._file(app_name, user_id, session_id, filename)
+        with self._lock:
+            upload = self._uploads.get(file)
+        if upload is not None:
+            await asyncio.wrap_future(upload)
+        versions = await self._known_versions(file)
+        await self._call_inner(
+            self.inner.delete_artifact,
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=filename,
+        )
+        with self._lock:
+            self._versions.pop(file, None)
+        for version in versions:
+            self.cache.discard((*file, version))
+
+    async def list_versions(
+        self, *, app_name: str, user_id: str, session_id: str, filename: str
+    ) -> list[int]:
+        file = self._file(app_name, user_id, session_id, filename)
+        return sorted(await self._known_versions(file))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """未送信のアップロードがすべて終わるまで待つ。時間内に終わったかを返す"""
+        with self._lock:
+            pending = list(self._pending)
+        _, not_done = wait_futures(pending, timeout)
+        return not not_done
+
+    def close(self) -> None:
+        if not self.flush(timeout=60):
+            logger.error("アップロードされていないアーティファクトがあります")
+        self._executor.shutdown(wait=False)
+        _services.discard(self)
+
+
+# 終了時に未送信のアップロードを書き出すサービス。インスタンスごとに atexit に登録すると
+# 破棄されたサービスも参照され続けるため、弱参照で持っておく
+_services: weakref.WeakSet[CachedArtifactService] = weakref.WeakSet()
+
+
+@atexit.register
+def _close_all() -> None:
+    for service in list(_services):
+        service.close()
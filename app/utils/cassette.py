@@ -0,0 +1,298 @@
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.base_llm_connection import BaseLlmConnection
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types as genai_types
+from pydantic_core import to_jsonable_python
+
+from .fake_llm import content_text
+
+logger = logging.getLogger(__name__)
+
+MODES = ("replay", "record", "auto")
+
+
+class CassetteMiss(LookupError):
+    """再生モードで、リクエストに対応する記録がカセットに無い"""
+
+
+def _strip(value: Any) -> Any:
+    # ADK がクライアント側で振る関数呼び出しIDや署名は実行ごとに変わるのでキーから除く
+    if isinstance(value, dict):
+        return {
+            k: _strip(v)
+            for k, v in value.items()
+            if k not in ("id", "thought_signature")
+        }
+    if isinstance(value, list):
+        return [_strip(v) for v in value]
+    return value
+
+
+def _without_tool_results(part: dict[str, Any]) -> dict[str, Any]:
+    if "function_response" in part:
+        return {"function_response": {"name": part["function_response"].get("name")}}
+    return part
+
+
+def request_keys(llm_request: LlmRequest, model: str) -> tuple[str, str]:
+    """(完全一致のキー, ツールの結果を除いて照合する緩いキー) を返す"""
+    config = llm_request.config
+    instruction = config.system_instruction if config else None
+    if instruction is not None and not isinstance(instruction, str):
+        instruction = json.dumps(
+            _strip(to_jsonable_python(instruction, by_alias=False, exclude_none=True))
+        )
+    tools = sorted(llm_request.tools_dict)
+    if config and config.tools:
+        tools += [
+            json.dumps(tool.model_dump(mode="json", exclude_none=True), sort_keys=True)
+            for tool in config.tools
+            if isinstance(tool, genai_types.Tool) and not tool.function_declarations
+        ]
+    contents = [
+        _strip(content.model_dump(mode="json", exclude_none=True))
+        for content in llm_request.contents
+    ]
+    head = json.dumps([model, instruction, tools], sort_keys=True, ensure_ascii=False)
+    exact = hashlib.sha256(
+        (head + json.dumps(contents, sort_keys=True, ensure_ascii=False)).encode()
+    ).hexdigest()[:24]
+    # ツールの結果（現在時刻など）が変わっても、同じ位置の呼び出しとして再生できるようにする
+    # ユーザーとモデルの発言はそのまま含める
+    relaxed = [
+        {
+            **content,
+            "parts": [_without_tool_results(p) for p in content.get("parts", [])],
+        }
+        for content in contents
+    ]
+    loose = hashlib.sha256(
+        (head + json.dumps(relaxed, sort_keys=True, ensure_ascii=False)).encode()
+    ).hexdigest()[:24]
+    return exact, loose
+
+
+@dataclass
+class Interaction:
+    key: str
+    loose: str
+    model: str
+    stream: bool
+    prompt: str
+    # リクエストに登録されていたツール名と、会話の長さ（ベンチマークで再生するプロンプトを選ぶため）
+    tools: list[str] = field(default_factory=list)
+    turns: int = 0
+    # (呼び出し開始からの秒数, LlmResponse のJSON)
+    chunks: list[tuple[float, dict[str, Any]]] = field(default_factory=list)
+    used: bool = False
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "k": self.key,
+                "l": self.loose,
+                "m": self.model,
+                "s": self.stream,
+                "q": self.prompt,
+                "t": self.tools,
+                "n": self.turns,
+                "r": [[round(t, 4), r] for t, r in self.chunks],
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, line: str) -> "Interaction":
+        row = json.loads(line)
+        return cls(
+            row["k"],
+            row["l"],
+            row["m"],
+            row["s"],
+            row["q"],
+            row["t"],
+            row["n"],
+            [tuple(c) for c in row["r"]],
+        )
+
+
+class Cassette:
+    """モデル呼び出しの記録（gzip圧縮したJSONL、1行1リクエスト）
+
+    同じキーのリクエストが複数回記録されていれば記録順に返し、使い切ったら最後の記録を返す。
+    完全一致が無ければ、ツールの結果だけが異なる記録を順に使う。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.interactions: list[Interaction] = []
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._by_key: dict[str, list[Interaction]] = {}
+        self._by_loose: dict[str, list[Interaction]] = {}
+        if self.path.exists():
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._index(Interaction.from_json(line))
+
+    def _index(self, interaction: Interaction) -> None:
+        self.interactions.append(interaction)
+        self._by_key.setdefault(interaction.key, []).append(interaction)
+        self._by_loose.setdefault(interaction.loose, []).append(interaction)
+
+    def find(self, key: str, loose: str) -> Interaction | None:
+        with self._lock:
+            for matches in (self._by_key.get(key), self._by_loose.get(loose)):
+                if matches:
+                    found = next((i for i in matches if not i.used), matches[-1])
+                    found.used = True
+                    return found
+        return None
+
+    def add(self, interaction: Interaction) -> None:
+        with self._lock:
+            interaction.used = True
+            self._index(interaction)
+            self.dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self.dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            # mtime を固定し、内容が同じなら同じバイト列になるようにする
+            with (
+                open(tmp, "wb") as raw,
+                gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f,
+            ):
+                for interaction in self.interactions:
+                    f.write(interaction.to_json().encode() + b"\n")
+            os.replace(tmp, self.path)
+            self.dirty = False
+        logger.info(
+            f"[Cassette] {len(self.interactions)} 件を {self.path} に保存しました"
+        )
+
+    def rewind(self) -> None:
+        with self._lock:
+            for interaction in self.interactions:
+                interaction.used = False
+
+
+_cassettes: dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def open_cassette(path: str) -> Cassette:
+    """同じパスのカセットはプロセス内で1つを共有する"""
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path)
+        return cassette
+
+
+@atexit.register
+def save_all() -> None:
+    with _cassettes_lock:
+        cassettes = list(_cassettes.values())
+    for cassette in cassettes:
+        cassette.save()
+
+
+class CassetteLlm(BaseLlm):
+    """モデルの応答をカセットに記録・再生するラッパー
+
+    replay: 記録だけを返し、無ければ CassetteMiss を送出する（内側のモデルは呼ばない）
+    record: 常に内側のモデルを呼び、応答を記録する
+    auto: 記録があれば再生し、無ければ内側のモデルを呼んで記録する
+
+    timing が0より大きいと、記録時の応答間隔に timing を掛けた時間だけ待ってから返す。
+    """
+
+    inner: BaseLlm
+    path: str
+    mode: str = "replay"
+    timing: float = 0.0
+
+    def __init__(self, inner: BaseLlm, **kwargs: Any) -> None:
+        if kwargs.get("mode", "replay") not in MODES:
+            raise ValueError(f"mode は {MODES} のいずれかです: {kwargs['mode']}")
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        cassette = open_cassette(self.path)
+        model = llm_request.model or self.model
+        key, loose = request_keys(llm_request, model)
+
+        if self.mode != "record":
+            interaction = cassette.find(key, loose)
+            if interaction is not None:
+                async for response in self._replay(interaction, stream):
+                    yield response
+                return
+            if self.mode == "replay":
+                raise CassetteMiss(
+                    f"{self.path} に記録がありません（model={model}）。"
+                    "LLM_CASSETTE_MODE=record で記録し直してください"
+                )
+
+        last = llm_request.contents[-1] if llm_request.contents else None
+        interaction = Interaction(
+            key,
+            loose,
+            model,
+            stream,
+            content_text(last)[:200],
+            sorted(llm_request.tools_dict),
+            len(llm_request.contents),
+        )
+        start = time.perf_counter()
+        async for response in self.inner.generate_content_async(
+            llm_request, stream=stream
+        ):
+            interaction.chunks.append(
+                (
+                    time.perf_counter() - start,
+                    response.model_dump(mode="json", exclude_none=True),
+                )
+            )
+            yield response
+        cassette.add(interaction)
+
+    async def _replay(
+        self, interaction: Interaction, stream: bool
+    ) -> AsyncGenerator[LlmResponse, None]:
+        elapsed = 0.0
+        for offset, data in interaction.chunks:
+            response = LlmResponse.model_validate(data)
+            # ストリーミングで記録した呼び出しを非ストリーミングで再生するときは部分応答を飛ばす
+            if response.partial and not stream:
+                continue
+            if self.timing > 0 and offset > elapsed:
+                await asyncio.sleep((offset - elapsed) * self.timing)
+                elapsed = offset
+            yield response
+
+    def connect(self, llm_request: LlmRequest) -> BaseLlmConnection:
+        return self.inner.connect(llm_request)
@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections.abc import AsyncGenerator, Callable, Coroutine
+from dataclasses import dataclass
+from typing import Any
+
+from google.adk.models import Gemini
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.base_llm_connection import BaseLlmConnection
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
+
+from .fake_llm import estimate_tokens
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REQUESTS_TOTAL = REGISTRY.counter(
+    "adk_context_cache_requests_total",
+    "Number of model calls by context cache result (hit, miss, skipped, fallback).",
+    ("result",),
+)
+OPERATIONS_TOTAL = REGISTRY.counter(
+    "adk_context_cache_operations_total",
+    "Number of cached-content API calls by operation and status.",
+    ("op", "status"),
+)
+HANDLES = REGISTRY.gauge(
+    "adk_context_cache_handles",
+    "Number of live cached-content handles held by this process.",
+)
+
+# (モデル, プロンプトバージョン, 固定部分のハッシュ)
+CacheKey = tuple[str, str, str]
+
+
+@dataclass
+class CacheHandle:
+    name: str
+    expires_at: float
+    tokens: int = 0
+    renewing: bool = False
+
+
+def _expires_at(cached: genai_types.CachedContent, fallback: float) -> float:
+    return cached.expire_time.timestamp() if cached.expire_time else fallback
+
+
+def _genai_tools(
+    config: genai_types.GenerateContentConfig,
+) -> list[genai_types.Tool] | None:
+    """キャッシュに載せられるツール定義。関数や MCP セッションが混ざっている場合は None"""
+    tools = [tool for tool in config.tools or [] if isinstance(tool, genai_types.Tool)]
+    return tools if len(tools) == len(config.tools or []) else None
+
+
+def is_cache_error(error: BaseException) -> bool:
+    """キャッシュが期限切れ・削除済み・使えない場合のエラーか"""
+    if not isinstance(error, genai_errors.ClientError):
+        return False
+    if error.code in (403, 404):
+        return True
+    return error.code == 400 and "cache" in str(error).lower()
+
+
+class ContextCacheManager:
+    """エージェントの固定部分（インストラクションとツール定義）の cached content を管理する
+
+    ハンドルは (モデル, プロンプトバージョン, 固定部分のハッシュ) ごとに1つ作り、
+    残りTTLが renew_before を切ったらバックグラウンドで延長する。
+    作成・延長はリクエストを待たせないよう非同期に行い、その間の呼び出しはキャッシュなしで送る。
+    プロンプトのバージョンが変わったら、同じプロンプトの古いハンドルは削除する。
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        renew_before: float = 300.0,
+        min_tokens: int = 1024,
+        max_handles: int = 32,
+        retry_after: float = 60.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl = ttl
+        self.renew_before = renew_before
+        # Gemini は一定以上のトークン数でないとキャッシュを作れない
+        self.min_tokens = min_tokens
+        self.max_handles = max_handles
+        self.retry_after = retry_after
+        self.clock = clock
+        self._handles: dict[CacheKey, CacheHandle] = {}
+        self._creating: set[CacheKey] = set()
+        # 作成に失敗したキー -> 次に試してよい時刻
+        self._failed: dict[CacheKey, float] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def key(
+        self, model: str, prompt_version: str, prefix: dict[str, Any]
+    ) -> tuple[CacheKey, int]:
+        text = json.dumps(prefix, sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+        return (model, prompt_version, digest), estimate_tokens(text)
+
+    def lookup(
+        self, caches: Any, key: CacheKey, config: genai_types.GenerateContentConfig
+    ) -> str | None:
+        """使えるハンドル名を返す。無ければ作成を予約して None を返す"""
+        now = self.clock()
+        handle = self._handles.get(key)
+        # 送信中に期限が切れないよう、残りが少ないハンドルは使わない
+        if handle and handle.expires_at - now > min(60.0, self.renew_before / 2):
+            if handle.expires_at - now < self.renew_before and not handle.renewing:
+                handle.renewing = True
+                self._spawn(self._renew(caches, key, handle))
+            return handle.name
+
+        if handle:
+            self._forget(key)
+        if (
+            key not in self._creating
+            and self._failed.get(key, 0.0) <= now
+            and len(self._handles) + len(self._creating) < self.max_handles
+        ):
+            self._creating.add(key)
+            self._spawn(self._create(caches, key, config))
+        return None
+
+    def invalidate(self, key: CacheKey, name: str) -> None:
+        handle = self._handles.get(key)
+        if handle and handle.name == name:
+            self._forget(key)
+
+    async def drain(self) -> None:
+        """実行中の作成・延長・削除が終わるまで待つ（テスト・終了処理用）"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _forget(self, key: CacheKey) -> None:
+        self._handles.pop(key, None)
+        HANDLES.set(len(self._handles))
+
+    async def _create(
+        self, caches: Any, key: CacheKey, config: genai_types.GenerateContentConfig
+    ) -> None:
+        model, prompt_version, _ = key
+        try:
+            cached = await caches.create(
+                model=model,
+                config=genai_types.CreateCachedContentConfig(
+                    display_name=f"{prompt_version}"[:128],
+                    system_instruction=config.system_instruction,
+                    tools=_genai_tools(config) or None,
+                    tool_config=config.tool_config,
+                    ttl=f"{int(self.ttl)}s",
+                ),
+            )
+        except Exception as e:
+            OPERATIONS_TOTAL.inc(op="create", status="error")
+            self._failed[key] = self.clock() + self.retry_after
+            logger.warning(
+                f"[ContextCache] キャッシュを作成できませんでした ({prompt_version}): {e}"
+            )
+            return
+        finally:
+            self._creating.discard(key)
+
+        OPERATIONS_TOTAL.inc(op="create", status="ok")
+        self._failed.pop(key, None)
+        tokens = cached.usage_metadata.total_token_count if cached.usage_metadata else 0
+        self._handles[key] = CacheHandle(
+            cached.name, _expires_at(cached, self.clock() + self.ttl), tokens or 0
+        )
+        HANDLES.set(len(self._handles))
+        logger.info(f"[ContextCache] {cached.name} を作成しました ({prompt_version})")
+
+        # 同じモデル・同じプロンプトの古いバージョンは使われなくなるので消す
+        name = prompt_version.rsplit(":", 1)[0]
+        for old in [
+            k
+            for k in self._handles
+            if k != key and k[0] == model and k[1].rsplit(":", 1)[0] == name
+        ]:
+            self._spawn(self._delete(caches, self._handles.pop(old).name))
+        HANDLES.set(len(self._handles))
+
+    async def _renew(self, caches: Any, key: CacheKey, handle: CacheHandle) -> None:
+        try:
+            cached = await caches.update(
+                name=handle.name,
+                config=genai_types.UpdateCachedContentConfig(ttl=f"{int(self.ttl)}s"),
+            )
+        except Exception as e:
+            OPERATIONS_TOTAL.inc(op="renew", status="error")
+            logger.warning(f"[ContextCache] {handle.name} を延長できませんでした: {e}")
+            # 次の呼び出しで作り直す
+            self.invalidate(key, handle.name)
+            return
+        finally:
+            handle.renewing = False
+        OPERATIONS_TOTAL.inc(op="renew", status="ok")
+        handle.expires_at = _expires_at(cached, self.clock() + self.ttl)
+
+    async def _delete(self, caches: Any, name: str) -> None:
+        try:
+            await caches.delete(name=name)
+            OPERATIONS_TOTAL.inc(op="delete", status="ok")
+        except Exception as e:
+            OPERATIONS_TOTAL.inc(op="delete", status="error")
+            logger.info(f"[ContextCache] {name} を削除できませんでした: {e}")
+
+
+manager = ContextCacheManager()
+
+
+def configure(**kwargs: Any) -> None:
+    global manager
+    manager = ContextCacheManager(**kwargs)
+
+
+class ContextCachingLlm(BaseLlm):
+    """インストラクションとツール定義を cached content に載せてモデルを呼び出すラッパー
+
+    キャッシュが使えるときは固定部分をリクエストから外して cached_content で参照する。
+    キャッシュの準備中・固定部分が小さい場合はそのまま送り、
+    キャッシュが期限切れなどで使えなかった場合はキャッシュなしで送り直す。
+    """
+
+    inner: BaseLlm
+    prompt_version: str = ""
+
+    def __init__(self, inner: BaseLlm, **kwargs: Any) -> None:
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    def _caches(self) -> Any:
+        if isinstance(self.inner, Gemini):
+            return self.inner.api_client.aio.caches
+        # フェイクモデルはローカル版のキャッシュAPIを持つ
+        return getattr(self.inner, "caches", None)
+
+    def _cached_request(
+        self, llm_request: LlmRequest
+    ) -> tuple[LlmRequest, CacheKey, str] | None:
+        config = llm_request.config
+        caches = self._caches()
+        if caches is None or config is None or config.cached_content:
+            return None
+        if not config.system_instruction and not config.tools:
+            return None
+        tools = _genai_tools(config)
+        if tools is None:
+            return None
+
+        current = manager
+        prefix = {
+            "system_instruction": config.system_instruction
+            if isinstance(config.system_instruction, str)
+            else genai_types.Content.model_validate(
+                config.system_instruction
+            ).model_dump(mode="json", exclude_none=True),
+            "tools": [
+                tool.model_dump(mode="json", exclude_none=True) for tool in tools
+            ],
+            "tool_config": config.tool_config.model_dump(mode="json", exclude_none=True)
+            if config.tool_config
+            else None,
+        }
+        key, tokens = current.key(
+            llm_request.model or self.model, self.prompt_version, prefix
+        )
+        if tokens < current.min_tokens:
+            REQUESTS_TOTAL.inc(result="skipped")
+            return None
+
+        name = current.lookup(caches, key, config)
+        if name is None:
+            REQUESTS_TOTAL.inc(result="miss")
+            return None
+        REQUESTS_TOTAL.inc(result="hit")
+        # cached_content を使うリクエストにはインストラクションとツールを含められない
+        request = llm_request.model_copy(
+            update={
+                "contents": list(llm_request.contents),
+                "config": config.model_copy(
+                    update={
+                        "system_instruction": None,
+                        "tools": None,
+                        "tool_config": None,
+                        "cached_content": name,
+                    }
+                ),
+            }
+        )
+        return request, key, name
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        cached = self._cached_request(llm_request)
+        if cached is None:
+            async for response in self.inner.generate_content_async(
+                llm_request, stream=stream
+            ):
+                yield response
+            return
+
+        request, key, name = cached
+        yielded = False
+        try:
+            async for response in self.inner.generate_content_async(
+                request, stream=stream
+            ):
+                yielded = True
+                yield response
+            return
+        except Exception as e:
+            if yielded or not is_cache_error(e):
+                raise
+            logger.warning(
+                f"[ContextCache] {name} が使えないためキャッシュなしで送り直します: {e}"
+            )
+            REQUESTS_TOTAL.inc(result="fallback")
+            manager.invalidate(key, name)
+
+        async for response in self.inner.generate_content_async(
+            llm_request, stream=stream
+        ):
+            yield response
+
+    def connect(self, llm_request: LlmRequest) -> BaseLlmConnection:
+        return self.inner.connect(llm_request)
@@ -0,0 +1,265 @@
+import asyncio
+import random
+import time
+from collections.abc import AsyncGenerator, Callable
+from datetime import datetime, timezone
+from typing import Any
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
+from pydantic import PrivateAttr
+
+# ツール名 -> (呼び出しのきっかけになるキーワード, 引数名)
+_TOOL_TRIGGERS = {
+    "get_weather": (("weather", "天気"), "query"),
+    "get_current_time": (("time", "時刻", "時間"), "query"),
+    "search_agent": (("search", "research", "調べ", "検索"), "request"),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算。ASCIIは4文字で1トークン、それ以外は1文字1トークンとみなす"""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def content_text(content: genai_types.Content | None) -> str:
+    if not content or not content.parts:
+        return ""
+    texts = []
+    for part in content.parts:
+        if part.text:
+            texts.append(part.text)
+        elif part.function_call:
+            texts.append(f"{part.function_call.name}({part.function_call.args})")
+        elif part.function_response:
+            texts.append(str(part.function_response.response))
+    return "\n".join(texts)
+
+
+def request_text(llm_request: LlmRequest) -> str:
+    """システムインストラクションを含め、モデルに送られるテキスト全体を返す"""
+    texts = [content_text(content) for content in llm_request.contents]
+    if llm_request.config and isinstance(llm_request.config.system_instruction, str):
+        texts.insert(0, llm_request.config.system_instruction)
+    return "\n".join(texts)
+
+
+def _not_found(name: str) -> genai_errors.ClientError:
+    return genai_errors.ClientError(
+        404,
+        {
+            "error": {
+                "code": 404,
+                "status": "NOT_FOUND",
+                "message": f"CachedContent not found (or permission denied): {name}",
+            }
+        },
+    )
+
+
+def _ttl_seconds(ttl: str | None) -> float:
+    # API と同じく、TTL の指定がなければ1時間
+    return float((ttl or "3600s").rstrip("s"))
+
+
+class FakeCaches:
+    """client.aio.caches のローカル版。TTLの経過は clock で判定する"""
+
+    def __init__(
+        self, clock: Callable[[], float] = time.time, latency: float = 0.0
+    ) -> None:
+        self.clock = clock
+        self.latency = latency
+        # name -> (期限, トークン数)
+        self.entries: dict[str, tuple[float, int]] = {}
+        self.calls: list[tuple[str, str]] = []
+        self._ids = 0
+
+    def _cached_content(self, name: str, model: str = "") -> genai_types.CachedContent:
+        expires_at, tokens = self.entries[name]
+        return genai_types.CachedContent(
+            name=name,
+            model=model,
+            expire_time=datetime.fromtimestamp(expires_at, timezone.utc),
+            usage_metadata=genai_types.CachedContentUsageMetadata(
+                total_token_count=tokens
+            ),
+        )
+
+    async def create(
+        self, *, model: str, config: genai_types.CreateCachedContentConfig
+    ) -> genai_types.CachedContent:
+        await asyncio.sleep(self.latency)
+        self._ids += 1
+        name = f"cachedContents/fake-{self._ids}"
+        self.calls.append(("create", name))
+        text = (
+            config.system_instruction
+            if isinstance(config.system_instruction, str)
+            else ""
+        )
+        text += "".join(
+            tool.model_dump_json(exclude_none=True) for tool in config.tools or []
+        )
+        self.entries[name] = (
+            self.clock() + _ttl_seconds(config.ttl),
+            estimate_tokens(text),
+        )
+        return self._cached_content(name, model)
+
+    async def update(
+        self, *, name: str, config: genai_types.UpdateCachedContentConfig
+    ) -> genai_types.CachedContent:
+        await asyncio.sleep(self.latency)
+        self.calls.append(("update", name))
+        tokens = self.lookup(name)
+        self.entries[name] = (self.clock() + _ttl_seconds(config.ttl), tokens)
+        return self._cached_content(name)
+
+    async def delete(self, *, name: str) -> None:
+        self.calls.append(("delete", name))
+        if self.entries.pop(name, None) is None:
+            raise _not_found(name)
+
+    def lookup(self, name: str) -> int:
+        """キャッシュのトークン数を返す。無いか期限切れなら Gemini と同じ 404 を送出する"""
+        entry = self.entries.get(name)
+        if entry is None or entry[0] <= self.clock():
+            self.entries.pop(name, None)
+            raise _not_found(name)
+        return entry[1]
+
+
+class FakeLlm(BaseLlm):
+    """Gemini の代わりにローカルで決まった応答を返すモデル。
+
+    ベンチマークやオフラインテスト用。ユーザー発話にキーワードが含まれ、
+    対応するツールがリクエストに登録されていればそのツールを呼び出し、
+    ツールの結果を受け取ったらそれを要約したテキストを返す。
+
+    prefill_latency を指定すると、入力1000トークンあたりその秒数だけ応答が遅くなる。
+    fail_first / fail_rate を指定すると、クォータ超過時と同じ 429 エラーを返す。
+    caches を指定すると cached_content を参照するリクエストを受け付ける。
+    """
+
+    latency: float = 0.0
+    prefill_latency: float = 0.0
+    reply: str | None = None
+    fail_first: int = 0
+    fail_rate: float = 0.0
+    retry_after: float | None = None
+    seed: int = 0
+    caches: Any = None
+
+    _calls: int = PrivateAttr(default=0)
+    _random: random.Random | None = PrivateAttr(default=None)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        self._calls += 1
+        cached_tokens = 0
+        if llm_request.config and llm_request.config.cached_content:
+            if self.caches is None:
+                raise _not_found(llm_request.config.cached_content)
+            cached_tokens = self.caches.lookup(llm_request.config.cached_content)
+        delay = self.latency
+        if self.prefill_latency:
+            delay += (
+                self.prefill_latency * estimate_tokens(request_text(llm_request)) / 1000
+            )
+        if delay:
+            await asyncio.sleep(delay)
+        if self._should_fail():
+            raise self._rate_limit_error()
+
+        response = self._respond(llm_request, cached_tokens)
+        parts = (response.content.parts if response.content else None) or []
+        text = content_text(response.content)
+        if stream and text and not parts[0].function_call:
+            # ストリーミング時は部分応答を数回に分けて返したあと、最終応答を返す
+            step = max(1, len(text) // 3)
+            for i in range(0, len(text), step):
+                yield LlmResponse(
+                    content=genai_types.Content(
+                        role="model",
+                        parts=[genai_types.Part.from_text(text=text[i : i + step])],
+                    ),
+                    partial=True,
+                )
+        yield response
+
+    def _should_fail(self) -> bool:
+        if self._calls <= self.fail_first:
+            return True
+        if not self.fail_rate:
+            return False
+        if self._random is None:
+            self._random = random.Random(self.seed)
+        return self._random.random() < self.fail_rate
+
+    def _rate_limit_error(self) -> genai_errors.ClientError:
+        details = []
+        if self.retry_after is not None:
+            details.append(
+                {
+                    "@type": "type.googleapis.com/google.rpc.RetryInfo",
+                    "retryDelay": f"{self.retry_after}s",
+                }
+            )
+        return genai_errors.ClientError(
+            429,
+            {
+                "error": {
+                    "code": 429,
+                    "status": "RESOURCE_EXHAUSTED",
+                    "message": "Resource exhausted. Please try again later.",
+                    "details": details,
+                }
+            },
+        )
+
+    def _respond(self, llm_request: LlmRequest, cached_tokens: int = 0) -> LlmResponse:
+        last = llm_request.contents[-1] if llm_request.contents else None
+        parts = last.parts if last and last.parts else []
+
+        function_responses = [p.function_response for p in parts if p.function_response]
+        if function_responses:
+            reply = "\n".join(
+                f"{fr.name}: {fr.response.get('result', fr.response) if fr.response else ''}"
+                for fr in function_responses
+            )
+            part = genai_types.Part.from_text(text=reply)
+        else:
+            message = content_text(last)
+            part = self._tool_call(message, llm_request) or genai_types.Part.from_text(
+                text=self.reply or f"[{self.model}] {message}"
+            )
+
+        # キャッシュ済みの部分も入力トークンに含まれる（料金と prefill が軽くなるだけ）
+        prompt_tokens = estimate_tokens(request_text(llm_request)) + cached_tokens
+        output_tokens = estimate_tokens(content_text(genai_types.Content(parts=[part])))
+        return LlmResponse(
+            content=genai_types.Content(role="model", parts=[part]),
+            usage_metadata=genai_types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                cached_content_token_count=cached_tokens or None,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+    def _tool_call(
+        self, message: str, llm_request: LlmRequest
+    ) -> genai_types.Part | None:
+        lowered = message.lower()
+        for name, (keywords, arg) in _TOOL_TRIGGERS.items():
+            if name in llm_request.tools_dict and any(k in lowered for k in keywords):
+                return genai_types.Part.from_function_call(
+                    name=name, args={arg: message}
+                )
+        return None
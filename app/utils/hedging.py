@@ -0,0 +1,181 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any
+
+from google.adk.tools import FunctionTool
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types as genai_types
+
+from . import usage
+from .metrics import REGISTRY
+from .routing import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+TIMEOUTS_TOTAL = REGISTRY.counter(
+    "adk_tool_timeouts_total",
+    "Number of tool calls that hit their deadline and returned a timeout result.",
+    ("tool",),
+)
+HEDGES_TOTAL = REGISTRY.counter(
+    "adk_tool_hedges_total",
+    "Number of hedged duplicate tool calls, by which attempt finished first.",
+    ("tool", "winner"),
+)
+
+# ツールごとの直近の実行時間。ヘッジを出すまでの待ち時間（p95）に使う
+tool_latency = LatencyStats(window=500, max_age=1800.0)
+
+
+def _runs_blocking(tool: BaseTool) -> bool:
+    # FunctionTool は同期関数をイベントループ上でそのまま呼ぶため、期限で打ち切れない
+    if not isinstance(tool, FunctionTool):
+        return False
+    func = tool.func
+    # 関数でなければ、呼び出し可能なオブジェクトの __call__ が async かを見る
+    call = func if inspect.isroutine(func) else type(func).__call__
+    return not (
+        inspect.iscoroutinefunction(call)
+        or "tool_context" in inspect.signature(func).parameters
+    )
+
+
+class HedgedTool(BaseTool):
+    """ツールの実行に期限を設け、冪等なツールは遅い呼び出しに重複実行（ヘッジ）をかけるラッパー
+
+    実行時間が直近の p95 を超えたら同じ引数で2本目を起動し、先に終わった方の結果を使う。
+    期限を過ぎたら残りの実行を取り消し、失敗ではなくタイムアウトを表す結果をモデルに返す。
+    """
+
+    def __init__(
+        self,
+        inner: BaseTool,
+        deadline: float,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        min_hedge_delay: float = 0.05,
+    ) -> None:
+        super().__init__(
+            name=inner.name,
+            description=inner.description,
+            is_long_running=inner.is_long_running,
+        )
+        self.inner = inner
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+
+    def _get_declaration(self) -> genai_types.FunctionDeclaration | None:
+        return self.inner._get_declaration()
+
+    async def process_llm_request(
+        self, *, tool_context: ToolContext, llm_request: Any
+    ) -> None:
+        await self.inner.process_llm_request(
+            tool_context=tool_context, llm_request=llm_request
+        )
+
+    async def _attempt(self, args: dict[str, Any], tool_context: ToolContext) -> Any:
+        if _runs_blocking(self.inner):
+            return await asyncio.to_thread(
+                lambda: asyncio.run(
+                    self.inner.run_async(args=args, tool_context=tool_context)
+                )
+            )
+        return await self.inner.run_async(args=args, tool_context=tool_context)
+
+    def hedge_delay(self) -> float | None:
+        if not self.hedge:
+            return None
+        p95 = tool_latency.percentile(self.name, self.hedge_quantile)
+        if p95 is None or p95 >= self.deadline:
+            return None
+        return max(p95, self.min_hedge_delay)
+
+    async def run_async(
+        self, *, args: dict[str, Any], tool_context: ToolContext
+    ) -> Any:
+        start = time.perf_counter()
+        deadline_at = start + self.deadline
+        hedge_delay = self.hedge_delay()
+        hedge_at = start + hedge_delay if hedge_delay is not None else None
+        attempts = [asyncio.create_task(self._attempt(args, tool_context))]
+        error: BaseException | None = None
+        try:
+            while True:
+                pending = [t for t in attempts if not t.done()]
+                if not pending:
+                    # すべての実行が失敗した（ヘッジはエラーのリトライには使わない）
+                    raise error
+                wake_at = hedge_at if hedge_at is not None else deadline_at
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, wake_at - time.perf_counter()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        # ヘッジが勝った場合も、呼び出し元から見た最初の実行開始からの時間を記録する
+                        tool_latency.observe(self.name, time.perf_counter() - start)
+                        if len(attempts) > 1:
+                            winner = "hedge" if task is attempts[1] else "primary"
+                            HEDGES_TOTAL.inc(tool=self.name, winner=winner)
+                        return task.result()
+                    error = error or task.exception()
+
+                now = time.perf_counter()
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    if not attempts[0].done():
+                        # p95 を超えたので同じ引数で2本目を起動する
+                        attempts.append(
+                            asyncio.create_task(self._attempt(args, tool_context))
+                        )
+                elif now >= deadline_at:
+                    break
+
+            # 期限切れは打ち切った時間として記録し、以後の p95 に反映する
+            tool_latency.observe(self.name, self.deadline)
+            TIMEOUTS_TOTAL.inc(tool=self.name)
+            usage.mark_degraded("tool_timeout")
+            logger.warning(
+                f"[Tool] {self.name} が {self.deadline:g} 秒以内に終わりませんでした"
+            )
+            return {
+                "status": "timeout",
+                "error": (
+                    f"`{self.name}` did not finish within {self.deadline:g} seconds. "
+                    "Answer with what you already know, or tell the user the information "
+                    "is temporarily unavailable."
+                ),
+                "tool": self.name,
+                "elapsed_seconds": round(time.perf_counter() - start, 3),
+                "attempts": len(attempts),
+            }
+        finally:
+            for task in attempts:
+                task.cancel()
+
+
+def parse_deadlines(value: str) -> dict[str, float]:
+    """ "get_weather=10,search_agent=60" 形式の設定をツール名ごとの秒数にする"""
+    deadlines = {}
+    for item in value.split(","):
+        name, sep, seconds = item.partition("=")
+        if sep and name.strip():
+            deadlines[name.strip()] = float(seconds)
+    return deadlines
+
+
+def wrap(
+    tool: BaseTool, deadlines: dict[str, float], default: float, hedged: set[str]
+) -> BaseTool:
+    """期限が0以下のツールはそのまま返す"""
+    deadline = deadlines.get(tool.name, default)
+    if deadline <= 0:
+        return tool
+    return HedgedTool(tool, deadline=deadline, hedge=tool.name in hedged)
@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types as genai_types
+
+from .fake_llm import content_text, estimate_tokens
+from .metrics import REGISTRY, stage
+
+logger = logging.getLogger(__name__)
+
+COMPACTIONS_TOTAL = REGISTRY.counter(
+    "adk_history_compactions_total",
+    "Number of model requests whose conversation history was compacted.",
+    ("summary",),
+)
+COMPACTED_TOKENS_TOTAL = REGISTRY.counter(
+    "adk_history_compacted_tokens_total",
+    "Estimated prompt tokens removed from model requests by history compaction.",
+)
+SUMMARIES_TOTAL = REGISTRY.counter(
+    "adk_history_summaries_total",
+    "Number of background rolling-summary generations.",
+    ("status",),
+)
+
+SUMMARY_INSTRUCTION = (
+    "あなたは会話履歴の要約係です。これまでの要約と新しい会話を統合し、"
+    "ユーザーの目的・好み・決定事項・未解決の質問・重要な事実（固有名詞や数値）を残した"
+    "簡潔な要約を日本語で作成してください。挨拶や重複は省いてください。"
+)
+SUMMARY_HEADER = "[これまでの会話の要約]\n"
+TRIMMED_MARKER = "…（長いツール結果を省略しました）"
+
+
+@dataclass
+class Summary:
+    """セッション先頭 covered 件の contents を要約したもの"""
+
+    covered: int
+    fingerprint: str
+    text: str
+
+
+def _fingerprint(contents: list[genai_types.Content], covered: int) -> str:
+    # セッションは追記のみなので、件数と境界の内容が一致すれば同じ履歴とみなす
+    if not covered:
+        return ""
+    return hashlib.blake2b(
+        content_text(contents[covered - 1]).encode(), digest_size=8
+    ).hexdigest()
+
+
+def _turn_starts(contents: list[genai_types.Content]) -> list[int]:
+    """ユーザーの発話（関数レスポンスではないもの）から始まるターンの先頭インデックス"""
+    return [
+        i
+        for i, content in enumerate(contents)
+        if content.role == "user" and any(part.text for part in content.parts or ())
+    ]
+
+
+def _trim_tool_results(
+    content: genai_types.Content, max_chars: int
+) -> genai_types.Content:
+    if not any(part.function_response for part in content.parts or ()):
+        return content
+    parts = []
+    for part in content.parts or ():
+        response = part.function_response
+        if response and len(text := str(response.response)) > max_chars:
+            part = genai_types.Part(
+                function_response=genai_types.FunctionResponse(
+                    id=response.id,
+                    name=response.name,
+                    response={"result": text[:max_chars] + TRIMMED_MARKER},
+                )
+            )
+        parts.append(part)
+    return genai_types.Content(role=content.role, parts=parts)
+
+
+def _tokens(contents: list[genai_types.Content]) -> int:
+    return sum(estimate_tokens(content_text(content)) for content in contents)
+
+
+def _prepend(
+    head: list[genai_types.Content], contents: list[genai_types.Content]
+) -> list[genai_types.Content]:
+    """要約を続くユーザーの発話の先頭に入れる（user が2回続くリクエストにしない）"""
+    if not head or not contents or contents[0].role != "user":
+        return head + contents
+    first = contents[0]
+    merged = genai_types.Content(
+        role="user",
+        parts=[part for content in head for part in content.parts or ()]
+        + list(first.parts or ()),
+    )
+    return [merged, *contents[1:]]
+
+
+class HistoryCompactor:
+    """長くなった会話履歴を、モデルに送る直前に要約と直近のターンに縮める
+
+    要約はバックグラウンドで作成してセッションごとにキャッシュし、リクエストは待たせない。
+    要約が追いついていない間は、予算に収まらない古いターンを単純に落とす。
+    """
+
+    def __init__(
+        self,
+        summary_model: BaseLlm | None = None,
+        max_tokens: int = 8000,
+        max_events: int = 60,
+        keep_turns: int = 4,
+        tool_result_chars: int = 2000,
+        summary_chars: int = 4000,
+        max_sessions: int = 10000,
+    ) -> None:
+        self.summary_model = summary_model
+        self.max_tokens = max_tokens
+        self.max_events = max_events
+        self.keep_turns = keep_turns
+        self.tool_result_chars = tool_result_chars
+        self.summary_chars = summary_chars
+        self.max_sessions = max_sessions
+        self._summaries: OrderedDict[str, Summary] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def compact(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> LlmResponse | None:
+        """before_model_callback。予算を超えていれば llm_request.contents を書き換える"""
+        contents = llm_request.contents
+        tokens = _tokens(contents)
+        if len(contents) <= self.max_events and tokens <= self.max_tokens:
+            return None
+
+        with stage("history_compaction"):
+            session = callback_context._invocation_context.session
+            key = f"{session.app_name}/{session.user_id}/{session.id}"
+            compacted, summarized_until = self._compact(key, contents)
+            COMPACTED_TOKENS_TOTAL.inc(max(0, tokens - _tokens(compacted)))
+            llm_request.contents = compacted
+            self._schedule_summary(key, contents, summarized_until)
+        return None
+
+    def _compact(
+        self, key: str, contents: list[genai_types.Content]
+    ) -> tuple[list[genai_types.Content], int]:
+        starts = _turn_starts(contents)
+        # 直近 keep_turns ターン（実行中のターンを含む）はそのまま残す
+        keep_from = starts[-self.keep_turns] if len(starts) > self.keep_turns else 0
+        current = starts[-1] if starts else 0
+        recent = [
+            content
+            if i >= current
+            else _trim_tool_results(content, self.tool_result_chars)
+            for i, content in enumerate(contents[keep_from:], start=keep_from)
+        ]
+
+        summary = self.cached_summary(key, contents, keep_from)
+        covered = summary.covered if summary else 0
+        head = []
+        if summary:
+            head.append(
+                genai_types.Content(
+                    role="user",
+                    parts=[
+                        genai_types.Part.from_text(text=SUMMARY_HEADER + summary.text)
+                    ],
+                )
+            )
+
+        # 要約されていない古いターンは、新しいものから予算に収まる分だけ残す
+        budget = self.max_tokens - _tokens(head) - _tokens(recent)
+        slots = self.max_events - len(head) - len(recent)
+        older_starts = [i for i in starts if covered <= i < keep_from] or [keep_from]
+        older: list[genai_types.Content] = []
+        boundaries = [*older_starts[1:], keep_from]
+        for start, end in reversed(list(zip(older_starts, boundaries, strict=True))):
+            turn = [
+                _trim_tool_results(c, self.tool_result_chars)
+                for c in contents[start:end]
+            ]
+            cost = _tokens(turn)
+            if cost > budget or len(turn) > slots:
+                break
+            older[:0] = turn
+            budget -= cost
+            slots -= len(turn)
+
+        COMPACTIONS_TOTAL.inc(summary="hit" if summary else "miss")
+        return _prepend(head, older + recent), keep_from
+
+    def cached_summary(
+        self, key: str, contents: list[genai_types.Content], limit: int
+    ) -> Summary | None:
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                return None
+            self._summaries.move_to_end(key)
+        if summary.covered > limit or summary.fingerprint != _fingerprint(
+            contents, summary.covered
+        ):
+            return None
+        return summary
+
+    def _schedule_summary(
+        self, key: str, contents: list[genai_types.Content], until: int
+    ) -> None:
+        model = self.summary_model
+        if model is None or until <= 0:
+            return
+        summary = self.cached_summary(key, contents, until)
+        # 要約の更新は、要約されていない古いターンがある程度たまってからまとめて行う
+        if (
+            summary
+            and _tokens(contents[summary.covered : until]) < self.max_tokens // 4
+        ):
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            task = asyncio.get_running_loop().create_task(
+                self._summarize(model, key, summary, list(contents[:until]))
+            )
+            self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _summarize(
+        self,
+        model: BaseLlm,
+        key: str,
+        previous: Summary | None,
+        contents: list[genai_types.Content],
+    ) -> None:
+        start = previous.covered if previous else 0
+        transcript = "\n".join(
+            f"{content.role}: {content_text(_trim_tool_results(content, self.tool_result_chars))}"
+            for content in contents[start:]
+        )
+        prompt = (
+            f"これまでの要約:\n{previous.text if previous else '（なし）'}\n\n"
+            f"新しい会話:\n{transcript[-self.summary_chars * 4 :]}"
+        )
+        llm_request = LlmRequest(
+            model=model.model,
+            contents=[
+                genai_types.Content(
+                    role="user", parts=[genai_types.Part.from_text(text=prompt)]
+                )
+            ],
+            config=genai_types.GenerateContentConfig(
+                system_instruction=SUMMARY_INSTRUCTION
+            ),
+        )
+        try:
+            with stage("history_summary", target=model.model):
+                text = ""
+                async for response in model.generate_content_async(llm_request):
+                    if not response.partial:
+                        text = content_text(response.content)
+        except Exception:
+            SUMMARIES_TOTAL.inc(status="error")
+            logger.exception("会話履歴の要約に失敗しました: %s", key)
+            return
+        if not text:
+            SUMMARIES_TOTAL.inc(status="empty")
+            return
+
+        SUMMARIES_TOTAL.inc(status="ok")
+        with self._lock:
+            self._summaries[key] = Summary(
+                covered=len(contents),
+                fingerprint=_fingerprint(contents, len(contents)),
+                text=text[: self.summary_chars],
+            )
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+
+    async def drain(self) -> None:
+        """実行中の要約がすべて終わるまで待つ（テスト・ベンチマーク用）"""
+        while tasks := list(self._pending.values()):
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+compactor = HistoryCompactor()
+
+
+def configure(**kwargs: Any) -> HistoryCompactor:
+    global compactor
+    compactor = HistoryCompactor(**kwargs)
+    return compactor
+
+
+def compact_history(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> LlmResponse | None:
+    return compactor.compact(callback_context, llm_request)
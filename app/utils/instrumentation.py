@@ -0,0 +1,80 @@
+import time
+from collections.abc import AsyncGenerator
+from typing import Any
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.base_llm_connection import BaseLlmConnection
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types as genai_types
+
+from . import routing, usage
+from .metrics import stage
+
+
+class InstrumentedLlm(BaseLlm):
+    """モデル呼び出し1回ごとに model_turn ステージとして計測し、トークン利用量を記録するラッパー"""
+
+    inner: BaseLlm
+    prompt_version: str = ""
+
+    def __init__(self, inner: BaseLlm, **kwargs: Any) -> None:
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        usage_metadata = None
+        # 呼び出し元に応答を渡している間（ツールの実行や search_agent の呼び出しを含む）は
+        # モデルの時間に含めず、最後の応答を受け取るまでを計測する
+        elapsed = 0.0
+        turn = stage("model_turn", target=self.model)
+        with turn:
+            try:
+                received = time.perf_counter()
+                async for response in self.inner.generate_content_async(
+                    llm_request, stream=stream
+                ):
+                    elapsed += time.perf_counter() - received
+                    # ストリーミング時は最後に受け取った値がその呼び出しの合計になる
+                    if response.usage_metadata is not None:
+                        usage_metadata = response.usage_metadata
+                    turn.pause()
+                    yield response
+                    turn.resume()
+                    received = time.perf_counter()
+                elapsed += time.perf_counter() - received
+            finally:
+                # ルーティングはモデルごとの直近レイテンシも見て判断する
+                routing.latency_stats.observe(llm_request.model or self.model, elapsed)
+                usage.record(
+                    llm_request.model or self.model,
+                    usage_metadata,
+                    prompt_version=self.prompt_version,
+                )
+
+    def connect(self, llm_request: LlmRequest) -> BaseLlmConnection:
+        return self.inner.connect(llm_request)
+
+
+class InstrumentedTool(BaseTool):
+    """ツール実行を tool_call ステージとして計測するラッパー"""
+
+    def __init__(self, inner: BaseTool) -> None:
+        super().__init__(
+            name=inner.name,
+            description=inner.description,
+            is_long_running=inner.is_long_running,
+        )
+        self.inner = inner
+
+    def _get_declaration(self) -> genai_types.FunctionDeclaration | None:
+        return self.inner._get_declaration()
+
+    async def run_async(
+        self, *, args: dict[str, Any], tool_context: ToolContext
+    ) -> Any:
+        with stage("tool_call", target=self.name):
+            return await self.inner.run_async(args=args, tool_context=tool_context)
@@ -0,0 +1,330 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, TypeVar
+
+from opentelemetry import trace
+
+logger = logging.getLogger(__name__)
+
+# LLM呼び出しは数十秒かかることもあるため、Prometheusのデフォルトより上まで用意する
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_labels(
+    names: tuple[str, ...], values: tuple[str, ...], extra: str = ""
+) -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]) -> None:
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        self._add(self._key(labels), amount)
+
+    def _add(self, key: tuple[str, ...], amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}"
+            for key, v in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [バケット毎の件数..., 合計値, 件数]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        self._observe(self._key(labels), value)
+
+    def _observe(self, key: tuple[str, ...], value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def total(self, **labels: str) -> float:
+        state = self._values.get(self._key(labels))
+        return state[-2] if state else 0.0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0.0
+            for bound, hits in zip(self.buckets, state, strict=False):
+                cumulative += hits
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le)} "
+                    f"{_format_value(cumulative)}"
+                )
+            inf = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {_format_value(state[-1])}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+
+_M = TypeVar("_M", bound=_Metric)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls: type[_M], name: str, *args: Any, **kwargs: Any) -> _M:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                created = cls(name, *args, **kwargs)
+                self._metrics[name] = created
+                return created
+            if type(metric) is not cls:
+                raise ValueError(f"メトリクス '{name}' は別の型で登録済みです")
+            return metric
+
+    def counter(
+        self, name: str, help_text: str, labels: tuple[str, ...] = ()
+    ) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "adk_stage_duration_seconds",
+    "Latency of each processing stage.",
+    ("stage", "target"),
+)
+STAGE_TOTAL = REGISTRY.counter(
+    "adk_stage_total",
+    "Number of completed stage executions.",
+    ("stage", "target", "status"),
+)
+STAGE_IN_FLIGHT = REGISTRY.gauge(
+    "adk_stage_in_flight",
+    "Number of stage executions currently running.",
+    ("stage", "target"),
+)
+
+_tracer = trace.get_tracer(__name__)
+_settings = {"enabled": True, "otel_spans": False}
+
+
+def configure(enabled: bool | None = None, otel_spans: bool | None = None) -> None:
+    """計測の有効/無効と、ステージをOpenTelemetryのspanとしても記録するかを切り替える"""
+    if enabled is not None:
+        _settings["enabled"] = enabled
+    if otel_spans is not None:
+        _settings["otel_spans"] = otel_spans
+
+
+class stage:
+    """処理ステージのレイテンシ・件数・実行中数を記録するコンテキストマネージャ
+
+    リクエストごとに何度も通るため、contextlib ではなくクラスで実装してオーバーヘッドを抑えている。
+    非同期ジェネレーターの中で使うときは、yield の前後を pause / resume で囲むと
+    呼び出し元が処理している時間を除いて計測できる。
+    """
+
+    __slots__ = ("_key", "_name", "_paused", "_span", "_start", "_target")
+
+    def __init__(self, name: str, target: str = "") -> None:
+        self._name = name
+        self._target = target
+        self._key: tuple[str, str] | None = None
+        self._span: Any = None
+        self._start = 0.0
+        self._paused = 0.0
+
+    def __enter__(self) -> "stage":
+        if not _settings["enabled"]:
+            return self
+        if _settings["otel_spans"]:
+            self._span = _tracer.start_as_current_span(
+                f"stage.{self._name}",
+                attributes={"stage": self._name, "target": self._target},
+            )
+            self._span.__enter__()
+        self._key = (self._name, self._target)
+        STAGE_IN_FLIGHT._add(self._key, 1.0)
+        self._start = time.perf_counter()
+        return self
+
+    def pause(self) -> None:
+        self._paused = time.perf_counter()
+
+    def resume(self) -> None:
+        if self._paused:
+            self._start += time.perf_counter() - self._paused
+            self._paused = 0.0
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        key = self._key
+        if key is None:
+            return
+        # 一時停止中に終了した（呼び出し元がジェネレーターを閉じた）ときは停止時点までを記録する
+        end = self._paused or time.perf_counter()
+        self._paused = 0.0
+        STAGE_LATENCY._observe(key, end - self._start)
+        STAGE_TOTAL._add((*key, "ok" if exc_type is None else "error"), 1.0)
+        STAGE_IN_FLIGHT._add(key, -1.0)
+        self._key = None
+        if self._span is not None:
+            span, self._span = self._span, None
+            span.__exit__(exc_type, exc, tb)
+
+
+def start_metrics_server(
+    port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY
+) -> ThreadingHTTPServer:
+    """Prometheus形式の /metrics エンドポイントをバックグラウンドスレッドで起動する"""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            # スクレイプごとのアクセスログは出さない
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    logger.info(
+        f"[Metrics] http://{host}:{server.server_address[1]}/metrics で公開しています"
+    )
+    return server
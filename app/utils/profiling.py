@@ -0,0 +1,275 @@
+import asyncio
+import concurrent.futures
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+import google.cloud.storage as storage
+
+logger = logging.getLogger(__name__)
+
+MAX_DURATION = 300.0
+
+_settings: dict[str, Any] = {"output_dir": ".profiles", "upload_bucket": None}
+_lock = threading.Lock()
+_active: "Capture | None" = None
+_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+
+
+class Capture:
+    """時間を区切って取得する1回分のプロファイル
+
+    - sample: 全スレッドのスタックを定期的にサンプリングした統計プロファイル（collapsed stack形式）
+    - cprofile: 追跡中のイベントループのスレッドの cProfile
+    - tasks: 追跡中のイベントループで実行中の asyncio タスクのスタック
+    """
+
+    def __init__(
+        self, duration: float, output_dir: Path, modes: tuple[str, ...], interval: float
+    ) -> None:
+        self.duration = duration
+        self.output_dir = output_dir
+        self.modes = modes
+        self.interval = interval
+        self.paths: list[Path] = []
+        self._done: concurrent.futures.Future[list[Path]] = concurrent.futures.Future()
+
+    def wait(self, timeout: float | None = None) -> list[Path]:
+        concurrent.futures.wait([self._done], timeout)
+        return self.paths
+
+    def add_done_callback(self, callback: Callable[[list[Path]], Any]) -> None:
+        """取得が終わったら保存したファイルの一覧で callback を呼ぶ（終了済みならすぐ呼ぶ）"""
+        self._done.add_done_callback(lambda future: callback(future.result()))
+
+    def _run(self) -> None:
+        global _active
+        loop_profiles: list[tuple[asyncio.AbstractEventLoop, cProfile.Profile]] = []
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            if "cprofile" in self.modes:
+                loop_profiles = _start_loop_profiles()
+            if "tasks" in self.modes:
+                self.paths.append(self._write("tasks.txt", dump_asyncio_tasks()))
+            if "sample" in self.modes:
+                samples = _sample_stacks(self.duration, self.interval)
+                self.paths.append(
+                    self._write(
+                        "samples.folded",
+                        "".join(
+                            f"{stack} {count}\n"
+                            for stack, count in samples.most_common()
+                        ),
+                    )
+                )
+            else:
+                time.sleep(self.duration)
+        finally:
+            with _lock:
+                _active = None
+            try:
+                profiles = _stop_loop_profiles(loop_profiles)
+                if "cprofile" in self.modes:
+                    self._write_cprofile(profiles)
+                if _settings["upload_bucket"]:
+                    _upload(self.paths, _settings["upload_bucket"])
+            except Exception as e:
+                logger.error(f"[Profiling] プロファイルの保存に失敗しました: {e}")
+            logger.info(f"[Profiling] プロファイルを保存しました: {self.output_dir}")
+            self._done.set_result(self.paths)
+
+    def _write(self, name: str, text: str) -> Path:
+        path = self.output_dir / name
+        path.write_text(text)
+        return path
+
+    def _write_cprofile(self, profiles: list[cProfile.Profile]) -> None:
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = self.output_dir / "cprofile.pstats"
+        stats.dump_stats(path)
+        self.paths.append(path)
+
+        report = io.StringIO()
+        pstats.Stats(str(path), stream=report).sort_stats("cumulative").print_stats(50)
+        self.paths.append(self._write("cprofile.txt", report.getvalue()))
+
+
+def configure(output_dir: str | None = None, upload_bucket: str | None = None) -> None:
+    if output_dir is not None:
+        _settings["output_dir"] = output_dir
+    _settings["upload_bucket"] = upload_bucket or None
+
+
+def start_capture(
+    duration: float = 30.0,
+    modes: tuple[str, ...] = ("sample", "cprofile", "tasks"),
+    interval: float = 0.005,
+) -> Capture | None:
+    """バックグラウンドでプロファイルの取得を始める。取得中の場合は None を返す"""
+    global _active
+    duration = max(0.0, min(duration, MAX_DURATION))
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    output_dir = Path(_settings["output_dir"]) / f"{timestamp}-{os.getpid()}"
+    with _lock:
+        if _active is not None:
+            logger.info("[Profiling] すでにプロファイルを取得中です")
+            return None
+        _active = capture = Capture(duration, output_dir, modes, interval)
+
+    logger.info(f"[Profiling] {duration:.0f}秒間プロファイルを取得します: {modes}")
+    threading.Thread(target=capture._run, name="profiler", daemon=True).start()
+    return capture
+
+
+def track_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """タスクダンプの対象にするイベントループを登録する"""
+    _loops.add(loop)
+
+
+def dump_asyncio_tasks(timeout: float = 1.0) -> str:
+    """追跡中の全イベントループについて、実行中タスクのスタックを文字列にする"""
+    out = io.StringIO()
+    for loop in list(_loops):
+        if loop.is_closed():
+            continue
+        out.write(f"=== loop {id(loop):#x} (running={loop.is_running()}) ===\n")
+        for task in _tasks_of(loop, timeout):
+            out.write(f"--- {task!r}\n")
+            task.print_stack(file=out)
+    return out.getvalue()
+
+
+def _call_in_loop(
+    loop: asyncio.AbstractEventLoop, func: Any, timeout: float = 1.0
+) -> bool:
+    future: concurrent.futures.Future = concurrent.futures.Future()
+
+    def run() -> None:
+        try:
+            func()
+            future.set_result(True)
+        except Exception as e:
+            future.set_exception(e)
+
+    loop.call_soon_threadsafe(run)
+    try:
+        return future.result(timeout)
+    except (concurrent.futures.TimeoutError, ValueError):
+        return False
+
+
+def _start_loop_profiles() -> list[tuple[asyncio.AbstractEventLoop, cProfile.Profile]]:
+    # cProfile はスレッド単位なので、イベントループのスレッド上で有効にする
+    started = []
+    for loop in list(_loops):
+        if loop.is_closed() or not loop.is_running():
+            continue
+        profile = cProfile.Profile()
+        if _call_in_loop(loop, profile.enable):
+            started.append((loop, profile))
+    return started
+
+
+def _stop_loop_profiles(
+    started: list[tuple[asyncio.AbstractEventLoop, cProfile.Profile]],
+) -> list[cProfile.Profile]:
+    stopped = []
+    for loop, profile in started:
+        if not loop.is_closed() and _call_in_loop(loop, profile.disable, timeout=10.0):
+            stopped.append(profile)
+    return stopped
+
+
+def _tasks_of(loop: asyncio.AbstractEventLoop, timeout: float) -> set[asyncio.Task]:
+    if not loop.is_running():
+        return asyncio.all_tasks(loop)
+    future: concurrent.futures.Future = concurrent.futures.Future()
+    loop.call_soon_threadsafe(lambda: future.set_result(asyncio.all_tasks(loop)))
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # ループがブロックされている場合は、スレッド外から直接読む
+        return asyncio.all_tasks(loop)
+
+
+def _sample_stacks(duration: float, interval: float) -> Counter:
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    samples: Counter = Counter()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            current: FrameType | None = frame
+            while current is not None:
+                code = current.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                current = current.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return samples
+
+
+def _upload(paths: list[Path], bucket_name: str) -> None:
+    bucket = storage.Client().bucket(bucket_name.removeprefix("gs://"))
+    for path in paths:
+        blob = bucket.blob(f"profiles/{path.parent.name}/{path.name}")
+        blob.upload_from_filename(str(path))
+    logger.info(f"[Profiling] gs://{bucket_name}/profiles/ にアップロードしました")
+
+
+def install(
+    signal_name: str | None = "SIGUSR1",
+    on_start: float = 0.0,
+    output_dir: str | None = None,
+    upload_bucket: str | None = None,
+) -> None:
+    """シグナル・環境変数からプロファイル取得を開始できるようにする
+
+    シグナルを受け取ると30秒間のプロファイルを取得する。on_start を指定すると起動直後に取得する。
+    """
+    configure(output_dir=output_dir, upload_bucket=upload_bucket)
+    if signal_name:
+        signum = getattr(signal, signal_name, None)
+        if signum is None:
+            logger.warning(
+                f"[Profiling] このプラットフォームでは {signal_name} を使えません"
+            )
+        else:
+            try:
+                # ハンドラ内でロックを取らないよう、別スレッドで開始する
+                signal.signal(
+                    signum,
+                    lambda *_: threading.Thread(
+                        target=start_capture, daemon=True
+                    ).start(),
+                )
+            except ValueError:
+                # メインスレッド以外からはシグナルハンドラを登録できない
+                logger.warning(
+                    "[Profiling] メインスレッド以外のためシグナルハンドラを登録できません"
+                )
+    if on_start:
+        start_capture(on_start)
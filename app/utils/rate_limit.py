@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
+from typing import Any
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.base_llm_connection import BaseLlmConnection
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import errors as genai_errors
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY_LIMIT = REGISTRY.gauge(
+    "adk_model_concurrency_limit", "Current adaptive concurrency limit for model calls."
+)
+MODEL_IN_FLIGHT = REGISTRY.gauge(
+    "adk_model_in_flight", "Number of model calls holding a concurrency slot."
+)
+REJECTIONS_TOTAL = REGISTRY.counter(
+    "adk_model_rejections_total",
+    "Number of model calls rejected on the client side.",
+    ("reason",),
+)
+RETRIES_TOTAL = REGISTRY.counter(
+    "adk_model_retries_total", "Number of model calls retried after a 429 response."
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "adk_model_circuit_state", "Circuit breaker state (0=closed, 1=open, 2=half-open)."
+)
+
+
+class RateLimitError(Exception):
+    """クライアント側でモデル呼び出しを断念したことを表す例外の基底クラス"""
+
+
+class LimiterRejected(RateLimitError):
+    pass
+
+
+class CircuitOpenError(RateLimitError):
+    pass
+
+
+class RetriesExhausted(RateLimitError):
+    pass
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return isinstance(error, genai_errors.APIError) and (
+        error.code == 429 or error.status == "RESOURCE_EXHAUSTED"
+    )
+
+
+def retry_after(error: BaseException) -> float | None:
+    """429レスポンスに含まれる待ち時間のヒント（Retry-Afterヘッダ または RetryInfo）を秒で返す"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value:
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            if isinstance(delay, str) and delay.endswith("s"):
+                try:
+                    return float(delay[:-1])
+                except ValueError:
+                    pass
+    return None
+
+
+class AdaptiveLimiter:
+    """AIMDで上限を調整する同時実行数リミッター
+
+    成功するたびに上限を少しずつ上げ、429を受けたら半分にする。
+    Slackボットではエージェント専用のイベントループ上で使われるが、評価やテストなど
+    別スレッドのイベントループからも同じリミッターを共有するため、asyncioのプリミティブ
+    ではなくスレッドロックと待機中Futureの受け渡しで実装している。
+    """
+
+    def __init__(
+        self,
+        initial: float = 8.0,
+        min_limit: float = 1.0,
+        max_limit: float = 64.0,
+        backoff: float = 0.5,
+        queue_timeout: float = 30.0,
+        decrease_interval: float = 1.0,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.decrease_interval = decrease_interval
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+        CONCURRENCY_LIMIT.set(self._limit)
+        MODEL_IN_FLIGHT.set(0)
+
+    @property
+    def limit(self) -> float:
+        return self._limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self._in_flight < int(self._limit) and not self._waiters:
+                self._in_flight += 1
+                MODEL_IN_FLIGHT.set(self._in_flight)
+                return
+            loop = asyncio.get_running_loop()
+            entry = (loop, loop.create_future())
+            self._waiters.append(entry)
+
+        try:
+            await asyncio.wait_for(entry[1], self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    REJECTIONS_TOTAL.inc(reason="queue_timeout")
+                    raise LimiterRejected(
+                        f"モデル呼び出しの空きを {self.queue_timeout} 秒待ちましたが確保できませんでした"
+                    ) from None
+            # タイムアウトと同時に枠が割り当てられていた
+        except asyncio.CancelledError:
+            with self._lock:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    raise
+            self.release("cancelled")
+            raise
+
+    def release(self, outcome: str = "ok") -> None:
+        """枠を返す。outcome は ok / throttled / error / cancelled"""
+        with self._lock:
+            if outcome == "ok":
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            elif outcome == "throttled":
+                now = time.monotonic()
+                # 同時に返ってきた複数の429で何度も半減させない
+                if now - self._last_decrease >= self.decrease_interval:
+                    self._limit = max(self.min_limit, self._limit * self.backoff)
+                    self._last_decrease = now
+            self._in_flight -= 1
+            while self._waiters and self._in_flight < int(self._limit):
+                loop, future = self._waiters.popleft()
+                self._in_flight += 1
+                loop.call_soon_threadsafe(_wake, future)
+            CONCURRENCY_LIMIT.set(self._limit)
+            MODEL_IN_FLIGHT.set(self._in_flight)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+@dataclass
+class RetryPolicy:
+    """ジッター付き指数バックオフ。サーバーから待ち時間のヒントがあればそれ以上待つ"""
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+
+    def delay(self, attempt: int, hint: float | None = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return max(backoff, hint or 0.0)
+
+
+class CircuitBreaker:
+    """リトライしても429が続く状態（クォータ枯渇）が続いたら、一定時間呼び出しを即座に失敗させる"""
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.open_seconds:
+            return "open"
+        return "half_open"
+
+    def check(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_running:
+                # 1件だけ試しに通す
+                self._trial_running = True
+                CIRCUIT_STATE.set(2)
+                return
+            REJECTIONS_TOTAL.inc(reason="circuit_open")
+            remaining = self.open_seconds - (
+                time.monotonic() - (self._opened_at or 0.0)
+            )
+            raise CircuitOpenError(
+                f"モデルのクォータ超過が続いているため、{max(remaining, 0):.0f}秒ほど呼び出しを停止しています"
+            )
+
+    def release_trial(self) -> None:
+        """429以外の理由で試行が終わった場合に、次の試行を通せるようにする"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+            CIRCUIT_STATE.set(0)
+
+    def record_throttle(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_running:
+                    logger.warning(
+                        "[RateLimit] 429が続いているためサーキットを開きます"
+                    )
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+                CIRCUIT_STATE.set(1)
+
+
+class ModelCallGuard:
+    """プロセス内の全モデル呼び出しで共有するリミッター・リトライ・サーキットブレーカー"""
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter | None = None,
+        retry: RetryPolicy | None = None,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self.limiter = limiter or AdaptiveLimiter()
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+
+# エージェントはデプロイ時にpickleされるため、ガードはモデルに持たせずモジュールで共有する
+guard = ModelCallGuard()
+
+
+def configure(**kwargs: Any) -> ModelCallGuard:
+    """共有ガードを設定し直す。kwargs は limiter / retry / breaker"""
+    global guard
+    guard = ModelCallGuard(**kwargs)
+    return guard
+
+
+class RateLimitedLlm(BaseLlm):
+    """共有ガードを通してモデルを呼び出すラッパー。429はバックオフしてリトライする"""
+
+    inner: BaseLlm
+
+    def __init__(self, inner: BaseLlm, **kwargs: Any) -> None:
+        super().__init__(model=inner.model, inner=inner, **kwargs)
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        current = guard
+        for attempt in range(current.retry.max_attempts):
+            current.breaker.check()
+            try:
+                await current.limiter.acquire()
+            except BaseException:
+                current.breaker.release_trial()
+                raise
+            outcome = "error"
+            error: BaseException | None = None
+            responses: list[LlmResponse] = []
+            try:
+                # 枠を持ったまま呼び出し元に yield すると、その間に実行されるツール
+                # （search_agent のモデル呼び出しなど）が同じ枠を待って詰まるため、
+                # 応答を最後まで受け取って枠を返してから呼び出し元に渡す
+                async for response in self.inner.generate_content_async(
+                    llm_request, stream=stream
+                ):
+                    responses.append(response)
+                outcome = "ok"
+            except Exception as e:
+                # 部分応答を受け取った後はリトライすると内容が重複するため諦める
+                if not is_rate_limited(e) or responses:
+                    raise
+                outcome = "throttled"
+                error = e
+            finally:
+                current.limiter.release(outcome)
+                if outcome == "error":
+                    current.breaker.release_trial()
+
+            if outcome == "ok":
+                current.breaker.record_success()
+                for response in responses:
+                    yield response
+                return
+
+            current.breaker.record_throttle()
+            if attempt + 1 >= current.retry.max_attempts:
+                break
+            delay = current.retry.delay(attempt, retry_after(error) if error else None)
+            RETRIES_TOTAL.inc()
+            logger.info(
+                f"[RateLimit] 429のため {delay:.2f} 秒後にリトライします ({attempt + 1})"
+            )
+            await asyncio.sleep(delay)
+
+        REJECTIONS_TOTAL.inc(reason="retries_exhausted")
+        raise RetriesExhausted(
+            f"{current.retry.max_attempts} 回試行しましたがクォータ超過が解消しませんでした"
+        ) from error
+
+    def connect(self, llm_request: LlmRequest) -> BaseLlmConnection:
+        return self.inner.connect(llm_request)
@@ -0,0 +1,125 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+from .metrics import REGISTRY
+
+ROUTING_DECISIONS = REGISTRY.counter(
+    "adk_routing_decisions_total",
+    "Number of requests routed to each model tier.",
+    ("tier", "reason"),
+)
+
+# tier -> root_agent のモデル。search_agent は調査の質を落とさないよう常に標準モデルを使う
+TIERS = {
+    "lite": "gemini-2.5-flash-lite",
+    "standard": "gemini-2.5-flash",
+}
+
+# 調査・推論が必要そうな依頼
+_COMPLEX_PATTERNS = re.compile(
+    r"調べ|検索|比較|違い|なぜ|理由|詳しく|説明|まとめ|要約|分析|設計|実装|コード|最新|ニュース|"
+    r"research|search|compare|difference|why|explain|summar|analy|design|implement|code|latest|news",
+    re.IGNORECASE,
+)
+# 軽量モデルで十分な雑談・天気・時刻
+_SIMPLE_PATTERNS = re.compile(
+    r"天気|気温|時刻|何時|こんにちは|こんばんは|おはよう|ありがとう|よろしく|"
+    r"weather|temperature|what time|hello|\bhi\b|\bhey\b|thanks|thank you",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RoutingDecision:
+    tier: str
+    model: str
+    reason: str
+    features: dict[str, float] = field(default_factory=dict)
+
+    def as_metadata(self) -> dict:
+        return asdict(self)
+
+
+class LatencyStats:
+    """モデルごとの直近のレイテンシ（model_turn 単位）を保持する"""
+
+    def __init__(self, window: int = 200, max_age: float = 600.0) -> None:
+        self.window = window
+        self.max_age = max_age
+        self._samples: dict[str, deque[tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(model, deque(maxlen=self.window))
+            samples.append((time.monotonic(), seconds))
+
+    def percentile(self, model: str, q: float) -> float | None:
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            values = sorted(s for t, s in self._samples.get(model, ()) if t >= cutoff)
+        if len(values) < 5:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+latency_stats = LatencyStats()
+
+
+def _features(message: str) -> dict[str, float]:
+    text = unicodedata.normalize("NFKC", message).strip()
+    return {
+        "chars": float(len(text)),
+        "lines": float(text.count("\n") + 1),
+        "questions": float(text.count("?")),
+        "complex": float(bool(_COMPLEX_PATTERNS.search(text))),
+        "simple": float(bool(_SIMPLE_PATTERNS.search(text))),
+        "code": float("```" in text),
+    }
+
+
+class ModelRouter:
+    """ローカルのヒューリスティクスと直近のレイテンシからリクエストごとのモデルを選ぶ"""
+
+    def __init__(
+        self,
+        tiers: dict[str, str] | None = None,
+        short_chars: int = 60,
+        stats: LatencyStats | None = None,
+        degraded_ratio: float = 1.5,
+    ) -> None:
+        self.tiers = tiers or TIERS
+        self.short_chars = short_chars
+        self.stats = stats or latency_stats
+        self.degraded_ratio = degraded_ratio
+
+    def route(self, message: str) -> RoutingDecision:
+        features = _features(message)
+        if features["code"] or features["complex"] or features["lines"] > 3:
+            tier, reason = "standard", "complex"
+        elif features["simple"] or features["chars"] <= self.short_chars:
+            tier, reason = "lite", "simple" if features["simple"] else "short"
+        else:
+            tier, reason = "standard", "long"
+
+        if tier == "lite" and self._lite_degraded():
+            tier, reason = "standard", "lite_degraded"
+
+        ROUTING_DECISIONS.inc(tier=tier, reason=reason)
+        return RoutingDecision(
+            tier=tier, model=self.tiers[tier], reason=reason, features=features
+        )
+
+    def _lite_degraded(self) -> bool:
+        # 軽量モデルの方が遅くなっている（混雑など）場合は標準モデルに逃がす
+        lite = self.stats.percentile(self.tiers["lite"], 0.95)
+        standard = self.stats.percentile(self.tiers["standard"], 0.95)
+        return (
+            lite is not None
+            and standard is not None
+            and lite > standard * self.degraded_ratio
+        )
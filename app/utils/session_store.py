@@ -0,0 +1,183 @@
+import copy
+import hashlib
+import json
+import zlib
+from dataclasses import dataclass
+from typing import Any
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+
+from .metrics import REGISTRY
+
+EVENT_BYTES = REGISTRY.gauge(
+    "adk_session_event_bytes",
+    "Bytes of compact event records held by the session service.",
+)
+BLOB_BYTES = REGISTRY.gauge(
+    "adk_session_blob_bytes",
+    "Bytes of large tool outputs held once in the session side store.",
+)
+BLOBS = REGISTRY.gauge(
+    "adk_session_blobs",
+    "Number of distinct tool outputs held in the session side store.",
+)
+BLOB_DEDUP_TOTAL = REGISTRY.counter(
+    "adk_session_blob_dedup_total",
+    "Number of tool outputs that reused a payload already in the side store.",
+)
+
+
+class BlobStore:
+    """大きなツール結果を内容のハッシュで1つだけ持つ（参照カウントで解放）"""
+
+    def __init__(self) -> None:
+        self._blobs: dict[str, bytes] = {}
+        self._refs: dict[str, int] = {}
+        self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    def put(self, payload: bytes) -> str:
+        key = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        if key in self._blobs:
+            BLOB_DEDUP_TOTAL.inc()
+        else:
+            self._blobs[key] = zlib.compress(payload, 1)
+            self.bytes += len(self._blobs[key])
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return key
+
+    def get(self, key: str) -> bytes:
+        return zlib.decompress(self._blobs[key])
+
+    def release(self, key: str) -> None:
+        self._refs[key] -= 1
+        if not self._refs[key]:
+            del self._refs[key]
+            self.bytes -= len(self._blobs.pop(key))
+
+
+@dataclass(frozen=True, slots=True)
+class CompactEvent:
+    """None のフィールドを除いた JSON と、サイドストアに移したツール結果の (part 番号, キー)"""
+
+    data: bytes
+    blobs: tuple[tuple[int, str], ...]
+    timestamp: float
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def compact_event(event: Event, blobs: BlobStore, threshold: int) -> CompactEvent:
+    record = event.model_dump(mode="json", exclude_none=True)
+    refs = []
+    parts = (record.get("content") or {}).get("parts") or ()
+    for i, part in enumerate(parts):
+        response = (part.get("function_response") or {}).get("response")
+        if response is None or threshold <= 0:
+            continue
+        payload = _dumps(response)
+        if len(payload) >= threshold:
+            refs.append((i, blobs.put(payload)))
+            del part["function_response"]["response"]
+    return CompactEvent(_dumps(record), tuple(refs), event.timestamp)
+
+
+def expand_event(compact: CompactEvent, blobs: BlobStore) -> Event:
+    event = Event.model_validate_json(compact.data)
+    parts = event.content.parts if event.content else None
+    for i, key in compact.blobs:
+        # compact_event が取り出した位置には必ず関数レスポンスがある
+        response = parts[i].function_response if parts else None
+        if response is not None:
+            response.response = json.loads(blobs.get(key))
+    return event
+
+
+class CompactSessionService(InMemorySessionService):
+    """イベントを Event オブジェクトではなくコンパクトな記録として保持する InMemorySessionService
+
+    保持するセッションの events は常に空で、イベントは None を除いた JSON として別に持つ。
+    blob_threshold バイト以上のツール結果はサイドストアに移して内容のハッシュで参照し、
+    同じ内容はセッションをまたいで1つだけ持つ。get_session では元と同じ Event を組み立て直す。
+    """
+
+    def __init__(self, blob_threshold: int = 2048) -> None:
+        super().__init__()
+        self.blob_threshold = blob_threshold
+        self.blobs = BlobStore()
+        self.events: dict[tuple[str, str, str], list[CompactEvent]] = {}
+        self.event_bytes = 0
+
+    def _update_gauges(self) -> None:
+        EVENT_BYTES.set(self.event_bytes)
+        BLOB_BYTES.set(self.blobs.bytes)
+        BLOBS.set(len(self.blobs))
+
+    def _get_session_impl(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: GetSessionConfig | None = None,
+    ) -> Session | None:
+        stored = self.sessions.get(app_name, {}).get(user_id, {}).get(session_id)
+        if stored is None:
+            return None
+        records = self.events.get((app_name, user_id, session_id), [])
+        if config and config.num_recent_events:
+            records = records[-config.num_recent_events :]
+        if config and config.after_timestamp:
+            # 元の実装と同じく、after_timestamp より前の最後のイベントより後ろを返す
+            i = len(records) - 1
+            while i >= 0 and records[i].timestamp >= config.after_timestamp:
+                i -= 1
+            records = records[i + 1 :]
+        session = Session(
+            app_name=stored.app_name,
+            user_id=stored.user_id,
+            id=stored.id,
+            state=copy.deepcopy(stored.state),
+            events=[expand_event(record, self.blobs) for record in records],
+            last_update_time=stored.last_update_time,
+        )
+        return self._merge_state(app_name, user_id, session)
+
+    def _delete_session_impl(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        for record in self.events.pop((app_name, user_id, session_id), []):
+            self.event_bytes -= len(record.data)
+            for _, key in record.blobs:
+                self.blobs.release(key)
+        super()._delete_session_impl(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        self._update_gauges()
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session, event)
+        stored = (
+            self.sessions.get(session.app_name, {})
+            .get(session.user_id, {})
+            .get(session.id)
+        )
+        if stored is None or not stored.events:
+            return event
+        # 親クラスが保持セッションに追加した Event をコンパクトな記録に置き換える
+        records = self.events.setdefault(
+            (session.app_name, session.user_id, session.id), []
+        )
+        for appended in stored.events:
+            record = compact_event(appended, self.blobs, self.blob_threshold)
+            records.append(record)
+            self.event_bytes += len(record.data)
+        stored.events.clear()
+        self._update_gauges()
+        return event
@@ -0,0 +1,427 @@
+import asyncio
+import bisect
+import hashlib
+import importlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DISPATCHED_TOTAL = REGISTRY.counter(
+    "adk_shard_dispatched_total",
+    "Number of requests dispatched to each worker process.",
+    ("worker",),
+)
+WORKER_IN_FLIGHT = REGISTRY.gauge(
+    "adk_shard_in_flight",
+    "Number of requests waiting for each worker process.",
+    ("worker",),
+)
+MIGRATED_TOTAL = REGISTRY.counter(
+    "adk_shard_migrated_sessions_total",
+    "Number of sessions moved between workers by rebalancing.",
+)
+WORKER_RESTARTS_TOTAL = REGISTRY.counter(
+    "adk_shard_worker_restarts_total",
+    "Number of worker processes restarted after exiting unexpectedly.",
+)
+
+
+class WorkerError(RuntimeError):
+    """ワーカープロセス内で処理が失敗した、またはワーカーが終了した"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """仮想ノード付きのコンシステントハッシュ。ワーカーの増減で移動するキーを最小にする"""
+
+    def __init__(self, nodes: list[str] | None = None, vnodes: int = 64) -> None:
+        self.vnodes = vnodes
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        for node in nodes or ():
+            self.add(node)
+
+    @property
+    def nodes(self) -> set[str]:
+        return set(self._owners.values())
+
+    def add(self, node: str) -> None:
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+
+    def remove(self, node: str) -> None:
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def lookup(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("ノードがありません")
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+
+class ThreadStore:
+    """ボットが参加しているSlackスレッドを記録するローカルのSQLiteストア
+
+    プロセスをまたいで共有でき、再起動しても参加中のスレッドを忘れない。
+    """
+
+    def __init__(self, path: str, max_age: float = 30 * 86400) -> None:
+        self.max_age = max_age
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS bot_threads (
+                    thread_ts TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def add(self, thread_ts: str) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO bot_threads VALUES (?, ?)", (thread_ts, now)
+            )
+            self._conn.execute(
+                "DELETE FROM bot_threads WHERE created_at < ?", (now - self.max_age,)
+            )
+
+    def __contains__(self, thread_ts: object) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM bot_threads WHERE thread_ts = ?", (thread_ts,)
+            ).fetchone()
+        return row is not None
+
+
+async def _serve(
+    worker_id: str, target: str, inbox: Any, outbox: Any, concurrency: int
+) -> None:
+    module = importlib.import_module(target)
+    if hasattr(module, "init_worker"):
+        module.init_worker(worker_id)
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    # 同じキー（セッション）のリクエストは到着順に1つずつ処理する
+    locks: dict[str, tuple[asyncio.Lock, int]] = {}
+    tasks: set[asyncio.Task] = set()
+
+    async def run(request_id: int, key: str, method: str, args: tuple) -> None:
+        lock, users = locks.get(key) or (asyncio.Lock(), 0)
+        locks[key] = (lock, users + 1)
+        try:
+            async with lock, slots:
+                result = await getattr(module, method)(*args)
+            outbox.put(("result", request_id, True, result))
+        except Exception as e:
+            logger.exception("ワーカーでの処理に失敗しました: %s", method)
+            outbox.put(("result", request_id, False, f"{type(e).__name__}: {e}"))
+        finally:
+            lock, users = locks[key]
+            if users == 1:
+                del locks[key]
+            else:
+                locks[key] = (lock, users - 1)
+
+    outbox.put(("ready", worker_id))
+    while True:
+        message = await loop.run_in_executor(None, inbox.get)
+        if message is None:
+            break
+        task = asyncio.create_task(run(*message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+def _worker_main(
+    worker_id: str, target: str, inbox: Any, outbox: Any, concurrency: int
+) -> None:
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(worker_id, target, inbox, outbox, concurrency))
+
+
+class WorkerPool:
+    """キーのコンシステントハッシュでリクエストをワーカープロセスに振り分ける
+
+    target はワーカーで読み込むモジュール名。submit で指定したメソッドをそのモジュールの
+    コルーチン関数として呼び出す。リバランス時に移動するキーは、target の
+    export_session(key) / import_session(key, data) で新しいワーカーへ引き継ぐ。
+    引き継ぐのは最近使われた max_keys 個のキーまでで、それより古いキーは移動先で
+    新しいセッションになる。
+    """
+
+    def __init__(
+        self,
+        target: str,
+        workers: int = 2,
+        concurrency: int = 16,
+        vnodes: int = 64,
+        ready_timeout: float = 120.0,
+        max_keys: int = 100_000,
+    ) -> None:
+        self.target = target
+        self.size = workers
+        self.concurrency = concurrency
+        self.ready_timeout = ready_timeout
+        self.max_keys = max_keys
+        self.ring = HashRing(vnodes=vnodes)
+        self._context = multiprocessing.get_context("spawn")
+        self._outbox = self._context.Queue()
+        self._processes: dict[str, multiprocessing.process.BaseProcess] = {}
+        self._inboxes: dict[str, Any] = {}
+        self._ready: dict[str, threading.Event] = {}
+        # リクエストID -> (ワーカー, Future)
+        self._pending: dict[int, tuple[str, Future]] = {}
+        # 最近振り分けたキー -> 担当ワーカー（古い順）
+        self._keys: OrderedDict[str, str] = OrderedDict()
+        # リバランスでセッションを移している最中のキー。終わるまで振り分けを待たせる
+        self._moving: dict[str, threading.Event] = {}
+        # 異常終了から再起動している最中のワーカー。起動するまでそのワーカーへの振り分けを待たせる
+        self._restarting: dict[str, threading.Event] = {}
+        self._ids = itertools.count()
+        # _lock はワーカー構成と振り分け、_pending_lock は結果待ちの管理を守る
+        self._lock = threading.RLock()
+        self._pending_lock = threading.Lock()
+        self._resize_lock = threading.Lock()
+        self._collector: threading.Thread | None = None
+        self._closed = False
+
+    def start(self) -> "WorkerPool":
+        self._collector = threading.Thread(
+            target=self._collect, name="shard-collector", daemon=True
+        )
+        self._collector.start()
+        with self._lock:
+            for i in range(self.size):
+                self._spawn(f"worker-{i}")
+            for worker_id in list(self._processes):
+                self._wait_ready(worker_id)
+                self.ring.add(worker_id)
+        return self
+
+    def submit(self, key: str, method: str, *args: Any) -> Future:
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise WorkerError("ワーカープールは停止しています")
+                worker_id = self.ring.lookup(key)
+                waiting = self._moving.get(key) or self._restarting.get(worker_id)
+                if waiting is None:
+                    if self._processes[worker_id].is_alive():
+                        self._keys[key] = worker_id
+                        self._keys.move_to_end(key)
+                        if len(self._keys) > self.max_keys:
+                            self._keys.popitem(last=False)
+                        return self._send(worker_id, key, method, args)
+                    self._restart(worker_id)
+            if waiting is not None:
+                waiting.wait()
+                continue
+            # 起動はロックの外で待ち、他のワーカーへの振り分けやリサイズを止めない
+            try:
+                self._wait_ready(worker_id)
+            finally:
+                with self._lock:
+                    self._restarting.pop(worker_id).set()
+
+    def call(
+        self, key: str, method: str, *args: Any, timeout: float | None = None
+    ) -> Any:
+        return self.submit(key, method, *args).result(timeout)
+
+    def resize(self, workers: int) -> int:
+        """ワーカー数を変更し、担当が変わるキーのセッションを移す。移したセッション数を返す"""
+        if workers < 1:
+            raise ValueError("ワーカーは1つ以上必要です")
+        with self._resize_lock:
+            # 新しいワーカーはリングに加えるまで振り分けられないので、起動はロックの外で待つ
+            with self._lock:
+                current = sorted(
+                    self._processes, key=lambda w: int(w.rsplit("-", 1)[1])
+                )
+                added = [f"worker-{i}" for i in range(len(current), workers)]
+                removed = current[workers:]
+                for worker_id in added:
+                    self._spawn(worker_id)
+            for worker_id in added:
+                self._wait_ready(worker_id)
+
+            with self._lock:
+                for worker_id in added:
+                    self.ring.add(worker_id)
+                for worker_id in removed:
+                    self.ring.remove(worker_id)
+                moves = []
+                for key, old in self._keys.items():
+                    new = self.ring.lookup(key)
+                    if new != old:
+                        moves.append((key, old, new))
+                        self._moving[key] = threading.Event()
+
+            # 移動中のキーへのリクエストだけを待たせ、他のキーは処理を続ける
+            moved = 0
+            for key, old, new in moves:
+                try:
+                    # export は同じキーの処理中リクエストが終わってから実行される
+                    data = self._send(old, key, "export_session", (key,)).result()
+                    if data is not None:
+                        self._send(new, key, "import_session", (key, data)).result()
+                        moved += 1
+                finally:
+                    with self._lock:
+                        if key in self._keys:
+                            self._keys[key] = new
+                        self._moving.pop(key).set()
+            MIGRATED_TOTAL.inc(moved)
+
+            with self._lock:
+                stopping = [self._detach(worker_id) for worker_id in removed]
+                self.size = workers
+            for process in stopping:
+                self._join(process)
+            logger.info(
+                "ワーカー数を %d にしました（%d セッションを移動）", workers, moved
+            )
+            return moved
+
+    def owners(self) -> dict[str, int]:
+        """ワーカーごとの担当キー数"""
+        with self._lock:
+            counts = dict.fromkeys(self._processes, 0)
+            for worker_id in self._keys.values():
+                counts[worker_id] = counts.get(worker_id, 0) + 1
+            return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            stopping = [self._detach(worker_id) for worker_id in list(self._processes)]
+        for process in stopping:
+            self._join(process)
+
+    def _spawn(self, worker_id: str) -> None:
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.target, inbox, self._outbox, self.concurrency),
+            name=f"slack-{worker_id}",
+            daemon=True,
+        )
+        self._ready[worker_id] = threading.Event()
+        self._inboxes[worker_id] = inbox
+        self._processes[worker_id] = process
+        process.start()
+
+    def _wait_ready(self, worker_id: str) -> None:
+        ready = self._ready.get(worker_id)
+        if ready is not None and not ready.wait(self.ready_timeout):
+            raise WorkerError(f"{worker_id} が起動しませんでした")
+
+    def _detach(self, worker_id: str) -> multiprocessing.process.BaseProcess:
+        # self._lock を保持した状態で呼ぶ。ワーカーは受け付け済みの処理を終えてから終了する
+        self._inboxes.pop(worker_id).put(None)
+        ready = self._ready.pop(worker_id, None)
+        if ready is not None:
+            # 起動を待っている再起動を止める（待っていた振り分けは停止・リサイズ後の状態で再試行する）
+            ready.set()
+        return self._processes.pop(worker_id)
+
+    @staticmethod
+    def _join(process: multiprocessing.process.BaseProcess) -> None:
+        process.join(30)
+        if process.is_alive():
+            process.terminate()
+
+    def _restart(self, worker_id: str) -> None:
+        # self._lock を保持した状態で呼ぶ。起動の完了は呼び出し元がロックの外で待つ
+        # 異常終了したワーカーは同じIDで起動し直す。担当キーは変わらないがセッションは失われる
+        logger.error("%s が終了していたため再起動します", worker_id)
+        WORKER_RESTARTS_TOTAL.inc()
+        self._fail_pending(worker_id)
+        self._inboxes.pop(worker_id, None)
+        self._spawn(worker_id)
+        self._restarting[worker_id] = threading.Event()
+
+    def _send(self, worker_id: str, key: str, method: str, args: tuple) -> Future:
+        future: Future = Future()
+        request_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[request_id] = (worker_id, future)
+        DISPATCHED_TOTAL.inc(worker=worker_id)
+        WORKER_IN_FLIGHT.inc(worker=worker_id)
+        self._inboxes[worker_id].put((request_id, key, method, args))
+        return future
+
+    def _fail_pending(self, worker_id: str) -> None:
+        with self._pending_lock:
+            failed = [rid for rid, (w, _) in self._pending.items() if w == worker_id]
+            for request_id in failed:
+                _, future = self._pending.pop(request_id)
+                WORKER_IN_FLIGHT.dec(worker=worker_id)
+                future.set_exception(WorkerError(f"{worker_id} が終了しました"))
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                message = self._outbox.get(timeout=1.0)
+            except queue.Empty:
+                dead = [w for w, p in list(self._processes.items()) if not p.is_alive()]
+                for worker_id in dead:
+                    self._fail_pending(worker_id)
+                continue
+            except (EOFError, OSError):
+                return
+
+            # 想定外のメッセージで結果の受け取りが止まらないようにする
+            try:
+                self._handle(message)
+            except Exception:
+                logger.exception(
+                    "ワーカーからのメッセージを処理できませんでした: %r", message
+                )
+
+    def _handle(self, message: tuple) -> None:
+        if message[0] == "ready":
+            # 停止済みのワーカーからの通知は無視する
+            ready = self._ready.get(message[1])
+            if ready is not None:
+                ready.set()
+            return
+        _, request_id, ok, value = message
+        with self._pending_lock:
+            entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return
+        worker_id, future = entry
+        WORKER_IN_FLIGHT.dec(worker=worker_id)
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(WorkerError(value))
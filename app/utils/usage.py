@@ -0,0 +1,354 @@
+import atexit
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types as genai_types
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+BUDGET_EXCEEDED_MESSAGE = (
+    "トークン利用量の上限に達したため、しばらく時間をおいてから再度お試しください。"
+)
+
+TOKENS_TOTAL = REGISTRY.counter(
+    "adk_model_tokens_total",
+    "Number of tokens consumed by model calls.",
+    ("model", "kind"),
+)
+BUDGET_ACTIONS_TOTAL = REGISTRY.counter(
+    "adk_token_budget_actions_total",
+    "Number of model calls rejected or downgraded by per-user token budgets.",
+    ("action",),
+)
+
+# 集計値の並び: 呼び出し回数, 入力, 出力, キャッシュ済み入力, 合計
+_FIELDS = ("calls", "prompt_tokens", "output_tokens", "cached_tokens", "total_tokens")
+
+
+def prompt_version(name: str, prompt: Any | None) -> str:
+    """Langfuseのプロンプトオブジェクトから 'name:v3' 形式のバージョン文字列を作る"""
+    version = getattr(prompt, "version", None)
+    return f"{name}:v{version}" if version is not None else f"{name}:fallback"
+
+
+@dataclass
+class UsageScope:
+    """1回のリクエスト（エージェント実行）に紐づく利用者情報と、そのリクエスト内の合計"""
+
+    user_id: str
+    session_id: str
+    invocation_id: str = ""
+    automatic: bool = False
+    totals: list[int] = field(default_factory=lambda: [0] * len(_FIELDS))
+    # バジェット超過やツールのタイムアウトなど、通常とは異なる応答になった理由
+    degraded: set[str] = field(default_factory=set)
+
+    def as_langfuse_usage(self) -> dict[str, int]:
+        return {
+            "input": self.totals[1],
+            "output": self.totals[2],
+            "total": self.totals[4],
+        }
+
+
+_current_scope: contextvars.ContextVar[UsageScope | None] = contextvars.ContextVar(
+    "usage_scope", default=None
+)
+
+
+@contextmanager
+def scope(user_id: str, session_id: str) -> Iterator[UsageScope]:
+    """この中で行われたモデル呼び出しを user_id / session_id に紐づける
+
+    ネストした search_agent は AgentTool 内で 'tmp_user' として実行されるため、
+    呼び出し元で明示的にスコープを張っておく。
+    """
+    current = UsageScope(user_id=user_id, session_id=session_id)
+    token = _current_scope.set(current)
+    try:
+        yield current
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope() -> UsageScope | None:
+    return _current_scope.get()
+
+
+def mark_degraded(reason: str) -> None:
+    """実行中のリクエストの応答が、他のユーザーに使い回してはいけないものであることを記録する"""
+    current = _current_scope.get()
+    if current is not None:
+        current.degraded.add(reason)
+
+
+def bind_invocation(callback_context: CallbackContext) -> None:
+    """root_agent の before_agent_callback。
+
+    Agent Engine のように呼び出し元でスコープを張れない経路でも、
+    実行中のユーザー・セッションに利用量を紐づけられるようにする。
+    """
+    current = _current_scope.get()
+    if current is not None and not (
+        current.automatic and current.invocation_id != callback_context.invocation_id
+    ):
+        return
+    invocation = callback_context._invocation_context
+    _current_scope.set(
+        UsageScope(
+            user_id=invocation.user_id,
+            session_id=invocation.session.id,
+            invocation_id=callback_context.invocation_id,
+            automatic=True,
+        )
+    )
+
+
+class UsageStore:
+    """集計結果を保存するローカルのSQLiteストア
+
+    ファイルは最初に書き込み・読み出しをするときに開く（import しただけでは作らない）。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # self._lock を取った状態で呼ぶ
+        if self._conn is not None:
+            return self._conn
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        with conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS token_usage (
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    total_tokens INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, session_id, model, prompt_version)
+                )
+                """
+            )
+        self._conn = conn
+        return conn
+
+    def add(self, rows: dict[tuple[str, str, str, str], list[int]]) -> None:
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, session_id, model, prompt_version) DO UPDATE SET
+                    calls = calls + excluded.calls,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens,
+                    cached_tokens = cached_tokens + excluded.cached_tokens,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    updated_at = excluded.updated_at
+                """,
+                [(*key, *values, now) for key, values in rows.items()],
+            )
+
+    def totals_by(self, column: str) -> dict[str, int]:
+        if column not in ("user_id", "session_id", "model", "prompt_version"):
+            raise ValueError(f"集計できない列です: {column}")
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                f"SELECT {column}, SUM(total_tokens) FROM token_usage GROUP BY {column}"
+            ).fetchall()
+        return dict(rows)
+
+
+class UsageTracker:
+    """モデル呼び出しごとのトークン数をメモリ上で集計し、定期的にストアへ書き出す"""
+
+    def __init__(
+        self,
+        store: UsageStore | None = None,
+        flush_interval: float = 30.0,
+        budget_tokens: int = 0,
+        budget_window: float = 86400.0,
+        budget_action: str = "reject",
+        downgrade_model: str = "gemini-2.5-flash-lite",
+    ) -> None:
+        if budget_action not in ("reject", "downgrade"):
+            raise ValueError(f"不明なバジェット超過時の動作です: {budget_action}")
+        self.store = store
+        self.flush_interval = flush_interval
+        self.budget_tokens = budget_tokens
+        self.budget_window = budget_window
+        self.budget_action = budget_action
+        self.downgrade_model = downgrade_model
+        self._lock = threading.Lock()
+        # 前回のフラッシュ以降の差分
+        self._pending: dict[tuple[str, str, str, str], list[int]] = {}
+        # ユーザーごとの (ウィンドウ開始時刻, ウィンドウ内の合計トークン)
+        self._windows: dict[str, tuple[float, int]] = {}
+        self._flusher: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def record(
+        self,
+        model: str,
+        usage: genai_types.GenerateContentResponseUsageMetadata | None,
+        prompt_version: str = "",
+    ) -> None:
+        if usage is None:
+            return
+        values = [
+            1,
+            usage.prompt_token_count or 0,
+            usage.candidates_token_count or 0,
+            usage.cached_content_token_count or 0,
+            usage.total_token_count or 0,
+        ]
+        current = _current_scope.get()
+        user_id = current.user_id if current else ""
+        session_id = current.session_id if current else ""
+        key = (user_id, session_id, model, prompt_version)
+
+        with self._lock:
+            pending = self._pending.setdefault(key, [0] * len(_FIELDS))
+            for i, value in enumerate(values):
+                pending[i] += value
+            if current is not None:
+                for i, value in enumerate(values):
+                    current.totals[i] += value
+            if self.budget_tokens and user_id:
+                start, used = self._window(user_id)
+                self._windows[user_id] = (start, used + values[4])
+
+        TOKENS_TOTAL._add((model, "input"), values[1])
+        TOKENS_TOTAL._add((model, "output"), values[2])
+        TOKENS_TOTAL._add((model, "cached"), values[3])
+        self._ensure_flusher()
+
+    def _window(self, user_id: str) -> tuple[float, int]:
+        now = time.time()
+        start, used = self._windows.get(user_id, (now, 0))
+        if now - start >= self.budget_window:
+            return now, 0
+        return start, used
+
+    def used_tokens(self, user_id: str) -> int:
+        with self._lock:
+            return self._window(user_id)[1]
+
+    def enforce_budget(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> LlmResponse | None:
+        """before_model_callback。ユーザーのバジェットを超えていれば拒否またはモデルを格下げする"""
+        current = _current_scope.get()
+        if not self.budget_tokens or current is None:
+            return None
+        if self.used_tokens(current.user_id) < self.budget_tokens:
+            return None
+
+        BUDGET_ACTIONS_TOTAL._add((self.budget_action,), 1)
+        current.degraded.add(f"budget_{self.budget_action}")
+        if self.budget_action == "downgrade":
+            logger.info(
+                f"[Usage] {current.user_id} がバジェットを超過したため "
+                f"{self.downgrade_model} に切り替えます"
+            )
+            llm_request.model = self.downgrade_model
+            return None
+
+        logger.info(
+            f"[Usage] {current.user_id} がバジェットを超過したためリクエストを拒否します"
+        )
+        return LlmResponse(
+            content=genai_types.Content(
+                role="model",
+                parts=[genai_types.Part.from_text(text=BUDGET_EXCEEDED_MESSAGE)],
+            )
+        )
+
+    def snapshot(self) -> dict[tuple[str, str, str, str], dict[str, int]]:
+        """未フラッシュの集計値を返す（デバッグ・テスト用）"""
+        with self._lock:
+            return {
+                key: dict(zip(_FIELDS, values, strict=True))
+                for key, values in self._pending.items()
+            }
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.store is None:
+            return
+        try:
+            self.store.add(pending)
+        except Exception as e:
+            logger.error(f"[Usage] 利用量の書き出しに失敗しました: {e}")
+
+    def _ensure_flusher(self) -> None:
+        if self.store is None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="usage-flusher", daemon=True
+            )
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def _flush_loop(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self.flush()
+
+
+# プロセス全体で共有するトラッカー。エージェントはデプロイ時にpickleされるため、
+# コールバックにはインスタンスではなく下のモジュール関数を渡す。
+tracker = UsageTracker()
+
+
+def configure(store_path: str | None = None, **kwargs: Any) -> UsageTracker:
+    """共有トラッカーを設定し直す。kwargs は UsageTracker に渡される"""
+    global tracker
+    tracker.close()
+    tracker = UsageTracker(
+        store=UsageStore(store_path) if store_path else None, **kwargs
+    )
+    return tracker
+
+
+def record(
+    model: str,
+    usage: genai_types.GenerateContentResponseUsageMetadata | None,
+    prompt_version: str = "",
+) -> None:
+    tracker.record(model, usage, prompt_version=prompt_version)
+
+
+def enforce_budget(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> LlmResponse | None:
+    return tracker.enforce_budget(callback_context, llm_request)
@@ -0,0 +1,166 @@
+"""Offline precision/recall of the near-duplicate answer cache.
+
+For every labeled question pair, the first question's answer is stored and the second
+question is looked up, exactly as process_with_agent does. A hit on a pair labeled as
+a duplicate is a true positive, and a hit on any other pair is a false positive that
+would serve a wrong answer. Questions that depend on the conversation or the current
+time are never cached, so they count as misses.
+
+A simulated stream of questions drawn from the same paraphrase groups then reports the
+hit rate and the agent time saved at the configured threshold.
+
+Usage:
+    uv run python -m tests.benchmarks.answer_cache_eval [--dataset pairs.jsonl] [--agent-seconds 6]
+
+The optional dataset is JSONL with "a", "b" and "duplicate" (true/false) fields.
+"""
+
+import argparse
+import itertools
+import json
+import random
+
+from app.utils.answer_cache import AnswerCache
+
+# 同じグループの質問は同じ答えでよい言い換え
+GROUPS = [
+    [
+        "東京の天気は？",
+        "東京の天気は?",
+        "東京の天気はどう？",
+        "東京の天気を教えて",
+        "東京 天気",
+    ],
+    ["大阪の天気は？", "大阪の天気を教えて", "大阪の天気はどう？"],
+    [
+        "What's the weather in Tokyo?",
+        "what is the weather in tokyo",
+        "Tokyo weather?",
+        "weather in Tokyo",
+    ],
+    ["What's the weather in New York?", "weather in new york", "New York weather?"],
+    [
+        "生成AIの最新ニュースを調べて",
+        "生成AIの最新ニュースを調べてください",
+        "生成ＡＩの最新ニュースを調べて！",
+    ],
+    [
+        "Gemini 2.5 Flash と Flash-Lite の違いは？",
+        "Gemini 2.5 FlashとFlash-Liteの違いは?",
+        "gemini 2.5 flash と flash-lite の違い",
+    ],
+    [
+        "Slackのスレッドの使い方を教えて",
+        "Slackのスレッドの使い方を教えてください",
+        "slack スレッドの使い方",
+    ],
+    ["Why is the sky blue?", "why is the sky blue", "Why is the sky blue ?"],
+    ["富士山の高さは？", "富士山の高さを教えて", "富士山の標高は？"],
+    [
+        "Pythonでリストを逆順にする方法",
+        "python でリストを逆順にする方法は？",
+        "Pythonでリストを逆順にするには？",
+    ],
+]
+# 似ているが答えが違う、または文脈や時刻に依存するので使い回してはいけない組
+NEGATIVES = [
+    ("東京の天気は？", "京都の天気は？"),
+    ("東京の天気は？", "東京の明日の天気は？"),
+    ("What's the weather in Tokyo?", "What's the weather in Kyoto?"),
+    ("What's the weather in New York?", "What's the weather in New Delhi?"),
+    ("生成AIの最新ニュースを調べて", "生成AIの最新論文を調べて"),
+    ("Gemini 2.5 Flash と Flash-Lite の違いは？", "Gemini 2.5 Pro と Flash の違いは？"),
+    ("富士山の高さは？", "エベレストの高さは？"),
+    ("Pythonでリストを逆順にする方法", "Pythonでリストを並び替える方法"),
+    ("東京の天気は？", "それの天気は？"),
+    ("Why is the sky blue?", "Why is it blue?"),
+    ("ロンドンの時刻は？", "ロンドンの時刻は?"),
+    ("東京の天気を教えて", "もっと詳しく教えて"),
+]
+
+
+def labeled_pairs() -> list[tuple[str, str, bool]]:
+    pairs = [
+        (a, b, True) for group in GROUPS for a, b in itertools.permutations(group, 2)
+    ]
+    pairs += [
+        (a, b, False)
+        for g1, g2 in itertools.combinations(GROUPS, 2)
+        for a, b in [(g1[0], g2[0])]
+    ]
+    pairs += [(a, b, False) for a, b in NEGATIVES]
+    return pairs
+
+
+def evaluate(pairs: list[tuple[str, str, bool]], threshold: float) -> dict[str, float]:
+    tp = fp = fn = 0
+    for a, b, duplicate in pairs:
+        cache = AnswerCache(threshold=threshold)
+        cache.store(a, f"answer to {a}", "v1", 1.0)
+        hit = cache.lookup(b, "v1") is not None
+        tp += hit and duplicate
+        fp += hit and not duplicate
+        fn += duplicate and not hit
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "false_hits": fp}
+
+
+def simulate(
+    threshold: float, questions: int, agent_seconds: float, seed: int = 0
+) -> None:
+    rng = random.Random(seed)
+    cache = AnswerCache(threshold=threshold)
+    # 人気の質問ほど多く聞かれる（Zipf）
+    weights = [1 / (rank + 1) for rank in range(len(GROUPS))]
+    wrong = 0
+    for _ in range(questions):
+        group = rng.choices(range(len(GROUPS)), weights)[0]
+        question = rng.choice(GROUPS[group])
+        cached = cache.lookup(question, "v1")
+        if cached is None:
+            cache.store(question, f"group {group}", "v1", agent_seconds)
+        elif cached.answer != f"group {group}":
+            wrong += 1
+    stats = cache.stats
+    print(
+        f"\nsimulated {questions} questions: hit rate {stats.hit_rate:.1%}, "
+        f"agent time saved {stats.latency_saved:.0f}s of {questions * agent_seconds:.0f}s, "
+        f"wrong answers {wrong}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dataset", help="JSONL with a, b and duplicate fields")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--questions", type=int, default=1000)
+    parser.add_argument("--agent-seconds", type=float, default=6.0)
+    args = parser.parse_args()
+
+    if args.dataset:
+        with open(args.dataset) as f:
+            pairs = [
+                (row["a"], row["b"], bool(row["duplicate"]))
+                for row in map(json.loads, f)
+            ]
+    else:
+        pairs = labeled_pairs()
+    positives = sum(d for _, _, d in pairs)
+    print(
+        f"pairs: {len(pairs)} ({positives} duplicates, {len(pairs) - positives} distinct)"
+    )
+    print(f"{'threshold':>10}{'precision':>11}{'recall':>9}{'f1':>7}{'false hits':>12}")
+    for threshold in (0.4, 0.5, 0.6, 0.7, 0.8, 0.9):
+        result = evaluate(pairs, threshold)
+        marker = " <" if threshold == args.threshold else ""
+        print(
+            f"{threshold:>10.1f}{result['precision']:>11.3f}{result['recall']:>9.3f}"
+            f"{result['f1']:>7.3f}{result['false_hits']:>12}{marker}"
+        )
+    simulate(args.threshold, args.questions, args.agent_seconds)
+
+
+if __name__ == "__main__":
+    main()
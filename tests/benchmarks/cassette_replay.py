@@ -0,0 +1,112 @@
+"""Application overhead and end-to-end latency replayed from a model cassette.
+
+Replays the root_agent prompts recorded in a cassette (by default the one the
+integration tests use) through Runner, once with recorded timing and once without
+waiting. Recorded timing reproduces the latency seen when the cassette was recorded;
+without waiting, what is left is the time spent in ADK and the application code.
+
+If the cassette does not exist, one is recorded from the fake model first, so the
+benchmark also runs on a machine without credentials.
+
+Usage:
+    uv run python -m tests.benchmarks.cassette_replay [--cassette PATH] [--repeat 20]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from app import config
+from app.agent import create_agents
+from app.utils import cassette
+from app.utils.langfuse import LangfuseClient
+
+DEFAULT_CASSETTE = "tests/integration/cassettes/gemini.jsonl.gz"
+MESSAGES = [
+    "Why is the sky blue?",
+    "What's the weather in San Francisco?",
+    "東京の時刻は？",
+]
+
+
+async def run_prompts(prompts: list[str], repeat: int) -> list[float]:
+    """Runs every prompt in a new session and returns seconds per turn."""
+    agent = create_agents(LangfuseClient(public_key="", secret_key="", host=""))
+    session_service = InMemorySessionService()
+    runner = Runner(agent=agent, app_name="bench", session_service=session_service)
+    seconds = []
+    for _ in range(repeat):
+        for prompt in prompts:
+            session = await session_service.create_session(
+                app_name="bench", user_id="user"
+            )
+            start = time.perf_counter()
+            async for _ in runner.run_async(
+                user_id=session.user_id,
+                session_id=session.id,
+                new_message=types.Content(
+                    role="user", parts=[types.Part.from_text(text=prompt)]
+                ),
+            ):
+                pass
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def record_fake(path: str) -> None:
+    config.USE_FAKE_MODEL = True
+    config.FAKE_MODEL_LATENCY = "0.3"
+    config.LLM_CASSETTE_MODE = "record"
+    asyncio.run(run_prompts(MESSAGES, 1))
+    cassette.save_all()
+    config.USE_FAKE_MODEL = False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cassette", default=DEFAULT_CASSETTE)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    config.LLM_CASSETTE = args.cassette
+    if not Path(args.cassette).exists():
+        print(
+            f"{args.cassette} not found, recording one from the fake model (0.3s per call)"
+        )
+        record_fake(args.cassette)
+
+    recorded = cassette.open_cassette(args.cassette)
+    # 新しいセッションの最初のリクエストだけが root_agent へのプロンプト
+    prompts = list(
+        dict.fromkeys(
+            i.prompt
+            for i in recorded.interactions
+            if i.turns == 1 and "search_agent" in i.tools
+        )
+    )
+    print(
+        f"cassette: {args.cassette}  prompts: {len(prompts)}  calls: {len(recorded.interactions)}"
+    )
+
+    config.LLM_CASSETTE_MODE = "replay"
+    print(f"{'timing':<10}{'turns':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for label, timing in (("recorded", 1.0), ("none", 0.0)):
+        config.LLM_CASSETTE_TIMING = str(timing)
+        seconds = asyncio.run(run_prompts(prompts, 1 if timing else args.repeat))
+        cassette.open_cassette(args.cassette).rewind()
+        ms = sorted(s * 1000 for s in seconds)
+        p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+        print(
+            f"{label:<10}{len(ms):>8}{statistics.mean(ms):>10.1f}"
+            f"{statistics.median(ms):>10.1f}{p95:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
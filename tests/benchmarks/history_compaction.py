@@ -0,0 +1,123 @@
+"""Prompt size and latency over a long synthetic Slack conversation.
+
+Sends a 200-turn conversation to one session, with and without history compaction.
+Every fourth message triggers a search that returns a long result, like search_agent
+does in production. The fake model sleeps in proportion to its input tokens, so
+latency follows prompt size. The rolling summary comes from a slow fake model, which
+shows that summaries are generated off the request path.
+
+With compaction on, the remaining growth in latency comes from the session service
+and ADK copying every stored event on each run, not from the prompt.
+
+Usage:
+    uv run python -m tests.benchmarks.history_compaction [--turns 200]
+"""
+
+import argparse
+import asyncio
+import time
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.adk.tools import FunctionTool
+from google.genai import types
+
+from app import config
+from app.agent import create_agents
+from app.utils import history, usage
+from app.utils.fake_llm import FakeLlm
+from app.utils.langfuse import LangfuseClient
+
+MESSAGES = [
+    "東京の天気は？",
+    "最新のAIニュースを調べて",
+    "ありがとう",
+    "ロンドンの時刻は？",
+]
+
+
+def search_agent(request: str) -> str:
+    """Stands in for search_agent with a result of realistic length."""
+    return f"{request} の調査結果: " + "Lorem ipsum dolor sit amet. " * 80
+
+
+async def converse(turns: int) -> list[tuple[int, float]]:
+    """Returns (prompt tokens, seconds) of every turn."""
+    agent = create_agents(LangfuseClient(public_key="", secret_key="", host=""))
+    agent.tools = [
+        *(
+            tool
+            for tool in agent.tools
+            if getattr(tool, "name", None) != "search_agent"
+        ),
+        FunctionTool(search_agent),
+    ]
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="bench", user_id="user")
+    runner = Runner(agent=agent, app_name="bench", session_service=session_service)
+
+    results = []
+    for i in range(turns):
+        start = time.perf_counter()
+        with usage.scope(session.user_id, session.id) as request_usage:
+            async for _ in runner.run_async(
+                user_id=session.user_id,
+                session_id=session.id,
+                new_message=types.Content(
+                    role="user",
+                    parts=[types.Part.from_text(text=MESSAGES[i % len(MESSAGES)])],
+                ),
+            ):
+                pass
+        results.append((request_usage.totals[1], time.perf_counter() - start))
+    await history.compactor.drain()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    args = parser.parse_args()
+
+    config.USE_FAKE_MODEL = True
+    config.FAKE_MODEL_LATENCY = "0.002"
+    config.FAKE_MODEL_PREFILL_LATENCY = "0.005"
+    summary_model = FakeLlm(
+        model=config.HISTORY_SUMMARY_MODEL,
+        latency=0.2,
+        reply="ユーザーは各都市の天気・時刻とAIニュースの調査を繰り返し依頼している。",
+    )
+
+    runs = {}
+    for label, compactor in (
+        ("off", history.HistoryCompactor(max_tokens=10**9, max_events=10**9)),
+        (
+            "on",
+            history.HistoryCompactor(
+                summary_model=summary_model, max_tokens=args.max_tokens
+            ),
+        ),
+    ):
+        history.compactor = compactor
+        usage.configure()
+        runs[label] = asyncio.run(converse(args.turns))
+
+    window = max(1, args.turns // 10)
+    print(
+        f"{'turns':<12}{'tokens off':>12}{'tokens on':>12}{'ms off':>10}{'ms on':>10}"
+    )
+    for start in range(0, args.turns, window):
+        row = f"{start + 1:>4}-{min(start + window, args.turns):<7}"
+        for label in ("off", "on"):
+            chunk = runs[label][start : start + window]
+            row += f"{sum(t for t, _ in chunk) / len(chunk):>12.0f}"
+        for label in ("off", "on"):
+            chunk = runs[label][start : start + window]
+            row += f"{sum(s for _, s in chunk) / len(chunk) * 1000:>10.1f}"
+        print(row)
+    print(f"background summaries: {summary_model._calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Measures the per-request overhead of the stage instrumentation.
+
+Usage:
+    uv run python -m tests.benchmarks.metrics_overhead [--requests 200]
+"""
+
+import argparse
+import asyncio
+import time
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from app import config
+from app.agent import create_agents
+from app.utils import metrics
+from app.utils.langfuse import LangfuseClient
+
+MESSAGES = ["東京の天気は？", "サンフランシスコの時刻は？", "こんにちは"]
+
+
+def bench_stage(iterations: int) -> float:
+    """Returns the cost of one stage() enter/exit in nanoseconds."""
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        with metrics.stage("bench", target="noop"):
+            pass
+    return (time.perf_counter_ns() - start) / iterations
+
+
+async def bench_requests(requests: int) -> float:
+    """Returns the mean wall time of one agent request in microseconds."""
+    langfuse_client = LangfuseClient(public_key="", secret_key="", host="")
+    session_service = InMemorySessionService()
+
+    start = time.perf_counter()
+    for i in range(requests):
+        with metrics.stage("process_message"):
+            with metrics.stage("agent_build"):
+                agent = create_agents(langfuse_client)
+            runner = Runner(
+                agent=agent, app_name="bench", session_service=session_service
+            )
+            with metrics.stage("session_lookup"):
+                session = await session_service.create_session(
+                    app_name="bench", user_id=f"user_{i}"
+                )
+            async for _ in runner.run_async(
+                user_id=session.user_id,
+                session_id=session.id,
+                new_message=types.Content(
+                    role="user",
+                    parts=[types.Part.from_text(text=MESSAGES[i % len(MESSAGES)])],
+                ),
+            ):
+                pass
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+
+    config.USE_FAKE_MODEL = True
+
+    results = {}
+    for label, enabled, otel in (
+        ("disabled", False, False),
+        ("enabled", True, False),
+        ("enabled+otel", True, True),
+    ):
+        metrics.configure(enabled=enabled, otel_spans=otel)
+        stage_ns = bench_stage(args.iterations)
+        asyncio.run(bench_requests(10))  # warm-up
+        request_us = asyncio.run(bench_requests(args.requests))
+        results[label] = (stage_ns, request_us)
+
+    base = results["disabled"][1]
+    print(f"{'mode':<14}{'stage() ns':>12}{'request us':>14}{'overhead us':>14}")
+    for label, (stage_ns, request_us) in results.items():
+        print(
+            f"{label:<14}{stage_ns:>12.0f}{request_us:>14.1f}{request_us - base:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
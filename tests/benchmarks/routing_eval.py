@@ -0,0 +1,108 @@
+"""Offline evaluation of model routing.
+
+Replays the prompts of a JSONL file through the agent with the fake model, once with
+every request on the standard tier and once with routing enabled. Token counts come
+from the fake model; latency and cost are estimated from the per-model tables below.
+
+Usage:
+    uv run python -m tests.benchmarks.routing_eval [--dataset requests.jsonl]
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from app import config
+from app.agent import build_agents, fetch_prompts
+from app.evaluation import load_dataset
+from app.utils import usage
+from app.utils.langfuse import LangfuseClient
+from app.utils.routing import TIERS, ModelRouter
+
+# USD per 1M tokens (input, output)
+PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+# Seconds to first token and output tokens per second, measured on our workload.
+LATENCY = {
+    "gemini-2.5-flash": (0.60, 250.0),
+    "gemini-2.5-flash-lite": (0.35, 400.0),
+}
+# The fake model echoes the prompt, so assume a typical answer length instead.
+OUTPUT_TOKENS_PER_CALL = 250
+
+
+async def replay(prompts: list[str], models: list[str]) -> dict[str, float]:
+    """Runs every prompt on the given root model and returns estimated totals."""
+    prompt_objs = fetch_prompts(LangfuseClient(public_key="", secret_key="", host=""))
+    agents = {model: build_agents(prompt_objs, model=model) for model in set(models)}
+    session_service = InMemorySessionService()
+    totals = {"cost": 0.0, "latency": 0.0, "calls": 0.0}
+
+    for i, (prompt, model) in enumerate(zip(prompts, models, strict=True)):
+        tracker = usage.configure()
+        runner = Runner(
+            agent=agents[model], app_name="eval", session_service=session_service
+        )
+        session = await session_service.create_session(
+            app_name="eval", user_id=f"user_{i}"
+        )
+        async for _ in runner.run_async(
+            user_id=session.user_id,
+            session_id=session.id,
+            new_message=types.Content(
+                role="user", parts=[types.Part.from_text(text=prompt)]
+            ),
+        ):
+            pass
+
+        for (_, _, call_model, _), row in tracker.snapshot().items():
+            input_price, output_price = PRICES[call_model]
+            first_token, tokens_per_second = LATENCY[call_model]
+            output_tokens = OUTPUT_TOKENS_PER_CALL * row["calls"]
+            totals["cost"] += (
+                row["prompt_tokens"] * input_price + output_tokens * output_price
+            ) / 1e6
+            totals["latency"] += (
+                row["calls"] * first_token + output_tokens / tokens_per_second
+            )
+            totals["calls"] += row["calls"]
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dataset", default="requests.jsonl")
+    args = parser.parse_args()
+
+    config.USE_FAKE_MODEL = True
+    prompts = [case.prompt for case in load_dataset(args.dataset)]
+    router = ModelRouter()
+    decisions = [router.route(prompt) for prompt in prompts]
+
+    baseline = asyncio.run(replay(prompts, [TIERS["standard"]] * len(prompts)))
+    routed = asyncio.run(replay(prompts, [d.model for d in decisions]))
+
+    tiers = Counter(d.tier for d in decisions)
+    reasons = Counter(d.reason for d in decisions)
+    print(f"prompts: {len(prompts)}  tiers: {dict(tiers)}  reasons: {dict(reasons)}")
+    print(f"{'':<10}{'cost USD':>12}{'latency s':>12}{'mean s':>10}")
+    for label, totals in (("baseline", baseline), ("routed", routed)):
+        print(
+            f"{label:<10}{totals['cost']:>12.6f}{totals['latency']:>12.2f}"
+            f"{totals['latency'] / max(len(prompts), 1):>10.2f}"
+        )
+    if baseline["cost"]:
+        print(
+            f"savings: cost {1 - routed['cost'] / baseline['cost']:.1%}, "
+            f"latency {1 - routed['latency'] / baseline['latency']:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
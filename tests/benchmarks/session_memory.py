@@ -0,0 +1,182 @@
+"""Memory held by session history, full Event objects vs compact records.
+
+Builds the same synthetic Slack history in InMemorySessionService and in
+CompactSessionService: many sessions of several turns each. In every turn
+root_agent calls search_agent, gets a few KB of summary back, then answers.
+Popular questions share the same search summary across users, as in production.
+
+Each service is measured with tracemalloc:
+- memory held after all sessions are stored, with the top allocation sites from a
+  snapshot diff
+- the time get_session takes to hand a session to the runner
+
+The contents rebuilt for the model are checked against the original history.
+
+Usage:
+    uv run python -m tests.benchmarks.session_memory [--sessions 200] [--turns 8]
+"""
+
+import argparse
+import asyncio
+import gc
+import random
+import time
+import tracemalloc
+from typing import Any
+
+from google.adk.events import Event
+from google.adk.flows.llm_flows.contents import _get_contents
+from google.adk.sessions import BaseSessionService, InMemorySessionService
+from google.genai import types
+
+from app.utils.session_store import CompactSessionService
+
+WORDS = "検索 結果 要約 天気 東京 最新 ニュース 発表 モデル 性能 比較 価格 公開 研究 分野".split()
+
+
+def summary(rng: random.Random, size: int) -> str:
+    return "".join(rng.choice(WORDS) + "。" for _ in range(size // 3))
+
+
+def turn_events(i: int, question: str, result: str) -> list[Event]:
+    call_id = f"call-{i}"
+    return [
+        Event(
+            invocation_id=f"inv-{i}",
+            author="user",
+            content=types.Content(
+                role="user", parts=[types.Part.from_text(text=question)]
+            ),
+        ),
+        Event(
+            invocation_id=f"inv-{i}",
+            author="root_agent",
+            content=types.Content(
+                role="model",
+                parts=[
+                    types.Part(
+                        function_call=types.FunctionCall(
+                            id=call_id, name="search_agent", args={"request": question}
+                        )
+                    )
+                ],
+            ),
+        ),
+        Event(
+            invocation_id=f"inv-{i}",
+            author="root_agent",
+            content=types.Content(
+                role="user",
+                parts=[
+                    types.Part(
+                        function_response=types.FunctionResponse(
+                            id=call_id, name="search_agent", response={"result": result}
+                        )
+                    )
+                ],
+            ),
+        ),
+        Event(
+            invocation_id=f"inv-{i}",
+            author="root_agent",
+            content=types.Content(
+                role="model",
+                parts=[types.Part.from_text(text=result[:400] + "…という結果でした。")],
+            ),
+        ),
+    ]
+
+
+async def build(
+    service: BaseSessionService, sessions: int, turns: int, popular: int, seed: int
+) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    pool = [summary(random.Random(k), rng.randint(3000, 6000)) for k in range(popular)]
+    ids = []
+    for s in range(sessions):
+        session = await service.create_session(app_name="bench", user_id=f"user-{s}")
+        for t in range(turns):
+            # 半分は人気の質問（他のユーザーと同じ検索結果）、残りはその人だけの質問
+            if rng.random() < 0.5:
+                k = rng.randrange(popular)
+                question, result = f"popular question {k}", pool[k]
+            else:
+                question = f"question {s}-{t}"
+                result = summary(rng, rng.randint(3000, 6000))
+            for event in turn_events(s * turns + t, question, result):
+                await service.append_event(session, event)
+        ids.append((session.user_id, session.id))
+    return ids
+
+
+async def measure(
+    service: BaseSessionService, args: argparse.Namespace
+) -> tuple[int, list[tracemalloc.StatisticDiff], float, list[Any]]:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    ids = await build(service, args.sessions, args.turns, args.popular, args.seed)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    top = after.compare_to(before, "filename")[:3]
+
+    start = time.perf_counter()
+    contents = []
+    for user_id, session_id in ids[: args.reads]:
+        session = await service.get_session(
+            app_name="bench", user_id=user_id, session_id=session_id
+        )
+        assert session is not None
+        contents.append(_get_contents(None, session.events, "root_agent"))
+    per_get = (time.perf_counter() - start) / min(len(ids), args.reads)
+    return held, top, per_get, contents
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument(
+        "--popular", type=int, default=20, help="distinct popular search results"
+    )
+    parser.add_argument(
+        "--threshold", type=int, default=2048, help="side-store size threshold in bytes"
+    )
+    parser.add_argument(
+        "--reads", type=int, default=100, help="get_session calls to time"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{args.sessions} sessions x {args.turns} turns, {args.popular} popular search results"
+    )
+    results = {}
+    for label, service in (
+        ("events", InMemorySessionService()),
+        ("compact", CompactSessionService(blob_threshold=args.threshold)),
+    ):
+        held, top, per_get, contents = asyncio.run(measure(service, args))
+        results[label] = (held, contents)
+        print(
+            f"\n{label}: {held / 2**20:.1f} MiB held, get_session {per_get * 1000:.2f} ms"
+        )
+        for stat in top:
+            print(f"  {stat.size_diff / 2**20:>7.1f} MiB  {stat.traceback[0].filename}")
+        if isinstance(service, CompactSessionService):
+            print(
+                f"  records {service.event_bytes / 2**20:.1f} MiB, side store "
+                f"{service.blobs.bytes / 2**20:.1f} MiB in {len(service.blobs)} blobs"
+            )
+
+    equivalent = results["events"][1] == results["compact"][1]
+    ratio = results["events"][0] / results["compact"][0]
+    print(
+        f"\ncompact holds {ratio:.1f}x less memory; model contents equivalent: {equivalent}"
+    )
+
+
+if __name__ == "__main__":
+    main()
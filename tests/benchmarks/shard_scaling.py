@@ -0,0 +1,87 @@
+"""Throughput of the sharded Slack workers by worker count, at equal total concurrency.
+
+Starts WorkerPool("app.slack_worker") with the fake model and sends messages from many
+users at once, as the Socket Mode dispatcher would. Every configuration gets the same
+total number of concurrent messages (--concurrency), split across the workers, so the
+one-worker row is the single-process baseline and only the process count changes.
+
+The fake model answers without sleeping by default, so each message costs only the
+CPU time of the agent code (ADK runner, session, callbacks), which holds the GIL. The
+speedup is what extra processes buy for that work, and cannot exceed the CPU cores.
+With --latency > 0 the run is dominated by waiting instead, which one process with the
+same concurrency already overlaps.
+
+Usage:
+    uv run python -m tests.benchmarks.shard_scaling [--workers 1 2 4] [--messages 400]
+"""
+
+import argparse
+import os
+import time
+
+from app.utils.sharding import WorkerPool
+
+MESSAGES = ["東京の天気は？", "サンフランシスコの時刻は？", "こんにちは"]
+
+
+def run(workers: int, messages: int, users: int, concurrency: int) -> float:
+    """Returns messages per second."""
+    pool = WorkerPool(
+        "app.slack_worker", workers=workers, concurrency=concurrency
+    ).start()
+    try:
+        # warm-up: create every session once
+        futures = [
+            pool.submit(f"U{u}", "process_message", f"U{u}", MESSAGES[0])
+            for u in range(users)
+        ]
+        for future in futures:
+            future.result()
+
+        start = time.perf_counter()
+        futures = [
+            pool.submit(
+                f"U{i % users}", "process_message", f"U{i % users}", MESSAGES[i % 3]
+            )
+            for i in range(messages)
+        ]
+        for future in futures:
+            future.result()
+        return messages / (time.perf_counter() - start)
+    finally:
+        pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="total across all workers"
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ["USE_FAKE_MODEL"] = "true"
+    os.environ["FAKE_MODEL_LATENCY"] = str(args.latency)
+    os.environ["METRICS_PORT"] = ""
+
+    print(f"cpu cores: {os.cpu_count()}  fake model latency: {args.latency}s")
+    print(f"{'workers':>8}{'per worker':>12}{'msg/s':>10}{'speedup':>10}")
+    # 1プロセスで同じ同時実行数を処理したときを基準にする
+    base = run(1, args.messages, args.users, args.concurrency)
+    for workers in args.workers:
+        per_worker = max(1, args.concurrency // workers)
+        throughput = (
+            base
+            if workers == 1
+            else run(workers, args.messages, args.users, per_worker)
+        )
+        print(
+            f"{workers:>8}{per_worker:>12}{throughput:>10.1f}{throughput / base:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
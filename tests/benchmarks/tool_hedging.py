@@ -0,0 +1,134 @@
+"""Tail latency of tool calls with per-tool deadlines and hedged requests.
+
+A fake tool with a heavy-tailed latency (most calls are fast, a few stall and some
+hang) is called many times through three wrappers:
+
+- plain:    the tool as registered before (no deadline)
+- deadline: HedgedTool with a deadline, so hung calls return a timeout result
+- hedge:    HedgedTool with a deadline and a duplicate call after the rolling p95
+
+Each stall is independent per attempt, as with a slow upstream replica or a lost
+packet, so a duplicate call usually finishes quickly. The extra attempts column is the
+additional load the hedges put on the upstream.
+
+Usage:
+    uv run python -m tests.benchmarks.tool_hedging [--calls 400] [--deadline 1.0]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+from typing import Any, cast
+
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+from app.utils import hedging
+
+
+class HeavyTailTool(BaseTool):
+    def __init__(self, name: str, seed: int, stall: float, hang: float) -> None:
+        super().__init__(
+            name=name, description="Fake upstream lookup with a heavy tail."
+        )
+        self.rng = random.Random(seed)
+        self.stall = stall
+        self.hang = hang
+        self.attempts = 0
+
+    async def run_async(
+        self, *, args: dict[str, Any], tool_context: ToolContext
+    ) -> Any:
+        self.attempts += 1
+        roll = self.rng.random()
+        if roll < self.hang:
+            delay = 5.0
+        elif roll < self.hang + self.stall:
+            delay = self.rng.uniform(0.4, 0.8)
+        else:
+            delay = self.rng.lognormvariate(-3.2, 0.3)  # 中央値 40ms 前後
+        await asyncio.sleep(delay)
+        return {"city": args.get("city"), "temperature": 20}
+
+
+async def run(
+    mode: str,
+    calls: int,
+    concurrency: int,
+    deadline: float,
+    seed: int,
+    stall: float,
+    hang: float,
+) -> tuple[list[float], int, int]:
+    name = f"bench_{mode}"
+    inner = HeavyTailTool(name, seed, stall, hang)
+    tool = (
+        inner
+        if mode == "plain"
+        else hedging.HedgedTool(inner, deadline=deadline, hedge=mode == "hedge")
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    seconds: list[float] = []
+    timeouts = 0
+
+    async def call(i: int) -> None:
+        nonlocal timeouts
+        async with semaphore:
+            start = time.perf_counter()
+            result = await tool.run_async(
+                args={"city": f"city-{i}"}, tool_context=cast(ToolContext, None)
+            )
+            seconds.append(time.perf_counter() - start)
+            timeouts += result.get("status") == "timeout"
+
+    await asyncio.gather(*(call(i) for i in range(calls)))
+    return seconds, timeouts, inner.attempts - calls
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--deadline", type=float, default=1.0)
+    parser.add_argument(
+        "--stall", type=float, default=0.06, help="probability of a 0.4-0.8s stall"
+    )
+    parser.add_argument(
+        "--hang", type=float, default=0.01, help="probability of a 5s hang"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # タイムアウトごとの警告は表の timeouts 列で数える
+    logging.getLogger(hedging.__name__).setLevel(logging.ERROR)
+
+    print(
+        f"{args.calls} calls, stall {args.stall:.0%}, hang {args.hang:.0%}, deadline {args.deadline:g}s"
+    )
+    print(
+        f"{'mode':<10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'timeouts':>10}{'extra attempts':>16}"
+    )
+    for mode in ("plain", "deadline", "hedge"):
+        seconds, timeouts, extra = asyncio.run(
+            run(
+                mode,
+                args.calls,
+                args.concurrency,
+                args.deadline,
+                args.seed,
+                args.stall,
+                args.hang,
+            )
+        )
+        ms = sorted(s * 1000 for s in seconds)
+        q = statistics.quantiles(ms, n=100)
+        print(
+            f"{mode:<10}{q[49]:>9.0f}{q[94]:>9.0f}{q[98]:>9.0f}{ms[-1]:>9.0f}"
+            f"{timeouts:>10}{extra:>16}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Throughput and memory of the span analyzer on millions of exported spans.
+
+Writes two synthetic span exports (gzip JSONL, as CloudTraceLoggingSpanExporter
+writes each span to Cloud Logging). Invocations overlap in time and every
+invocation has the span tree of a root_agent turn: model calls, get_weather, and a
+search_agent sub-agent with its own model calls. The candidate run has slower
+search_agent model calls.
+
+The benchmark then:
+- streams the baseline through app.trace_analysis and reports spans per second
+- measures peak memory with tracemalloc on a 10% prefix and on the full candidate,
+  to show memory does not grow with the input
+- prints the regression diff between the two runs
+
+Usage:
+    uv run python -m tests.benchmarks.trace_analysis_scale [--spans 1000000] [--slowdown 1.3]
+"""
+
+import argparse
+import gzip
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from app import trace_analysis
+
+
+def _iso(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+
+
+def _record(
+    name: str, trace_id: str, span_id: str, parent: str | None, begin: float, end: float
+) -> dict:
+    # CloudTraceLoggingSpanExporter がログに書くのと同じ形（ReadableSpan.to_json + trace, span_id）
+    return {
+        "name": name,
+        "context": {"trace_id": f"0x{trace_id}", "span_id": f"0x{span_id}"},
+        "parent_id": f"0x{parent}" if parent else None,
+        "start_time": _iso(begin),
+        "end_time": _iso(end),
+        "attributes": {},
+        "trace": f"projects/bench/traces/{trace_id}",
+        "span_id": span_id,
+    }
+
+
+def invocation_spans(
+    rng: random.Random, trace: int, start: float, slowdown: float
+) -> list[dict]:
+    trace_id = f"{trace:032x}"
+    root, agent, tool, sub_agent = (f"{trace:08x}{i:08x}" for i in range(4))
+    ids = iter(range(4, 100))
+    spans = []
+
+    def model_call(parent: str, begin: float, seconds: float) -> float:
+        spans.append(
+            _record(
+                "call_llm",
+                trace_id,
+                f"{trace:08x}{next(ids):08x}",
+                parent,
+                begin,
+                begin + seconds,
+            )
+        )
+        return begin + seconds + 0.001
+
+    t = model_call(agent, start + 0.002, rng.lognormvariate(-0.7, 0.3))
+    if rng.random() < 0.5:
+        weather = rng.lognormvariate(-4, 0.5)
+        spans.append(
+            _record("execute_tool get_weather", trace_id, tool, agent, t, t + weather)
+        )
+        t += weather
+    else:
+        u = t + 0.004
+        for _ in range(2):
+            u = model_call(sub_agent, u, rng.lognormvariate(0.0, 0.4) * slowdown)
+        spans.append(
+            _record("agent_run [search_agent]", trace_id, sub_agent, tool, t + 0.003, u)
+        )
+        spans.append(
+            _record("execute_tool search_agent", trace_id, tool, agent, t, u + 0.002)
+        )
+        t = u + 0.002
+    t = model_call(agent, t + 0.001, rng.lognormvariate(-0.5, 0.3))
+    spans.append(
+        _record(
+            "agent_run [root_agent]", trace_id, agent, root, start + 0.001, t + 0.002
+        )
+    )
+    spans.append(_record("invocation", trace_id, root, None, start, t + 0.003))
+    return spans
+
+
+def write_export(path: Path, spans: int, slowdown: float, seed: int) -> int:
+    """約 spans 件のspanを終了時刻順（BatchSpanProcessor と同じ）に書き出す"""
+    rng = random.Random(seed)
+    written = trace = 0
+    clock = 1_700_000_000.0
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=1) as f:
+        while written < spans:
+            # 同時に走っている呼び出しをまとめて作り、span を終了時刻順に書く
+            batch = []
+            for _ in range(50):
+                clock += rng.expovariate(20)
+                batch += invocation_spans(rng, trace, clock, slowdown)
+                trace += 1
+            batch.sort(key=lambda s: s["end_time"])
+            for record in batch:
+                f.write(json.dumps(record) + "\n")
+            written += len(batch)
+    return written
+
+
+def peak_memory(path: Path) -> tuple[float, trace_analysis.Report]:
+    tracemalloc.start()
+    report, _ = trace_analysis.analyze([str(path)])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spans", type=int, default=1_000_000)
+    parser.add_argument(
+        "--slowdown",
+        type=float,
+        default=1.3,
+        help="candidate search_agent model latency factor",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline, candidate, prefix = (
+            Path(tmp) / n for n in ("base.jsonl.gz", "cand.jsonl.gz", "prefix.jsonl.gz")
+        )
+        start = time.perf_counter()
+        count = write_export(baseline, args.spans, 1.0, seed=1)
+        write_export(candidate, args.spans, args.slowdown, seed=2)
+        write_export(prefix, args.spans // 10, args.slowdown, seed=2)
+        print(f"wrote 2 x {count} spans in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        base_report, stats = trace_analysis.analyze([str(baseline)])
+        seconds = time.perf_counter() - start
+        print(
+            f"analyzed {base_report.spans} spans / {base_report.invocations} invocations in "
+            f"{seconds:.1f}s ({base_report.spans / seconds:,.0f} spans/s, skipped {stats['skipped']})\n"
+        )
+        print(trace_analysis.format_report(base_report))
+
+        print("\npeak traced memory while analyzing:")
+        for path in (prefix, candidate):
+            peak, cand_report = peak_memory(path)
+            print(f"  {cand_report.spans:>9} spans: {peak:.1f} MiB")
+
+        regressions = trace_analysis.compare(base_report, cand_report)
+        print()
+        print(trace_analysis.format_diff(base_report, cand_report, regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""Integration tests replay recorded model responses from a cassette.
+
+Without a cassette the tests call Gemini and record one. Re-record with
+`make record-cassettes` after changing prompts, tools or the model.
+"""
+
+import os
+from pathlib import Path
+
+CASSETTE = Path(__file__).parent / "cassettes" / "gemini.jsonl.gz"
+
+# app.config は読み込み時に環境変数を読むので、app を import する前に設定する
+os.environ.setdefault("LLM_CASSETTE", str(CASSETTE))
+os.environ.setdefault(
+    "LLM_CASSETTE_MODE",
+    "replay" if Path(os.environ["LLM_CASSETTE"]).exists() else "record",
+)
@@ -17,7 +17,7 @@ import logging
 import pytest
 from google.adk.events.event import Event
 
-from app.agent import root_agent
+from app import root_agent
 from app.agent_engine_app import AgentEngineApp
 
 
@@ -0,0 +1,14 @@
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from app.utils import usage
+
+
+@pytest.fixture(autouse=True)
+def usage_store(tmp_path: Path) -> Iterator[None]:
+    """Keeps token usage written during a test out of the working directory."""
+    usage.configure(store_path=str(tmp_path / "usage.sqlite3"))
+    yield
+    usage.configure()
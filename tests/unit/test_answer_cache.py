@@ -0,0 +1,74 @@
+from app.utils.answer_cache import (
+    AnswerCache,
+    is_context_dependent,
+    normalize,
+    shingles,
+)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_normalization_ignores_width_case_and_phrasing() -> None:
+    # 全角英字は NFKC で半角に揃える
+    assert normalize("ＴＯＫＹＯ　Weather？") == "tokyo weather"  # noqa: RUF001
+    assert shingles(normalize("東京の天気は？")) == shingles(
+        normalize("東京の天気を教えてください")
+    )
+    assert shingles(normalize("What's the weather in Tokyo?")) == {"tokyo", "weather"}
+
+
+def test_near_duplicates_hit_and_different_entities_miss() -> None:
+    cache = AnswerCache()
+    cache.store("東京の天気は？", "晴れです", "v1", seconds=5.0)
+
+    hit = cache.lookup("東京の天気を教えて", "v1")
+    assert hit is not None and hit.answer == "晴れです"
+    assert cache.lookup("大阪の天気は？", "v1") is None
+    assert cache.stats.hits == 1 and cache.stats.misses == 1
+    assert cache.stats.latency_saved == 5.0
+
+
+def test_context_dependent_questions_are_never_cached() -> None:
+    cache = AnswerCache()
+    for question in (
+        "それについてもっと詳しく",
+        "What did I ask before?",
+        "ロンドンの時刻は？",
+    ):
+        assert is_context_dependent(question)
+        assert not cache.store(question, "answer", "v1", seconds=1.0)
+        assert cache.lookup(question, "v1") is None
+    assert cache.stats.bypassed == 3
+
+
+def test_answers_expire_after_ttl() -> None:
+    clock = Clock()
+    cache = AnswerCache(ttl=60, clock=clock)
+    cache.store("Why is the sky blue?", "Rayleigh scattering", "v1", seconds=1.0)
+    clock.now = 59
+    assert cache.lookup("why is the sky blue", "v1") is not None
+    clock.now = 61
+    assert cache.lookup("why is the sky blue", "v1") is None
+
+
+def test_prompt_version_change_invalidates() -> None:
+    cache = AnswerCache()
+    cache.store("富士山の高さは？", "3776m", "root:v1+search:v1", seconds=1.0)
+    assert cache.lookup("富士山の高さは？", "root:v2+search:v1") is None
+    # 古いバージョンに戻っても、破棄した回答は返さない
+    assert cache.lookup("富士山の高さは？", "root:v1+search:v1") is None
+
+
+def test_oldest_entries_are_evicted() -> None:
+    cache = AnswerCache(max_entries=2)
+    for city in ("東京", "大阪", "札幌"):
+        cache.store(f"{city}の天気は？", city, "v1", seconds=1.0)
+    assert cache.lookup("東京の天気は？", "v1") is None
+    hit = cache.lookup("札幌の天気は？", "v1")
+    assert hit is not None and hit.answer == "札幌"
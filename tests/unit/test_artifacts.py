@@ -0,0 +1,211 @@
+import gc
+import time
+import weakref
+from pathlib import Path
+from typing import Any
+
+import pytest
+from google.adk.artifacts import InMemoryArtifactService
+from google.genai import types
+
+from app.utils import artifacts
+
+SCOPE: dict[str, Any] = {"app_name": "app", "user_id": "u1", "session_id": "s1"}
+
+
+class SlowArtifactService(InMemoryArtifactService):
+    """Stands in for GcsArtifactService: blocking I/O with a fixed latency."""
+
+    latency: float = 0.05
+    calls: int = 0
+
+    async def save_artifact(self, **kwargs: Any) -> int:
+        self.calls += 1
+        time.sleep(self.latency)
+        return await super().save_artifact(**kwargs)
+
+    async def load_artifact(self, **kwargs: Any) -> types.Part | None:
+        self.calls += 1
+        time.sleep(self.latency)
+        return await super().load_artifact(**kwargs)
+
+
+class FlakyArtifactService(SlowArtifactService):
+    """Fails the next save once fail_next is set."""
+
+    fail_next: bool = False
+
+    async def save_artifact(self, **kwargs: Any) -> int:
+        if self.fail_next:
+            self.fail_next = False
+            raise ConnectionError("upload failed")
+        return await super().save_artifact(**kwargs)
+
+
+def _part(text: str) -> types.Part:
+    return types.Part.from_bytes(data=text.encode(), mime_type="text/plain")
+
+
+def _data(part: types.Part | None) -> bytes | None:
+    return part.inline_data.data if part and part.inline_data else None
+
+
+@pytest.mark.asyncio
+async def test_write_behind_and_read_hit(tmp_path: Path) -> None:
+    """Saves return before the upload finishes, reads hit the cache, flush uploads everything."""
+    inner = SlowArtifactService()
+    service = artifacts.CachedArtifactService(
+        inner, cache_dir=str(tmp_path), write_behind=True
+    )
+    hits = artifacts.CACHE_REQUESTS_TOTAL.value(result="hit")
+
+    start = time.perf_counter()
+    versions = [
+        await service.save_artifact(
+            **SCOPE, filename="report.txt", artifact=_part(f"v{i}")
+        )
+        for i in range(3)
+    ]
+    assert time.perf_counter() - start < inner.latency * 3
+    assert versions == [0, 1, 2]
+
+    loaded = await service.load_artifact(**SCOPE, filename="report.txt")
+    assert _data(loaded) == b"v2"
+    assert artifacts.CACHE_REQUESTS_TOTAL.value(result="hit") == hits + 1
+
+    assert service.flush(timeout=5)
+    assert await inner.list_versions(**SCOPE, filename="report.txt") == [0, 1, 2]
+    uploaded = await inner.load_artifact(**SCOPE, filename="report.txt", version=1)
+    assert _data(uploaded) == b"v1"
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_saves_wait_for_upload_by_default(tmp_path: Path) -> None:
+    """Without write-behind a save returns only once the backing store has it."""
+    inner = SlowArtifactService()
+    service = artifacts.CachedArtifactService(inner, cache_dir=str(tmp_path))
+    version = await service.save_artifact(
+        **SCOPE, filename="report.txt", artifact=_part("v0")
+    )
+    assert await inner.list_versions(**SCOPE, filename="report.txt") == [version]
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_version_conflict_uses_remote_numbering(tmp_path: Path) -> None:
+    """A save that the backing store numbers differently is not cached under the local number."""
+    inner = SlowArtifactService()
+    service = artifacts.CachedArtifactService(inner, cache_dir=str(tmp_path))
+    await service.save_artifact(
+        **SCOPE, filename="report.txt", artifact=_part("ours 0")
+    )
+    # 別のプロセスが同じファイルに書き込む（こちらのバージョン一覧はまだ古いまま）
+    await inner.save_artifact(**SCOPE, filename="report.txt", artifact=_part("theirs"))
+
+    version = await service.save_artifact(
+        **SCOPE, filename="report.txt", artifact=_part("ours 1")
+    )
+    assert version == 2
+    assert await service.list_versions(**SCOPE, filename="report.txt") == [0, 1, 2]
+    theirs = await service.load_artifact(**SCOPE, filename="report.txt", version=1)
+    assert _data(theirs) == b"theirs"
+    assert (
+        _data(await service.load_artifact(**SCOPE, filename="report.txt")) == b"ours 1"
+    )
+    service.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_is_not_served_from_cache(tmp_path: Path) -> None:
+    """A version whose upload failed is forgotten, so the next save reuses its number."""
+    inner = FlakyArtifactService()
+    service = artifacts.CachedArtifactService(inner, cache_dir=str(tmp_path))
+    await service.save_artifact(**SCOPE, filename="report.txt", artifact=_part("v0"))
+    inner.fail_next = True
+    with pytest.raises(ConnectionError):
+        await service.save_artifact(
+            **SCOPE, filename="report.txt", artifact=_part("FAILED")
+        )
+
+    version = await service.save_artifact(
+        **SCOPE, filename="report.txt", artifact=_part("good")
+    )
+    assert version == 1
+    assert await inner.list_versions(**SCOPE, filename="report.txt") == [0, 1]
+    latest = await service.load_artifact(**SCOPE, filename="report.txt")
+    assert _data(latest) == b"good"
+    v1 = await service.load_artifact(**SCOPE, filename="report.txt", version=1)
+    assert _data(v1) == b"good"
+    service.close()
+
+
+def test_services_are_not_kept_alive_for_atexit(tmp_path: Path) -> None:
+    service = artifacts.CachedArtifactService(
+        SlowArtifactService(), cache_dir=str(tmp_path)
+    )
+    ref = weakref.ref(service)
+    assert service in artifacts._services
+    del service
+    gc.collect()
+    assert ref() is None
+
+
+@pytest.mark.asyncio
+async def test_read_through_miss_then_hit(tmp_path: Path) -> None:
+    """Artifacts written elsewhere are fetched once and then served locally."""
+    inner = SlowArtifactService()
+    await inner.save_artifact(
+        **SCOPE, filename="user:profile.txt", artifact=_part("hello")
+    )
+    service = artifacts.CachedArtifactService(inner, cache_dir=str(tmp_path))
+    misses = artifacts.CACHE_REQUESTS_TOTAL.value(result="miss")
+
+    for session_id in ("s1", "s2"):
+        part = await service.load_artifact(
+            app_name="app",
+            user_id="u1",
+            session_id=session_id,
+            filename="user:profile.txt",
+        )
+        assert _data(part) == b"hello"
+    assert artifacts.CACHE_REQUESTS_TOTAL.value(result="miss") == misses + 1
+    assert inner.calls == 2
+    service.close()
+
+
+def test_lru_eviction_keeps_pinned(tmp_path: Path) -> None:
+    """The disk cache stays under its size limit but never drops entries still being uploaded."""
+    cache = artifacts.DiskLruCache(str(tmp_path), max_bytes=400)
+    payload = _part("x" * 100)
+    cache.put(("a", "u", "s", "pinned", 0), payload, pin=True)
+    for i in range(5):
+        cache.put(("a", "u", "s", "f", i), payload)
+
+    assert cache.get(("a", "u", "s", "pinned", 0)) is not None
+    assert cache.get(("a", "u", "s", "f", 0)) is None
+    assert cache.get(("a", "u", "s", "f", 4)) is not None
+    assert sum(p.stat().st_size for p in tmp_path.glob("*.json")) <= 400
+
+    cache.unpin(("a", "u", "s", "pinned", 0))
+    cache.put(("a", "u", "s", "f", 5), payload)
+    assert cache.get(("a", "u", "s", "pinned", 0)) is None
+
+
+@pytest.mark.asyncio
+async def test_parallel_loads(tmp_path: Path) -> None:
+    """Several cache misses are fetched from the backing store concurrently."""
+    inner = SlowArtifactService()
+    inner.latency = 0.1
+    names = [f"file{i}.txt" for i in range(5)]
+    for name in names:
+        await inner.save_artifact(**SCOPE, filename=name, artifact=_part(name))
+    service = artifacts.CachedArtifactService(inner, cache_dir=str(tmp_path))
+
+    start = time.perf_counter()
+    parts = await service.load_artifacts(**SCOPE, filenames=names)
+    assert time.perf_counter() - start < 0.1 * len(names) / 2
+    assert {name: _data(part) for name, part in parts.items()} == {
+        name: name.encode() for name in names
+    }
+    service.close()
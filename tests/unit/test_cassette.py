@@ -0,0 +1,168 @@
+import asyncio
+import time
+from collections.abc import AsyncGenerator
+from pathlib import Path
+
+import pytest
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from app.utils import cassette
+
+
+class ScriptedLlm(BaseLlm):
+    """Streams two partial chunks and a grounded final answer, 50 ms apart."""
+
+    calls: int = 0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        for text in ("The sky ", "is blue"):
+            await asyncio.sleep(0.05)
+            yield LlmResponse(
+                content=types.Content(
+                    role="model", parts=[types.Part.from_text(text=text)]
+                ),
+                partial=True,
+            )
+        await asyncio.sleep(0.05)
+        yield LlmResponse(
+            content=types.Content(
+                role="model", parts=[types.Part.from_text(text="The sky is blue")]
+            ),
+            grounding_metadata=types.GroundingMetadata(
+                web_search_queries=["why is the sky blue"],
+                grounding_chunks=[
+                    types.GroundingChunk(
+                        web=types.GroundingChunkWeb(
+                            uri="https://example.com", title="Sky"
+                        )
+                    )
+                ],
+            ),
+        )
+
+
+def _request(*contents: types.Content, instruction: str = "Be helpful.") -> LlmRequest:
+    return LlmRequest(
+        model="gemini-2.5-flash",
+        contents=list(contents)
+        or [
+            types.Content(
+                role="user", parts=[types.Part.from_text(text="Why is the sky blue?")]
+            )
+        ],
+        config=types.GenerateContentConfig(system_instruction=instruction),
+    )
+
+
+async def _collect(
+    llm: BaseLlm, request: LlmRequest, stream: bool = True
+) -> list[LlmResponse]:
+    return [r async for r in llm.generate_content_async(request, stream=stream)]
+
+
+@pytest.fixture
+def path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> str:
+    monkeypatch.setattr(cassette, "_cassettes", {})
+    return str(tmp_path / "model.jsonl.gz")
+
+
+async def _record(path: str) -> tuple[ScriptedLlm, list[LlmResponse]]:
+    inner = ScriptedLlm(model="gemini-2.5-flash")
+    recorder = cassette.CassetteLlm(inner=inner, path=path, mode="record")
+    responses = await _collect(recorder, _request())
+    cassette.save_all()
+    # 別プロセスで再生するのと同じ状態にする
+    cassette._cassettes.clear()
+    return inner, responses
+
+
+@pytest.mark.asyncio
+async def test_replay_matches_recording(path: str) -> None:
+    """Streaming chunks and grounding metadata come back exactly, without calling the model."""
+    inner, recorded = await _record(path)
+    player = cassette.CassetteLlm(inner=inner, path=path)
+
+    start = time.perf_counter()
+    replayed = await _collect(player, _request())
+    assert time.perf_counter() - start < 0.05
+
+    assert [r.model_dump() for r in replayed] == [r.model_dump() for r in recorded]
+    metadata = replayed[-1].grounding_metadata
+    assert metadata and metadata.grounding_chunks and metadata.grounding_chunks[0].web
+    assert metadata.grounding_chunks[0].web.uri == "https://example.com"
+    assert inner.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_non_streaming_replay_skips_partials(path: str) -> None:
+    inner, _ = await _record(path)
+    player = cassette.CassetteLlm(inner=inner, path=path)
+    replayed = await _collect(player, _request(), stream=False)
+    assert len(replayed) == 1 and not replayed[0].partial
+
+
+@pytest.mark.asyncio
+async def test_realistic_timing(path: str) -> None:
+    inner, _ = await _record(path)
+    player = cassette.CassetteLlm(inner=inner, path=path, timing=1.0)
+    start = time.perf_counter()
+    await _collect(player, _request())
+    assert time.perf_counter() - start >= 0.14
+
+
+@pytest.mark.asyncio
+async def test_miss_raises_in_replay_mode(path: str) -> None:
+    inner, _ = await _record(path)
+    player = cassette.CassetteLlm(inner=inner, path=path)
+    other = _request(instruction="Be terse.")
+    with pytest.raises(cassette.CassetteMiss):
+        await _collect(player, other)
+    # 同じ形の会話でも、ユーザーの発言が違えば別のリクエスト
+    question = types.Content(
+        role="user", parts=[types.Part.from_text(text="Tokyo weather?")]
+    )
+    with pytest.raises(cassette.CassetteMiss):
+        await _collect(player, _request(question))
+
+
+@pytest.mark.asyncio
+async def test_auto_mode_records_only_misses(path: str) -> None:
+    inner, _ = await _record(path)
+    player = cassette.CassetteLlm(inner=inner, path=path, mode="auto")
+    await _collect(player, _request())
+    other = _request(instruction="Be terse.")
+    await _collect(player, other)
+    assert inner.calls == 2
+    assert len(cassette.open_cassette(path).interactions) == 2
+
+
+def test_keys_ignore_call_ids_and_fall_back_on_tool_results() -> None:
+    def turn(call_id: str, result: str) -> LlmRequest:
+        call = types.Part(
+            function_call=types.FunctionCall(
+                id=call_id, name="get_current_time", args={"query": "Tokyo"}
+            )
+        )
+        response = types.Part(
+            function_response=types.FunctionResponse(
+                id=call_id, name="get_current_time", response={"result": result}
+            )
+        )
+        return _request(
+            types.Content(
+                role="user", parts=[types.Part.from_text(text="Tokyo time?")]
+            ),
+            types.Content(role="model", parts=[call]),
+            types.Content(role="user", parts=[response]),
+        )
+
+    first = cassette.request_keys(turn("adk-1", "10:00"), "gemini-2.5-flash")
+    assert cassette.request_keys(turn("adk-2", "10:00"), "gemini-2.5-flash") == first
+    exact, loose = cassette.request_keys(turn("adk-3", "10:01"), "gemini-2.5-flash")
+    assert exact != first[0] and loose == first[1]
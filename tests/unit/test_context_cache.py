@@ -0,0 +1,164 @@
+from collections.abc import AsyncGenerator
+
+import pytest
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from app.utils import context_cache
+from app.utils.fake_llm import FakeCaches, FakeLlm, content_text
+
+INSTRUCTION = "You are a helpful assistant. " * 200
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _request(instruction: str = INSTRUCTION) -> LlmRequest:
+    return LlmRequest(
+        model="gemini-2.5-flash",
+        contents=[
+            types.Content(role="user", parts=[types.Part.from_text(text="hello")])
+        ],
+        config=types.GenerateContentConfig(system_instruction=instruction),
+    )
+
+
+Setup = tuple[Clock, FakeCaches, context_cache.ContextCachingLlm]
+
+
+@pytest.fixture
+def setup() -> Setup:
+    clock = Clock()
+    caches = FakeCaches(clock=clock)
+    context_cache.configure(ttl=3600, renew_before=300, min_tokens=100, clock=clock)
+    inner = FakeLlm(model="gemini-2.5-flash", caches=caches)
+    llm = context_cache.ContextCachingLlm(
+        inner=inner, prompt_version="root_agent_instruction:v1"
+    )
+    return clock, caches, llm
+
+
+async def _call(
+    llm: context_cache.ContextCachingLlm, request: LlmRequest
+) -> LlmResponse:
+    return [r async for r in llm.generate_content_async(request)][-1]
+
+
+def _cached_tokens(response: LlmResponse) -> int:
+    usage = response.usage_metadata
+    return (usage.cached_content_token_count or 0) if usage else 0
+
+
+def _config(request: LlmRequest) -> types.GenerateContentConfig:
+    assert request.config is not None
+    return request.config
+
+
+@pytest.mark.asyncio
+async def test_cache_is_created_then_reused(setup: Setup) -> None:
+    """The first call goes uncached while the handle is created; later calls reference it."""
+    _, caches, llm = setup
+
+    first = await _call(llm, _request())
+    assert not _cached_tokens(first)
+    await context_cache.manager.drain()
+    assert [op for op, _ in caches.calls] == ["create"]
+
+    second = await _call(llm, _request())
+    assert _cached_tokens(second) > 0
+    # 2回目以降もキャッシュの作成は1回だけ
+    await _call(llm, _request())
+    assert [op for op, _ in caches.calls] == ["create"]
+
+
+@pytest.mark.asyncio
+async def test_cached_request_drops_static_prefix(
+    setup: Setup, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The inner model receives cached_content instead of the instruction."""
+    _, caches, llm = setup
+    seen: list[LlmRequest] = []
+    original = FakeLlm.generate_content_async
+
+    async def spy(
+        self: FakeLlm, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        seen.append(llm_request)
+        async for r in original(self, llm_request, stream):
+            yield r
+
+    monkeypatch.setattr(FakeLlm, "generate_content_async", spy)
+    await _call(llm, _request())
+    await context_cache.manager.drain()
+    request = _request()
+    await _call(llm, request)
+
+    assert _config(seen[-1]).cached_content == caches.calls[0][1]
+    assert _config(seen[-1]).system_instruction is None
+    # 呼び出し元のリクエストは書き換えない
+    assert _config(request).system_instruction == INSTRUCTION
+    assert _config(request).cached_content is None
+
+
+@pytest.mark.asyncio
+async def test_handle_is_renewed_before_expiry(setup: Setup) -> None:
+    clock, caches, llm = setup
+    await _call(llm, _request())
+    await context_cache.manager.drain()
+    name = caches.calls[0][1]
+
+    clock.now += 3600 - 200
+    response = await _call(llm, _request())
+    await context_cache.manager.drain()
+    assert _cached_tokens(response) > 0
+    assert caches.calls[-1] == ("update", name)
+    assert caches.entries[name][0] == clock.now + 3600
+
+
+@pytest.mark.asyncio
+async def test_expired_cache_falls_back_to_uncached_call(setup: Setup) -> None:
+    """If the cache is gone on the server, the call is retried without it and the handle recreated."""
+    _, caches, llm = setup
+    await _call(llm, _request())
+    await context_cache.manager.drain()
+    name = caches.calls[0][1]
+    caches.entries.clear()
+
+    response = await _call(llm, _request())
+    assert content_text(response.content)
+    assert not _cached_tokens(response)
+
+    await _call(llm, _request())
+    await context_cache.manager.drain()
+    assert [op for op, _ in caches.calls] == ["create", "create"]
+    assert caches.calls[-1][1] != name
+
+
+@pytest.mark.asyncio
+async def test_new_prompt_version_replaces_old_handle(setup: Setup) -> None:
+    _, caches, llm = setup
+    await _call(llm, _request())
+    await context_cache.manager.drain()
+    old = caches.calls[0][1]
+
+    updated = context_cache.ContextCachingLlm(
+        inner=llm.inner, prompt_version="root_agent_instruction:v2"
+    )
+    await _call(updated, _request(INSTRUCTION + "Answer in Japanese."))
+    await context_cache.manager.drain()
+    assert ("delete", old) in caches.calls
+    assert old not in caches.entries and len(caches.entries) == 1
+
+
+@pytest.mark.asyncio
+async def test_small_prefix_is_not_cached(setup: Setup) -> None:
+    _, caches, llm = setup
+    await _call(llm, _request("Be brief."))
+    await context_cache.manager.drain()
+    assert caches.calls == []
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from app import agent_engine_app
+
+
+class StubEngine:
+    def __init__(self, resource_name: str, calls: list[str]) -> None:
+        self.resource_name = resource_name
+        self.calls = calls
+
+    def update(self, **kwargs: Any) -> "StubEngine":
+        self.calls.append("update")
+        return self
+
+
+class StubAgentEngines:
+    """Stands in for vertexai.agent_engines and records the calls made."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.calls: list[str] = []
+        self.engines: dict[str, StubEngine] = {}
+
+    def create(self, **kwargs: Any) -> StubEngine:
+        self.calls.append("create")
+        name = f"projects/p/locations/l/reasoningEngines/{len(self.engines)}"
+        self.engines[name] = StubEngine(name, self.calls)
+        return self.engines[name]
+
+    def get(self, resource_name: str) -> StubEngine:
+        self.calls.append("get")
+        time.sleep(self.delay)
+        return self.engines[resource_name]
+
+    def list(self, filter: str) -> list[StubEngine]:
+        self.calls.append("list")
+        time.sleep(self.delay)
+        return list(self.engines.values())
+
+
+@dataclass
+class Deploy:
+    tmp: Path
+    engines: StubAgentEngines = field(default_factory=StubAgentEngines)
+    buckets: list[str] = field(default_factory=list)
+
+    @property
+    def package(self) -> Path:
+        return self.tmp / "pkg"
+
+    def create_bucket(self, bucket_name: str, **kwargs: Any) -> None:
+        time.sleep(self.engines.delay)
+        self.buckets.append(bucket_name)
+
+    def run(self, **kwargs: Any) -> Any:
+        return agent_engine_app.deploy_agent_engine_app(
+            project="p",
+            location="l",
+            agent_name="adk-base",
+            requirements_file=str(self.tmp / "requirements.txt"),
+            extra_packages=[str(self.package)],
+            metadata_file=str(self.tmp / "deployment_metadata.json"),
+            **kwargs,
+        )
+
+
+def _agent(root_version: int) -> SimpleNamespace:
+    prompt = SimpleNamespace(version=root_version)
+    return SimpleNamespace(_langfuse_prompts={"root": prompt, "search": None})
+
+
+@pytest.fixture
+def deploy(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Deploy:
+    deploy = Deploy(tmp_path)
+    monkeypatch.setattr(agent_engine_app, "agent_engines", deploy.engines)
+    monkeypatch.setattr(agent_engine_app.vertexai, "init", lambda **kwargs: None)
+    monkeypatch.setattr(agent_engine_app, "AgentEngineApp", SimpleNamespace)
+    monkeypatch.setattr(agent_engine_app, "root_agent", _agent(1))
+    monkeypatch.setattr(
+        agent_engine_app, "create_bucket_if_not_exists", deploy.create_bucket
+    )
+    deploy.package.mkdir()
+    (deploy.package / "agent.py").write_text("x = 1\n")
+    (tmp_path / "requirements.txt").write_text("google-adk==1.5.0\n")
+    return deploy
+
+
+def test_unchanged_deploy_is_skipped(deploy: Deploy) -> None:
+    first = deploy.run()
+    metadata = json.loads((deploy.tmp / "deployment_metadata.json").read_text())
+    assert metadata["remote_agent_engine_id"] == first.resource_name
+    assert set(metadata["phase_seconds"]) >= {
+        "fingerprint",
+        "setup",
+        "engine_lookup",
+        "deploy",
+    }
+
+    second = deploy.run()
+    assert second is first
+    # 記録済みのIDで直接取得し、全件の一覧は取らない
+    assert deploy.engines.calls == ["list", "create", "get"]
+
+
+def test_changes_trigger_update(
+    deploy: Deploy, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    deploy.run()
+    (deploy.package / "agent.py").write_text("x = 2\n")
+    deploy.run()
+    deploy.run(env_vars={"COMMIT_SHA": "abc"})
+    deploy.run(force=True)
+    assert deploy.engines.calls.count("update") == 3
+
+    # Langfuse のプロンプトは import 時に取得され、エージェントと一緒に pickle される
+    monkeypatch.setattr(agent_engine_app, "root_agent", _agent(2))
+    deploy.run()
+    assert deploy.engines.calls.count("update") == 4
+
+    # .env の設定はモデルやツールのラッパーとして pickle に焼き込まれる
+    monkeypatch.setattr(agent_engine_app.config, "HISTORY_MAX_TOKENS", "1234")
+    deploy.run()
+    assert deploy.engines.calls.count("update") == 5
+
+
+def test_fingerprint_includes_agent_settings(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    settings = agent_engine_app.agent_settings()
+    assert "TOOL_DEADLINES" in settings
+    assert "LLM_CASSETTE" in settings
+    assert "SLACK_BOT_TOKEN" not in settings
+    assert "LANGFUSE_SECRET_KEY" not in settings
+    before = agent_engine_app.fingerprint([str(tmp_path)], ["x"], {}, [], settings)
+
+    monkeypatch.setattr(agent_engine_app.config, "USE_FAKE_MODEL", True)
+    after = agent_engine_app.agent_settings()
+    assert agent_engine_app.fingerprint([str(tmp_path)], ["x"], {}, [], after) != before
+
+
+def test_fingerprint_ignores_bytecode(tmp_path: Path) -> None:
+    (tmp_path / "a.py").write_text("a")
+    before = agent_engine_app.fingerprint([str(tmp_path)], ["x"], {})
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / "__pycache__" / "a.cpython-311.pyc").write_bytes(b"\0")
+    assert agent_engine_app.fingerprint([str(tmp_path)], ["x"], {}) == before
+    assert agent_engine_app.fingerprint([str(tmp_path)], ["x"], {"K": "V"}) != before
+
+
+def test_fingerprint_includes_prompt_versions(tmp_path: Path) -> None:
+    versions = agent_engine_app.prompt_versions(_agent(3))
+    assert versions == [
+        "root_agent_instruction:v3",
+        "search_agent_instruction:fallback",
+    ]
+    before = agent_engine_app.fingerprint([str(tmp_path)], ["x"], {}, versions)
+    after = agent_engine_app.prompt_versions(_agent(4))
+    assert agent_engine_app.fingerprint([str(tmp_path)], ["x"], {}, after) != before
+
+
+def test_setup_steps_run_concurrently(deploy: Deploy) -> None:
+    deploy.engines.delay = 0.3
+    active = threading.active_count()
+    start = time.perf_counter()
+    deploy.run()
+    # 2つのバケット確認とエンジン検索を順番に行うと 0.9 秒かかる
+    assert time.perf_counter() - start < 0.75
+    assert len(deploy.buckets) == 2
+    assert threading.active_count() == active
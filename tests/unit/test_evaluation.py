@@ -0,0 +1,123 @@
+import json
+from collections.abc import AsyncGenerator
+from pathlib import Path
+from typing import Any
+
+import pytest
+from google.adk.events import Event
+
+from app import config
+from app.evaluation import (
+    EvalCase,
+    Evaluator,
+    ResponseCache,
+    load_dataset,
+    trajectory_metrics,
+)
+from app.utils import history
+from app.utils.fake_llm import FakeLlm
+from app.utils.langfuse import LangfuseClient
+
+WEATHER = [{"tool_name": "get_weather", "tool_input": {"query": "東京の天気は？"}}]
+
+
+@pytest.fixture(autouse=True)
+def _restore_history(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Evaluator は履歴要約のモデルを設定し直すので、テスト後に元へ戻す
+    monkeypatch.setattr(history, "compactor", history.compactor)
+
+
+def _write_dataset(path: Path, prompts: list[str]) -> list[EvalCase]:
+    rows: list[dict[str, Any]] = [
+        {"id": f"r{i}", "prompt": p} for i, p in enumerate(prompts)
+    ]
+    rows[0]["reference_trajectory"] = WEATHER
+    path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in rows))
+    return load_dataset(str(path))
+
+
+def _evaluator(output: Path, cache: ResponseCache | None) -> Evaluator:
+    return Evaluator(
+        str(output),
+        concurrency=4,
+        cache=cache,
+        langfuse_client=LangfuseClient(public_key="", secret_key="", host=""),
+    )
+
+
+@pytest.mark.asyncio
+async def test_offline_run_is_cached_and_resumable(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Rows are cached by prompt/version/model, resumed from checkpoints, and only changes re-run."""
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    prompts = ["東京の天気は？", "こんにちは", "ロンドンの時刻は？"]
+    cases = _write_dataset(tmp_path / "data.jsonl", prompts)
+
+    path, stats = await _evaluator(tmp_path / "run1", cache).run(cases)
+    assert (stats["ran"], stats["cached"], stats["errors"]) == (3, 0, 0)
+    columns = json.loads(path.read_text()) if path.suffix == ".json" else None
+    if columns is not None:
+        assert columns["id"] == ["r0", "r1", "r2"]
+        assert json.loads(columns["predicted_trajectory"][0]) == WEATHER
+        assert columns["trajectory_exact_match"][0] == 1.0
+
+    _, stats = await _evaluator(tmp_path / "run1", cache).run(cases)
+    assert stats["resumed"] == 3
+
+    cases = _write_dataset(tmp_path / "data.jsonl", [*prompts[:2], "パリの時刻は？"])
+    _, stats = await _evaluator(tmp_path / "run2", cache).run(cases)
+    assert (stats["ran"], stats["cached"]) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_errored_rows_are_retried_on_resume(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A row that failed is run again on resume instead of being treated as done."""
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    cases = _write_dataset(tmp_path / "data.jsonl", ["東京の天気は？", "こんにちは"])
+
+    evaluator = _evaluator(tmp_path / "run", None)
+    run_async = evaluator.runner.run_async
+
+    def flaky(**kwargs: Any) -> AsyncGenerator[Event, None]:
+        if kwargs["user_id"] == "eval_r1":
+            raise RuntimeError("quota exceeded")
+        return run_async(**kwargs)
+
+    monkeypatch.setattr(evaluator.runner, "run_async", flaky)
+    _, stats = await evaluator.run(cases)
+    assert (stats["ran"], stats["errors"]) == (2, 1)
+
+    _, stats = await _evaluator(tmp_path / "run", None).run(cases)
+    assert (stats["resumed"], stats["ran"], stats["errors"]) == (1, 1, 0)
+
+
+def test_offline_summaries_use_the_fake_model(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """--offline is applied after app.agent has built the history summary model."""
+    monkeypatch.setattr(config, "HISTORY_COMPACTION_ENABLED", True)
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    _evaluator(tmp_path / "run", None)
+
+    model = history.compactor.summary_model
+    while model is not None and hasattr(model, "inner"):
+        model = model.inner
+    assert isinstance(model, FakeLlm)
+
+
+def test_trajectory_metrics() -> None:
+    """Trajectory metrics follow the Vertex AI definitions."""
+    a = {"tool_name": "a", "tool_input": {}}
+    b = {"tool_name": "b", "tool_input": {}}
+    metrics = trajectory_metrics([a, b], [b])
+    assert metrics == {
+        "trajectory_exact_match": 0.0,
+        "trajectory_in_order_match": 1.0,
+        "trajectory_precision": 0.5,
+        "trajectory_recall": 1.0,
+    }
+    assert trajectory_metrics([a], None)["trajectory_recall"] is None
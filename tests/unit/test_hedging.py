@@ -0,0 +1,121 @@
+import asyncio
+import time
+from typing import Any, cast
+
+import pytest
+from google.adk.tools import FunctionTool
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.tool_context import ToolContext
+
+from app.utils import usage
+from app.utils.hedging import HedgedTool, parse_deadlines, tool_latency, wrap
+
+# ラップしたツールにそのまま渡すだけなので、テストでは None で足りる
+NO_CONTEXT = cast(ToolContext, None)
+
+
+class SlowTool(BaseTool):
+    """Returns after the next delay in `delays`, or raises if the delay is an exception."""
+
+    def __init__(self, name: str, delays: list[float | Exception]) -> None:
+        super().__init__(name=name, description="fake tool")
+        self.delays = delays
+        self.calls = 0
+
+    async def run_async(
+        self, *, args: dict[str, Any], tool_context: ToolContext
+    ) -> Any:
+        call = self.calls
+        self.calls += 1
+        delay = self.delays[min(call, len(self.delays) - 1)]
+        if isinstance(delay, Exception):
+            raise delay
+        await asyncio.sleep(delay)
+        return {"call": call, **args}
+
+
+def warm_up(name: str, seconds: float) -> None:
+    for _ in range(20):
+        tool_latency.observe(name, seconds)
+
+
+@pytest.mark.asyncio
+async def test_deadline_returns_structured_timeout() -> None:
+    tool = HedgedTool(SlowTool("timeout_tool", [1.0]), deadline=0.05)
+    start = time.perf_counter()
+    with usage.scope("u", "s") as request_usage:
+        result = await tool.run_async(args={}, tool_context=NO_CONTEXT)
+    assert time.perf_counter() - start < 0.5
+    assert request_usage.degraded == {"tool_timeout"}
+    assert result["status"] == "timeout"
+    assert result["tool"] == "timeout_tool"
+    assert "0.05 seconds" in result["error"]
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_when_primary_is_slow(monkeypatch: pytest.MonkeyPatch) -> None:
+    warm_up("hedge_tool", 0.01)
+    observed: list[float] = []
+    monkeypatch.setattr(tool_latency, "observe", lambda name, s: observed.append(s))
+    inner = SlowTool("hedge_tool", [1.0, 0.01])
+    result = await HedgedTool(inner, deadline=2.0, hedge=True).run_async(
+        args={"city": "tokyo"}, tool_context=NO_CONTEXT
+    )
+    assert result == {"call": 1, "city": "tokyo"}
+    assert inner.calls == 2
+    # 勝ったヘッジ自体の時間ではなく、最初の実行開始からの時間を記録する
+    assert len(observed) == 1 and observed[0] >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_fast_calls_and_non_idempotent_tools_are_not_hedged() -> None:
+    warm_up("single_tool", 0.01)
+    fast = SlowTool("single_tool", [0.0])
+    assert (
+        await HedgedTool(fast, deadline=1.0, hedge=True).run_async(
+            args={}, tool_context=NO_CONTEXT
+        )
+    )["call"] == 0
+    assert fast.calls == 1
+
+    slow = SlowTool("single_tool", [0.2])
+    assert (
+        await HedgedTool(slow, deadline=1.0).run_async(args={}, tool_context=NO_CONTEXT)
+    )["call"] == 0
+    assert slow.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_errors_are_propagated() -> None:
+    tool = HedgedTool(SlowTool("error_tool", [ValueError("boom")]), deadline=1.0)
+    with pytest.raises(ValueError):
+        await tool.run_async(args={}, tool_context=NO_CONTEXT)
+
+
+@pytest.mark.asyncio
+async def test_blocking_function_tools_are_cut_off_at_deadline() -> None:
+    def blocking_lookup(city: str) -> dict[str, str]:
+        """Looks up a city slowly."""
+        time.sleep(0.5)
+        return {"city": city}
+
+    tool = HedgedTool(FunctionTool(blocking_lookup), deadline=0.05)
+    start = time.perf_counter()
+    result = await tool.run_async(args={"city": "tokyo"}, tool_context=NO_CONTEXT)
+    assert time.perf_counter() - start < 0.3
+    assert result["status"] == "timeout"
+    declaration = tool._get_declaration()
+    assert declaration is not None and declaration.name == "blocking_lookup"
+
+
+def test_wrap_uses_configured_deadlines() -> None:
+    deadlines = parse_deadlines("get_weather=10, search_agent=0,broken")
+    assert deadlines == {"get_weather": 10.0, "search_agent": 0.0}
+    weather = wrap(SlowTool("get_weather", [0]), deadlines, 30.0, {"get_weather"})
+    assert (
+        isinstance(weather, HedgedTool) and weather.deadline == 10.0 and weather.hedge
+    )
+    search = SlowTool("search_agent", [0])
+    assert wrap(search, deadlines, 30.0, set()) is search
+    other = wrap(SlowTool("other", [0]), deadlines, 30.0, set())
+    assert isinstance(other, HedgedTool) and other.deadline == 30.0 and not other.hedge
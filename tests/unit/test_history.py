@@ -0,0 +1,112 @@
+from itertools import pairwise
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.genai import types
+
+from app.utils import history
+from app.utils.fake_llm import FakeLlm
+
+
+def _context() -> CallbackContext:
+    session = SimpleNamespace(app_name="test", user_id="u1", id="s1")
+    context = SimpleNamespace(_invocation_context=SimpleNamespace(session=session))
+    return cast(CallbackContext, context)
+
+
+def _conversation(turns: int) -> list[types.Content]:
+    """Builds turns of user message, search call, large search result and answer."""
+    contents = []
+    for i in range(turns):
+        contents += [
+            types.Content(
+                role="user", parts=[types.Part.from_text(text=f"question {i}")]
+            ),
+            types.Content(
+                role="model",
+                parts=[
+                    types.Part.from_function_call(
+                        name="search_agent", args={"request": "q"}
+                    )
+                ],
+            ),
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part.from_function_response(
+                        name="search_agent",
+                        response={"result": f"result {i} " + "x" * 4000},
+                    )
+                ],
+            ),
+            types.Content(
+                role="model", parts=[types.Part.from_text(text=f"answer {i}")]
+            ),
+        ]
+    # 実行中のターン: 検索結果を受け取った直後
+    return contents[:-1]
+
+
+def test_compaction_trims_and_windows_history() -> None:
+    """Over budget, old turns are dropped, old tool results trimmed and the current turn kept."""
+    compactor = history.HistoryCompactor(
+        max_tokens=3000, keep_turns=2, tool_result_chars=200
+    )
+    request = LlmRequest(contents=_conversation(30))
+
+    compactor.compact(_context(), request)
+
+    assert history._tokens(request.contents) <= 3000
+    texts = [history.content_text(c) for c in request.contents]
+    assert texts[0].startswith("question") and "question 0" not in texts
+    assert texts.index("question 28") == len(texts) - 7
+    assert history.TRIMMED_MARKER in texts[2]
+    assert history.TRIMMED_MARKER not in texts[-1] and "result 29" in texts[-1]
+
+
+def test_small_history_is_untouched() -> None:
+    """Requests within the budget are sent as is."""
+    compactor = history.HistoryCompactor()
+    contents = _conversation(2)
+    request = LlmRequest(contents=list(contents))
+    compactor.compact(_context(), request)
+    assert request.contents == contents
+
+
+@pytest.mark.asyncio
+async def test_summary_is_built_in_background_and_reused() -> None:
+    """The rolling summary is generated off the request path and used by later requests."""
+    summary_model = FakeLlm(
+        model="gemini-2.5-flash-lite", latency=0.05, reply="user asks questions"
+    )
+    compactor = history.HistoryCompactor(
+        summary_model=summary_model,
+        max_tokens=3000,
+        keep_turns=2,
+        tool_result_chars=200,
+    )
+    hits = history.COMPACTIONS_TOTAL.value(summary="hit")
+
+    first = LlmRequest(contents=_conversation(30))
+    compactor.compact(_context(), first)
+    assert len(compactor._pending) == 1, "the summary is scheduled, not awaited"
+    assert not history.content_text(first.contents[0]).startswith(
+        history.SUMMARY_HEADER
+    )
+
+    await compactor.drain()
+    second = LlmRequest(contents=_conversation(31))
+    compactor.compact(_context(), second)
+    # 要約は続くユーザーの発話と同じターンに入れ、user が2回続かないようにする
+    summary, question = second.contents[0].parts or []
+    assert summary.text == history.SUMMARY_HEADER + "user asks questions"
+    assert (question.text or "").startswith("question")
+    roles = [content.role for content in second.contents]
+    assert all(a != b for a, b in pairwise(roles))
+    assert history.COMPACTIONS_TOTAL.value(summary="hit") == hits + 1
+    assert summary_model._calls == 1, (
+        "a small unsummarized tail does not trigger a new summary"
+    )
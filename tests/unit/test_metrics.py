@@ -0,0 +1,115 @@
+import asyncio
+import urllib.request
+
+import pytest
+from google.adk.models.llm_request import LlmRequest
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from app import config
+from app.agent import create_agents
+from app.utils import metrics, routing
+from app.utils.fake_llm import FakeLlm
+from app.utils.instrumentation import InstrumentedLlm
+from app.utils.langfuse import LangfuseClient
+
+
+def test_histogram_render() -> None:
+    """Histogram buckets are cumulative and rendered in Prometheus text format."""
+    registry = metrics.MetricsRegistry()
+    histogram = registry.histogram("latency", "help", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5.0, stage="a")
+
+    text = registry.render()
+    assert 'latency_bucket{stage="a",le="0.1"} 1' in text
+    assert 'latency_bucket{stage="a",le="1"} 2' in text
+    assert 'latency_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'latency_count{stage="a"} 3' in text
+
+
+def test_stage_records_status_and_in_flight() -> None:
+    """A stage records its latency, outcome and returns the in-flight gauge to zero."""
+    before = metrics.STAGE_LATENCY.count(stage="unit", target="ok")
+    with metrics.stage("unit", target="ok"):
+        assert metrics.STAGE_IN_FLIGHT.value(stage="unit", target="ok") == 1
+    assert metrics.STAGE_LATENCY.count(stage="unit", target="ok") == before + 1
+    assert metrics.STAGE_IN_FLIGHT.value(stage="unit", target="ok") == 0
+
+    with pytest.raises(RuntimeError):
+        with metrics.stage("unit", target="ng"):
+            raise RuntimeError("boom")
+    assert metrics.STAGE_TOTAL.value(stage="unit", target="ng", status="error") >= 1
+
+
+def test_metrics_server() -> None:
+    """The metrics endpoint serves the registry."""
+    registry = metrics.MetricsRegistry()
+    registry.counter("requests_total", "help").inc()
+    server = metrics.start_metrics_server(0, registry=registry)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode()
+        assert "requests_total 1" in body
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_model_and_tool_stages(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Model turns and tool calls are recorded when running the agent."""
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    agent = create_agents(LangfuseClient(public_key="", secret_key="", host=""))
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="test", user_id="u")
+    runner = Runner(agent=agent, app_name="test", session_service=session_service)
+
+    model_turns = metrics.STAGE_LATENCY.count(
+        stage="model_turn", target="gemini-2.5-flash"
+    )
+    tool_calls = metrics.STAGE_LATENCY.count(stage="tool_call", target="get_weather")
+    async for _ in runner.run_async(
+        user_id="u",
+        session_id=session.id,
+        new_message=types.Content(
+            role="user", parts=[types.Part.from_text(text="東京の天気は？")]
+        ),
+    ):
+        pass
+
+    assert (
+        metrics.STAGE_LATENCY.count(stage="model_turn", target="gemini-2.5-flash")
+        == model_turns + 2
+    )
+    assert (
+        metrics.STAGE_LATENCY.count(stage="tool_call", target="get_weather")
+        == tool_calls + 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_model_turn_excludes_consumer_time(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Time the runner spends between chunks (running tools) is not model latency."""
+    observed: list[float] = []
+    monkeypatch.setattr(
+        routing.latency_stats,
+        "observe",
+        lambda model, seconds: observed.append(seconds),
+    )
+    llm = InstrumentedLlm(inner=FakeLlm(model="consumer-test", latency=0.05))
+    request = LlmRequest(
+        model="consumer-test",
+        contents=[types.Content(role="user", parts=[types.Part.from_text(text="hi")])],
+    )
+    before = metrics.STAGE_LATENCY.total(stage="model_turn", target="consumer-test")
+    async for _ in llm.generate_content_async(request):
+        await asyncio.sleep(0.3)
+
+    seconds = metrics.STAGE_LATENCY.total(stage="model_turn", target="consumer-test")
+    assert 0.05 <= seconds - before < 0.2
+    assert len(observed) == 1 and 0.05 <= observed[0] < 0.2
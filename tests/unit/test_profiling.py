@@ -0,0 +1,94 @@
+import asyncio
+import pstats
+import threading
+from pathlib import Path
+
+import pytest
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from app import config
+from app.agent import create_agents
+from app.utils import profiling
+from app.utils.langfuse import LangfuseClient
+
+
+async def _run_requests(count: int) -> None:
+    agent = create_agents(LangfuseClient(public_key="", secret_key="", host=""))
+    session_service = InMemorySessionService()
+    runner = Runner(agent=agent, app_name="test", session_service=session_service)
+
+    async def one(i: int) -> None:
+        session = await session_service.create_session(app_name="test", user_id=f"u{i}")
+        async for _ in runner.run_async(
+            user_id=session.user_id,
+            session_id=session.id,
+            new_message=types.Content(
+                role="user", parts=[types.Part.from_text(text="東京の天気は？")]
+            ),
+        ):
+            pass
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+
+
+def test_capture_against_fake_model(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """A capture records sampled stacks, cProfile stats and asyncio tasks of running requests."""
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    monkeypatch.setattr(config, "FAKE_MODEL_LATENCY", "0.05")
+    profiling.configure(output_dir=str(tmp_path))
+    loop = asyncio.new_event_loop()
+    profiling.track_loop(loop)
+
+    async def scenario() -> list[Path]:
+        requests = asyncio.ensure_future(_run_requests(4))
+        await asyncio.sleep(0.01)
+        capture = profiling.start_capture(0.3)
+        assert capture is not None
+        assert profiling.start_capture(0.3) is None, "only one capture runs at a time"
+        await requests
+        await _run_requests(2)
+        return await asyncio.to_thread(capture.wait, 10)
+
+    try:
+        paths = loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+
+    names = {path.name for path in paths}
+    assert {"tasks.txt", "samples.folded", "cprofile.pstats", "cprofile.txt"} <= names
+    output_dir = paths[0].parent
+
+    assert "run_async" in (output_dir / "tasks.txt").read_text()
+    assert (output_dir / "samples.folded").read_text().strip()
+    functions = (
+        pstats.Stats(str(output_dir / "cprofile.pstats"))
+        .get_stats_profile()
+        .func_profiles
+    )
+    assert any("fake_llm.py" in function.file_name for function in functions.values())
+
+
+def test_done_callback_runs_without_waiting(tmp_path: Path) -> None:
+    """Callers are notified when the capture finishes instead of blocking on wait()."""
+    profiling.configure(output_dir=str(tmp_path))
+    capture = profiling.start_capture(0.2, modes=("tasks",))
+    assert capture is not None
+    done = threading.Event()
+    received: list[list[Path]] = []
+
+    def on_done(paths: list[Path]) -> None:
+        received.append(paths)
+        done.set()
+
+    capture.add_done_callback(on_done)
+    assert not done.is_set()
+    assert done.wait(5)
+    assert [path.name for path in received[0]] == ["tasks.txt"]
+
+    # 終了後に登録した場合はすぐに呼ばれる
+    capture.add_done_callback(received.append)
+    assert len(received) == 2
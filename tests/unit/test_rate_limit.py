@@ -0,0 +1,162 @@
+import asyncio
+from collections.abc import Iterator
+
+import pytest
+from google.adk.agents import Agent
+from google.adk.models.llm_request import LlmRequest
+from google.adk.runners import InMemoryRunner
+from google.adk.tools.agent_tool import AgentTool
+from google.genai import types
+
+from app.utils import rate_limit
+from app.utils.fake_llm import FakeLlm
+
+
+@pytest.fixture(autouse=True)
+def reset_guard() -> Iterator[None]:
+    yield
+    rate_limit.configure()
+
+
+def _request() -> LlmRequest:
+    return LlmRequest(
+        model="gemini-2.5-flash",
+        contents=[
+            types.Content(role="user", parts=[types.Part.from_text(text="hello")])
+        ],
+    )
+
+
+async def _call(llm: rate_limit.RateLimitedLlm) -> str:
+    responses = [r async for r in llm.generate_content_async(_request())]
+    content = responses[-1].content
+    assert content and content.parts
+    return content.parts[0].text or ""
+
+
+def test_aimd_limit() -> None:
+    """The limit grows additively on success and halves on a 429."""
+    limiter = rate_limit.AdaptiveLimiter(initial=4, decrease_interval=0)
+
+    async def cycle(outcome: str) -> None:
+        await limiter.acquire()
+        limiter.release(outcome)
+
+    asyncio.run(cycle("ok"))
+    assert limiter.limit == pytest.approx(4.25)
+    asyncio.run(cycle("throttled"))
+    assert limiter.limit == pytest.approx(2.125)
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped() -> None:
+    """No more calls than the current limit run at once; the rest wait for a slot."""
+    rate_limit.configure(limiter=rate_limit.AdaptiveLimiter(initial=2, max_limit=2))
+    fake = FakeLlm(model="gemini-2.5-flash", latency=0.02)
+    llm = rate_limit.RateLimitedLlm(inner=fake)
+    peak = 0
+
+    async def watch() -> None:
+        nonlocal peak
+        while True:
+            peak = max(peak, rate_limit.guard.limiter.in_flight)
+            await asyncio.sleep(0.001)
+
+    watcher = asyncio.create_task(watch())
+    await asyncio.gather(*(_call(llm) for _ in range(8)))
+    watcher.cancel()
+    assert peak == 2
+    assert rate_limit.guard.limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_rejects() -> None:
+    """Calls that cannot get a slot in time are rejected instead of piling up."""
+    rate_limit.configure(
+        limiter=rate_limit.AdaptiveLimiter(initial=1, max_limit=1, queue_timeout=0.01)
+    )
+    llm = rate_limit.RateLimitedLlm(
+        inner=FakeLlm(model="gemini-2.5-flash", latency=0.1)
+    )
+    results = await asyncio.gather(_call(llm), _call(llm), return_exceptions=True)
+    assert isinstance(results[1], rate_limit.LimiterRejected)
+
+
+@pytest.mark.asyncio
+async def test_retries_429_with_retry_after() -> None:
+    """429s are retried, waiting at least as long as the server's retry hint."""
+    rate_limit.configure(retry=rate_limit.RetryPolicy(max_attempts=3, base_delay=0.001))
+    fake = FakeLlm(model="gemini-2.5-flash", fail_first=2, retry_after=0.05)
+    llm = rate_limit.RateLimitedLlm(inner=fake)
+    retries = rate_limit.RETRIES_TOTAL.value()
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    assert "hello" in await _call(llm)
+    assert loop.time() - start >= 0.1
+    assert rate_limit.RETRIES_TOTAL.value() == retries + 2
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_on_prolonged_429() -> None:
+    """Persistent 429s open the circuit so further calls fail fast, then a trial closes it."""
+    rate_limit.configure(
+        retry=rate_limit.RetryPolicy(max_attempts=2, base_delay=0.001),
+        breaker=rate_limit.CircuitBreaker(failure_threshold=2, open_seconds=0.05),
+    )
+    fake = FakeLlm(model="gemini-2.5-flash", fail_first=2)
+    llm = rate_limit.RateLimitedLlm(inner=fake)
+
+    with pytest.raises(rate_limit.RetriesExhausted):
+        await _call(llm)
+    assert rate_limit.guard.breaker.state == "open"
+    with pytest.raises(rate_limit.CircuitOpenError):
+        await _call(llm)
+    assert fake._calls == 2, "an open circuit must not reach the model"
+
+    await asyncio.sleep(0.06)
+    assert "hello" in await _call(llm)
+    assert rate_limit.guard.breaker.state == "closed"
+
+
+def test_retry_after_parsing() -> None:
+    """Retry hints are read from RetryInfo details."""
+    error = FakeLlm(model="m", retry_after=7)._rate_limit_error()
+    assert rate_limit.is_rate_limited(error)
+    assert rate_limit.retry_after(error) == 7.0
+    assert rate_limit.RetryPolicy().delay(0, 7.0) >= 7.0
+
+
+@pytest.mark.asyncio
+async def test_nested_agent_tool_with_one_slot() -> None:
+    """A sub-agent called as a tool can get the only slot while its parent's turn is pending."""
+    rate_limit.configure(
+        limiter=rate_limit.AdaptiveLimiter(initial=1, max_limit=1, queue_timeout=0.5)
+    )
+    search_agent = Agent(
+        name="search_agent",
+        model=rate_limit.RateLimitedLlm(inner=FakeLlm(model="gemini-2.5-flash")),
+        instruction="Search the web.",
+    )
+    root_agent = Agent(
+        name="root_agent",
+        model=rate_limit.RateLimitedLlm(inner=FakeLlm(model="gemini-2.5-flash")),
+        instruction="Answer questions.",
+        tools=[AgentTool(agent=search_agent)],
+    )
+    runner = InMemoryRunner(agent=root_agent, app_name="app")
+    session = await runner.session_service.create_session(app_name="app", user_id="u")
+    message = types.Content(role="user", parts=[types.Part.from_text(text="調べて")])
+
+    events = [
+        event
+        async for event in runner.run_async(
+            user_id="u", session_id=session.id, new_message=message
+        )
+    ]
+    assert any(
+        call.name == "search_agent" for e in events for call in e.get_function_calls()
+    )
+    assert events[-1].is_final_response()
+    assert rate_limit.guard.limiter.in_flight == 0
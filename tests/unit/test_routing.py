@@ -0,0 +1,43 @@
+import pytest
+from google.adk.models import BaseLlm
+
+from app import config
+from app.agent import AgentCache
+from app.utils.langfuse import LangfuseClient
+from app.utils.routing import TIERS, LatencyStats, ModelRouter
+
+
+def test_route_by_heuristics() -> None:
+    """Chit-chat and weather/time go to the lite tier, research to the standard tier."""
+    router = ModelRouter(stats=LatencyStats())
+    assert router.route("東京の天気は？").tier == "lite"
+    assert router.route("hi there").tier == "lite"
+    assert (
+        router.route("量子コンピュータの最新ニュースを詳しく調べて").tier == "standard"
+    )
+    assert router.route("a" * 200).reason == "long"
+
+
+def test_route_avoids_degraded_lite_model() -> None:
+    """When the lite model is much slower than the standard one, requests fall back to standard."""
+    stats = LatencyStats()
+    for _ in range(10):
+        stats.observe(TIERS["lite"], 5.0)
+        stats.observe(TIERS["standard"], 1.0)
+    decision = ModelRouter(stats=stats).route("こんにちは")
+    assert (decision.tier, decision.reason) == ("standard", "lite_degraded")
+
+
+def test_agent_cache_reuses_agents_per_model(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Agents are built once per model and prompt version."""
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    cache = AgentCache(LangfuseClient(public_key="", secret_key="", host=""))
+    lite = cache.get(TIERS["lite"])
+    assert cache.get(TIERS["lite"]) is lite
+    standard = cache.get(TIERS["standard"])
+    assert standard is not lite
+    assert (
+        isinstance(standard.model, BaseLlm)
+        and standard.model.model == TIERS["standard"]
+    )
+    assert isinstance(lite.model, BaseLlm) and lite.model.model == TIERS["lite"]
@@ -0,0 +1,164 @@
+import pytest
+from google.adk.events import Event, EventActions
+from google.adk.flows.llm_flows.contents import _get_contents
+from google.adk.sessions import BaseSessionService, InMemorySessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.genai import types
+
+from app.utils.session_store import CompactSessionService
+
+SUMMARY = "検索結果の要約です。" * 400
+
+
+def turn(question: str, summary: str, timestamp: float) -> list[Event]:
+    return [
+        Event(
+            invocation_id=question,
+            author="user",
+            timestamp=timestamp,
+            content=types.Content(
+                role="user", parts=[types.Part.from_text(text=question)]
+            ),
+        ),
+        Event(
+            invocation_id=question,
+            author="root_agent",
+            timestamp=timestamp + 0.1,
+            content=types.Content(
+                role="model",
+                parts=[
+                    types.Part(
+                        function_call=types.FunctionCall(
+                            id=f"call-{timestamp}",
+                            name="search_agent",
+                            args={"request": question},
+                        ),
+                        thought_signature=b"\x00signature",
+                    )
+                ],
+            ),
+            actions=EventActions(
+                state_delta={"last_question": question, "temp:scratch": 1}
+            ),
+        ),
+        Event(
+            invocation_id=question,
+            author="root_agent",
+            timestamp=timestamp + 0.2,
+            content=types.Content(
+                role="user",
+                parts=[
+                    types.Part(
+                        function_response=types.FunctionResponse(
+                            id=f"call-{timestamp}",
+                            name="search_agent",
+                            response={"result": summary},
+                        )
+                    )
+                ],
+            ),
+        ),
+    ]
+
+
+def history(summaries: list[str]) -> list[Event]:
+    return [
+        event
+        for i, summary in enumerate(summaries)
+        for event in turn(f"question {i}", summary, 1000.0 + i)
+    ]
+
+
+async def fill(
+    service: BaseSessionService, session_id: str, events: list[Event]
+) -> None:
+    session = await service.create_session(
+        app_name="app", user_id="u", session_id=session_id
+    )
+    for event in events:
+        await service.append_event(session, event)
+
+
+async def load(
+    service: BaseSessionService, session_id: str, config: GetSessionConfig | None = None
+) -> Session:
+    session = await service.get_session(
+        app_name="app", user_id="u", session_id=session_id, config=config
+    )
+    assert session is not None
+    return session
+
+
+def tool_result(event: Event) -> types.FunctionResponse:
+    assert event.content and event.content.parts
+    response = event.content.parts[0].function_response
+    assert response is not None
+    return response
+
+
+@pytest.mark.asyncio
+async def test_sessions_rebuild_the_same_events_and_contents() -> None:
+    plain, compact = (
+        InMemorySessionService(),
+        CompactSessionService(blob_threshold=1024),
+    )
+    events = history([SUMMARY, "short"])
+    for service in (plain, compact):
+        await fill(service, "s", events)
+    expected = await load(plain, "s")
+    actual = await load(compact, "s")
+
+    assert actual.model_dump() == expected.model_dump()
+    assert _get_contents(None, actual.events, "root_agent") == _get_contents(
+        None, expected.events, "root_agent"
+    )
+    assert actual.state == {"last_question": "question 1"}
+
+    recent = GetSessionConfig(num_recent_events=2)
+    after = GetSessionConfig(after_timestamp=1001.0)
+    for config in (recent, after):
+        rebuilt = await load(compact, "s", config)
+        original = await load(plain, "s", config)
+        assert [e.id for e in rebuilt.events] == [e.id for e in original.events]
+
+
+@pytest.mark.asyncio
+async def test_large_tool_outputs_are_shared_and_released() -> None:
+    service = CompactSessionService(blob_threshold=1024)
+    await fill(service, "a", history([SUMMARY, SUMMARY]))
+    await fill(service, "b", history([SUMMARY, "short"]))
+    assert len(service.blobs) == 1
+    assert service.event_bytes < len(SUMMARY.encode())
+
+    # 返した Event を変更しても保持している内容には影響しない
+    session = await load(service, "a")
+    result = tool_result(session.events[2]).response
+    assert result is not None
+    result["result"] = "changed"
+    session = await load(service, "a")
+    assert tool_result(session.events[2]).response == {"result": SUMMARY}
+
+    await service.delete_session(app_name="app", user_id="u", session_id="a")
+    assert len(service.blobs) == 1
+    await service.delete_session(app_name="app", user_id="u", session_id="b")
+    assert (
+        len(service.blobs) == 0
+        and service.blobs.bytes == 0
+        and service.event_bytes == 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_partial_events_are_not_stored() -> None:
+    service = CompactSessionService()
+    session = await service.create_session(app_name="app", user_id="u")
+    partial = Event(
+        author="root_agent",
+        partial=True,
+        content=types.Content(
+            role="model", parts=[types.Part.from_text(text="stream")]
+        ),
+    )
+    await service.append_event(session, partial)
+    stored = await load(service, session.id)
+    assert stored.events == []
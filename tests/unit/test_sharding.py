@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from app.utils.sharding import HashRing, ThreadStore, WorkerPool
+
+
+def test_hash_ring_balance_and_minimal_movement() -> None:
+    """Keys spread evenly, and adding a node only moves keys onto the new node."""
+    keys = [f"U{i:05d}" for i in range(4000)]
+    ring = HashRing([f"worker-{i}" for i in range(4)])
+    before = {key: ring.lookup(key) for key in keys}
+    assert min(Counter(before.values()).values()) > 4000 / 4 * 0.6
+
+    ring.add("worker-4")
+    after = {key: ring.lookup(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == "worker-4" for key in moved)
+    assert len(moved) < 4000 / 5 * 1.5
+
+    ring.remove("worker-4")
+    assert {key: ring.lookup(key) for key in keys} == before
+
+
+def test_thread_store_is_shared(tmp_path: Path) -> None:
+    """Thread membership written by one process-local store is visible to another."""
+    path = str(tmp_path / "threads.sqlite3")
+    ThreadStore(path).add("1700000000.000100")
+    store = ThreadStore(path)
+    assert "1700000000.000100" in store
+    assert "1700000000.000200" not in store
+
+
+def test_worker_pool_routes_and_rebalances(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Users stick to one worker, and their sessions survive a resize."""
+    monkeypatch.setenv("USE_FAKE_MODEL", "true")
+    monkeypatch.setenv("METRICS_PORT", "")
+    monkeypatch.setenv("USAGE_DB_PATH", str(tmp_path / "usage.sqlite3"))
+    pool = WorkerPool("app.slack_worker", workers=1, concurrency=4).start()
+    try:
+        users = [f"U{i}" for i in range(8)]
+        for _ in range(2):
+            futures = [
+                pool.submit(u, "process_message", u, f"hello {u}") for u in users
+            ]
+            assert [f.result(60) for f in futures] == [
+                f"[gemini-2.5-flash-lite] hello {u}" for u in users
+            ]
+        assert sum(pool.owners().values()) == len(users)
+
+        owners = dict(pool._keys)
+        moved = pool.resize(2)
+        assert moved == sum(owners[u] != pool._keys[u] for u in users) > 0
+        for u in users:
+            session = pool.call(u, "export_session", u, timeout=60)
+            # 2 messages x (user + model) events, kept across the move
+            assert len(session["events"]) == 4
+    finally:
+        pool.close()
+
+
+class StubProcess:
+    def __init__(self, alive: bool = True) -> None:
+        self.alive = alive
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+
+def test_pool_bookkeeping_without_workers() -> None:
+    """Routed keys are bounded, and unexpected messages do not stop the collector."""
+    pool = WorkerPool("app.slack_worker", workers=0, max_keys=3).start()
+    inbox: queue.Queue = queue.Queue()
+    pool.ring.add("worker-0")
+    pool._processes["worker-0"] = StubProcess()  # type: ignore[assignment]
+    pool._inboxes["worker-0"] = inbox
+    try:
+        futures = [pool.submit(f"U{i}", "process_message") for i in range(5)]
+        assert list(pool._keys) == ["U2", "U3", "U4"]
+
+        pool._outbox.put(("ready", "worker-9"))
+        pool._outbox.put(("unexpected",))
+        for _ in futures:
+            request_id, key, _, _ = inbox.get(timeout=5)
+            pool._outbox.put(("result", request_id, True, key))
+        assert [f.result(5) for f in futures] == [f"U{i}" for i in range(5)]
+    finally:
+        pool._processes.clear()
+        pool.close()
+
+
+def test_restart_does_not_block_other_workers(monkeypatch: pytest.MonkeyPatch) -> None:
+    """While a crashed worker starts again, only requests for that worker wait."""
+    pool = WorkerPool("app.slack_worker", workers=0, ready_timeout=10).start()
+    inboxes: dict[str, queue.Queue] = {}
+
+    def spawn(worker_id: str) -> None:
+        # 起動通知は ready をテストから set するまで届かない
+        inboxes[worker_id] = pool._inboxes[worker_id] = queue.Queue()
+        pool._processes[worker_id] = StubProcess()  # type: ignore[assignment]
+        pool._ready[worker_id] = threading.Event()
+
+    monkeypatch.setattr(pool, "_spawn", spawn)
+    for worker_id in ("worker-0", "worker-1"):
+        spawn(worker_id)
+        pool.ring.add(worker_id)
+    pool._processes["worker-0"] = StubProcess(alive=False)  # type: ignore[assignment]
+    keys = {pool.ring.lookup(f"U{i}"): f"U{i}" for i in range(50)}
+    try:
+        crashed = [
+            threading.Thread(target=pool.submit, args=(keys["worker-0"], "m"))
+            for _ in range(2)
+        ]
+        crashed[0].start()
+        while "worker-0" not in pool._restarting:
+            time.sleep(0.01)
+        crashed[1].start()
+
+        other = threading.Thread(target=pool.submit, args=(keys["worker-1"], "m"))
+        other.start()
+        other.join(2)
+        assert not other.is_alive(), "other workers keep receiving requests"
+        assert inboxes["worker-1"].qsize() == 1
+        assert inboxes["worker-0"].empty()
+
+        pool._ready["worker-0"].set()
+        for thread in crashed:
+            thread.join(5)
+        assert inboxes["worker-0"].qsize() == 2
+        assert not pool._restarting
+    finally:
+        pool._processes.clear()
+        pool.close()
@@ -0,0 +1,52 @@
+from collections.abc import Iterator
+
+import pytest
+
+from app import config, slack_worker
+from app.utils import usage
+from app.utils.answer_cache import AnswerCache, is_context_dependent
+
+
+@pytest.fixture
+def answer_cache(monkeypatch: pytest.MonkeyPatch) -> Iterator[AnswerCache]:
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    cache = AnswerCache()
+    monkeypatch.setattr(slack_worker, "answer_cache", cache)
+    yield cache
+    usage.configure()
+
+
+@pytest.mark.asyncio
+async def test_budget_rejections_are_not_cached(answer_cache: AnswerCache) -> None:
+    """Only answers produced normally are shared through the answer cache."""
+    usage.configure(budget_tokens=1, budget_action="reject")
+    session_id = await slack_worker.get_or_create_session("U1")
+
+    answer = await slack_worker.process_with_agent("U1", session_id, "Pythonとは？")
+    assert answer != usage.BUDGET_EXCEEDED_MESSAGE
+    assert answer_cache.lookup("Pythonとは？", answer_cache.prompt_version) is not None
+
+    # 会話の途中の質問はもともとキャッシュしないので、新しいセッションで確かめる
+    fresh = await slack_worker.session_service.create_session(
+        app_name=slack_worker.APP_NAME, user_id="U1"
+    )
+    rejected = await slack_worker.process_with_agent("U1", fresh.id, "Rustとは？")
+    assert rejected == usage.BUDGET_EXCEEDED_MESSAGE
+    assert answer_cache.lookup("Rustとは？", answer_cache.prompt_version) is None
+
+
+@pytest.mark.asyncio
+async def test_questions_after_earlier_turns_are_not_shared(
+    answer_cache: AnswerCache,
+) -> None:
+    """A question that looks context-free can still depend on what the user said before."""
+    assert not is_context_dependent("天気は？")
+    session_id = await slack_worker.get_or_create_session("U2")
+    await slack_worker.process_with_agent("U2", session_id, "大阪に住んでいます")
+    await slack_worker.process_with_agent("U2", session_id, "天気は？")
+    assert answer_cache.lookup("天気は？", answer_cache.prompt_version) is None
+
+    # 他のユーザーの最初の質問は、会話の途中の回答を受け取らずにモデルに送られる
+    session_id = await slack_worker.get_or_create_session("U3")
+    await slack_worker.process_with_agent("U3", session_id, "天気は？")
+    assert answer_cache.stats.hits == 0
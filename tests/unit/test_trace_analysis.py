@@ -0,0 +1,160 @@
+import json
+import random
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from app.trace_analysis import (
+    LogHistogram,
+    Report,
+    Span,
+    TraceAssembler,
+    analyze,
+    analyze_trace,
+    compare,
+    parse_span,
+)
+
+EPOCH = 1_700_000_000
+
+
+def record(
+    name: str,
+    span_id: str,
+    parent: str | None,
+    start: float,
+    end: float,
+    trace: str = "t1",
+) -> dict:
+    """A span in the shape CloudTraceLoggingSpanExporter logs (ReadableSpan.to_json)."""
+    return {
+        "name": name,
+        "context": {"trace_id": f"0x{trace}", "span_id": f"0x{span_id}"},
+        "parent_id": f"0x{parent}" if parent else None,
+        "start_time": int((EPOCH + start) * 1e9),
+        "end_time": int((EPOCH + end) * 1e9),
+        "attributes": {},
+    }
+
+
+def invocation(trace: str = "t1", search: float = 3.0) -> list[dict]:
+    return [
+        record("invocation", "1", None, 0.0, 5.0 + search, trace),
+        record("call_llm", "2", "1", 0.5, 1.5, trace),
+        # 並列に実行された2つのツールのうち、遅い方だけがクリティカルパスに乗る
+        record("execute_tool get_weather", "3", "1", 1.5, 2.0, trace),
+        record("execute_tool search_agent", "4", "1", 1.5, 1.5 + search, trace),
+        record("call_llm", "5", "4", 1.6, 1.4 + search, trace),
+        record("call_llm", "6", "1", 2.0 + search, 4.5 + search, trace),
+    ]
+
+
+def span_of(record: dict[str, Any]) -> Span:
+    parsed = parse_span(record)
+    assert parsed is not None
+    return parsed[1]
+
+
+def spans_of(records: list[dict[str, Any]]) -> list[Span]:
+    return [span_of(r) for r in records]
+
+
+def test_self_time_and_critical_path() -> None:
+    (result,) = analyze_trace("t1", spans_of(invocation()))
+    assert result.seconds == pytest.approx(8.0)
+    assert result.self_time["model_call"] == pytest.approx(3.5)
+    assert result.self_time["search_agent/model_call"] == pytest.approx(2.8)
+    assert result.self_time["search_agent"] == pytest.approx(0.2)
+    assert result.self_time["tool:get_weather"] == pytest.approx(0.5)
+
+    critical = result.critical_by_stage()
+    assert "tool:get_weather" not in critical
+    assert critical["search_agent/model_call"] == pytest.approx(2.8)
+    assert sum(critical.values()) == pytest.approx(result.seconds)
+    assert [label for label, _ in result.critical][:3] == [
+        "agent",
+        "model_call",
+        "search_agent",
+    ]
+
+
+def test_log_entries_and_iso_timestamps_are_parsed() -> None:
+    entry = {
+        "jsonPayload": {
+            "name": "call_llm",
+            "trace": "projects/p/traces/ABC123",
+            "span_id": "00ff",
+            "parent_id": None,
+            "start_time": "2025-01-01T00:00:00.250000Z",
+            "end_time": "2025-01-01T00:00:01.000000Z",
+        },
+        "trace": "projects/p/traces/abc123",
+    }
+    parsed = parse_span(entry)
+    assert parsed is not None
+    trace_id, span = parsed
+    assert (trace_id, span.span_id) == ("abc123", "00ff")
+    assert span.end - span.start == pytest.approx(0.75)
+    assert parse_span({"textPayload": "not a span"}) is None
+
+
+def test_streaming_file_with_interleaved_traces(tmp_path: Path) -> None:
+    rng = random.Random(0)
+    lines = [
+        r
+        for trace in ("a", "b", "c")
+        for r in invocation(trace, search=rng.uniform(1, 4))
+    ]
+    rng.shuffle(lines)
+    path = tmp_path / "spans.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in lines) + "\nnot json\n")
+
+    report, stats = analyze([str(path)])
+    assert report.invocations == 3 and report.spans == 18
+    assert stats == {"skipped": 1, "forced": 0}
+    assert report.self_time["model_call"].count == 3
+
+
+def test_assembler_bounds_open_traces() -> None:
+    assembler = TraceAssembler(grace=10.0, max_open=2)
+    done = []
+    for i, trace in enumerate("abcd"):
+        done += [
+            t
+            for t, _ in assembler.add(trace, span_of(record("x", "1", None, i, i + 1)))
+        ]
+    assert done == ["a", "b"] and assembler.forced == 2
+
+    assembler = TraceAssembler(grace=10.0)
+    assert not list(assembler.add("a", span_of(record("x", "1", None, 0, 1))))
+    assert [
+        t for t, _ in assembler.add("b", span_of(record("x", "1", None, 20, 21)))
+    ] == ["a"]
+
+
+def test_histogram_quantiles_are_within_relative_accuracy() -> None:
+    rng = random.Random(1)
+    values = sorted(rng.lognormvariate(0, 1) for _ in range(10000))
+    histogram = LogHistogram()
+    for value in values:
+        histogram.add(value)
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert histogram.quantile(q) == pytest.approx(exact, rel=0.02)
+    restored = LogHistogram.from_dict(json.loads(json.dumps(histogram.to_dict())))
+    assert restored.quantile(0.99) == histogram.quantile(0.99)
+
+
+def test_compare_reports_regressed_stages() -> None:
+    def report(search: float) -> Report:
+        result = Report()
+        for i in range(20):
+            for item in analyze_trace(str(i), spans_of(invocation(str(i), search))):
+                result.add(item)
+        return result
+
+    baseline = Report.from_dict(json.loads(json.dumps(report(3.0).to_dict())))
+    regressions = compare(baseline, report(4.0))
+    assert {r.stage for r in regressions} == {"total", "search_agent/model_call"}
+    assert not compare(baseline, report(3.0))
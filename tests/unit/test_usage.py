@@ -0,0 +1,111 @@
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from app import config
+from app.agent import create_agents
+from app.utils import usage
+from app.utils.langfuse import LangfuseClient
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setattr(config, "USE_FAKE_MODEL", True)
+    yield
+    usage.configure()
+
+
+async def _ask(user_id: str, text: str) -> str:
+    agent = create_agents(LangfuseClient(public_key="", secret_key="", host=""))
+    session_service = InMemorySessionService()
+    session = await session_service.create_session(app_name="test", user_id=user_id)
+    runner = Runner(agent=agent, app_name="test", session_service=session_service)
+    reply = ""
+    async for event in runner.run_async(
+        user_id=user_id,
+        session_id=session.id,
+        new_message=types.Content(role="user", parts=[types.Part.from_text(text=text)]),
+    ):
+        if event.is_final_response() and event.content and event.content.parts:
+            reply += "".join(part.text or "" for part in event.content.parts)
+    return reply
+
+
+@pytest.mark.asyncio
+async def test_usage_includes_nested_search_agent(tmp_path: Path) -> None:
+    """Tokens used by the nested search_agent are attributed to the calling user."""
+    tracker = usage.configure(store_path=str(tmp_path / "usage.sqlite3"))
+
+    await _ask("alice", "Please search the latest news")
+
+    keys = {(user, version) for user, _, _, version in tracker.snapshot()}
+    assert ("alice", "root_agent_instruction:fallback") in keys
+    assert ("alice", "search_agent_instruction:fallback") in keys
+
+    tracker.flush()
+    assert tracker.snapshot() == {}
+    assert tracker.store is not None
+    totals = tracker.store.totals_by("user_id")
+    assert totals["alice"] > 0
+
+
+def test_store_is_created_on_first_flush(tmp_path: Path) -> None:
+    """Configuring a store path does not create the database until usage is written."""
+    path = tmp_path / "usage.sqlite3"
+    tracker = usage.configure(store_path=str(path))
+    assert not path.exists()
+    tracker.flush()
+    assert not path.exists()
+
+    with usage.scope("erin", "s"):
+        usage.record(
+            "gemini-2.5-flash",
+            types.GenerateContentResponseUsageMetadata(total_token_count=3),
+        )
+    tracker.flush()
+    assert path.exists()
+
+
+@pytest.mark.asyncio
+async def test_scope_collects_request_totals() -> None:
+    """An explicit scope receives the per-request totals used for the Langfuse generation."""
+    usage.configure()
+    with usage.scope("bob", "slack_bob") as request_usage:
+        await _ask("bob", "東京の天気は？")
+    langfuse_usage = request_usage.as_langfuse_usage()
+    assert (
+        langfuse_usage["total"]
+        == langfuse_usage["input"] + langfuse_usage["output"]
+        > 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_budget_reject() -> None:
+    """Requests are rejected once the user's budget is exhausted."""
+    usage.configure(budget_tokens=1, budget_action="reject")
+    with usage.scope("carol", "s") as first:
+        await _ask("carol", "こんにちは")
+    assert usage.tracker.used_tokens("carol") > 0
+    assert not first.degraded
+    with usage.scope("carol", "s") as second:
+        assert await _ask("carol", "こんにちは") == usage.BUDGET_EXCEEDED_MESSAGE
+    assert second.degraded == {"budget_reject"}
+
+
+@pytest.mark.asyncio
+async def test_budget_downgrade() -> None:
+    """Requests are sent to the downgrade model once the budget is exhausted."""
+    tracker = usage.configure(
+        budget_tokens=1,
+        budget_action="downgrade",
+        downgrade_model="gemini-2.5-flash-lite",
+    )
+    await _ask("dave", "こんにちは")
+    await _ask("dave", "こんにちは")
+    models = {model for user, _, model, _ in tracker.snapshot() if user == "dave"}
+    assert models == {"gemini-2.5-flash", "gemini-2.5-flash-lite"}